@@ -1,25 +1,92 @@
 
-from flask import Flask, render_template, request, redirect, url_for, session, send_from_directory, jsonify, abort, send_file, flash
+from flask import Flask, render_template, request, redirect, url_for, session, send_from_directory, jsonify, abort, send_file, flash, g, Response, has_app_context, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from werkzeug.utils import secure_filename
 import os
 import socket
 from datetime import datetime, timedelta
-from cryptography.fernet import Fernet
 import base64
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, func, event, select, literal, create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.types import TypeDecorator, LargeBinary
 import uuid
-from PIL import Image
+import re
 import io
+import time
+import functools
+import bisect
+import random
+import itertools
+import threading
+from contextlib import contextmanager
+from collections import defaultdict, deque, Counter, namedtuple
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'supersecretkey'  # Change this for production
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chat.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('LANCHAT_DATABASE_URI', 'sqlite:///chat.db')
 app.config['UPLOAD_FOLDER'] = 'static/uploads/'
 app.config['PROFILE_PHOTO_FOLDER'] = 'static/profile_photos/'
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024 * 1024 # 10 GB
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)
+# Per-user Socket.IO budgets: event -> (burst size, sustained events per second)
+app.config['SOCKET_RATE_LIMITS'] = {
+    'send_message': (30, 5),
+    'react_message': (20, 4),
+    'remove_reaction': (20, 4),
+    'typing': (10, 2),
+    'stop_typing': (10, 2),
+    'group_read': (10, 1),
+    'group_deleted': (3, 0.1),
+    'resume': (5, 0.5),
+    'messages_read': (20, 5),
+}
+# How many recent events to keep per user for replay after a reconnect
+app.config['EVENT_REPLAY_BUFFER_SIZE'] = 500
+# /metrics is open to admins and loopback; set a token to let a remote scraper in
+app.config['METRICS_TOKEN'] = os.environ.get('LANCHAT_METRICS_TOKEN')
+# Opt-in per-request SQL profiling: query counts, DB time and repeated-statement (N+1) warnings
+app.config['SQL_PROFILING'] = os.environ.get('LANCHAT_SQL_PROFILING') == '1'
+# Warn when one statement fingerprint runs more than this many times in a single request/event
+app.config['SQL_PROFILING_REPEAT_THRESHOLD'] = int(os.environ.get('LANCHAT_SQL_REPEAT_THRESHOLD', 10))
+# How many recent request/event summaries /api/admin/sql_profile keeps
+app.config['SQL_PROFILING_HISTORY'] = 200
+# Share of requests/Socket.IO events traced into TRACE_FILE (0 disables tracing, 1 traces everything)
+app.config['TRACE_SAMPLE_RATE'] = float(os.environ.get('LANCHAT_TRACE_SAMPLE_RATE', 0))
+app.config['TRACE_FILE'] = os.environ.get('LANCHAT_TRACE_FILE', 'traces.jsonl')
+# Fernet key for message/password encryption; generated on first use if missing
+app.config['KEY_FILE'] = os.environ.get('LANCHAT_KEY_FILE', 'instance/chat.key')
+# Socket.IO server mode; 'threading' avoids loading eventlet for scripts and tests
+app.config['SOCKETIO_ASYNC_MODE'] = os.environ.get('LANCHAT_ASYNC_MODE', 'eventlet')
+# Cipher for new message content: 'aesgcm' (raw bytes, versioned header) or 'fernet' (legacy tokens)
+app.config['MESSAGE_CIPHER'] = os.environ.get('LANCHAT_MESSAGE_CIPHER', 'aesgcm')
+# AES-GCM message keys; the newest is primary, older ones only decrypt until re-encryption catches up
+app.config['KEYRING_FILE'] = os.environ.get('LANCHAT_KEYRING_FILE', 'instance/chat.keyring')
+# Background re-encryption: rows per batch and pause between batches so chat traffic keeps flowing
+app.config['REENCRYPT_BATCH_SIZE'] = 500
+app.config['REENCRYPT_PAUSE'] = 0.05
+# Most messages one admin content search (/api/admin/messages?q=) decrypts per request
+app.config['ADMIN_MESSAGE_SCAN_LIMIT'] = 5000
+# Messages older than this many days move to per-month archive files (archive.py); pinned ones stay
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('LANCHAT_ARCHIVE_AFTER_DAYS', 180))
+app.config['ARCHIVE_FOLDER'] = os.environ.get('LANCHAT_ARCHIVE_FOLDER', 'instance/archive')
+app.config['ARCHIVE_BATCH_SIZE'] = 1000
+# Group/user deletions run in the background: rows per batch and pause between batches
+app.config['DELETION_BATCH_SIZE'] = 500
+app.config['DELETION_PAUSE'] = 0.05
+# Orphan file collection: unreferenced uploads/photos older than the grace period move to quarantine,
+# and quarantined files are purged after ORPHAN_PURGE_AFTER_DAYS (gc_files.py)
+app.config['ORPHAN_QUARANTINE_FOLDER'] = os.environ.get('LANCHAT_QUARANTINE_FOLDER', 'instance/quarantine')
+app.config['ORPHAN_GRACE_HOURS'] = 1
+app.config['ORPHAN_PURGE_AFTER_DAYS'] = int(os.environ.get('LANCHAT_ORPHAN_PURGE_AFTER_DAYS', 7))
+app.config['ORPHAN_SCAN_BATCH_SIZE'] = 500
+# History import (import_history.py): messages per transaction and encryption worker processes (0 = in-process)
+app.config['IMPORT_BATCH_SIZE'] = 2000
+app.config['IMPORT_WORKERS'] = int(os.environ.get('LANCHAT_IMPORT_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+# Most users one /api/groups/<id>/members/bulk request may add, remove or re-role
+app.config['GROUP_BULK_LIMIT'] = 1000
+# Seconds a cached user identity (admin flag, profile photo) is used before User is read again
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('LANCHAT_IDENTITY_CACHE_TTL', 60))
 
 # Force no-cache for dynamic pages so re-click always fetches fresh HTML
 @app.after_request
@@ -30,9 +97,11 @@ def add_no_cache_headers(response):
     return response
 
 def get_or_create_key():
-    key_file = 'instance/chat.key'
-    if not os.path.exists('instance'):
-        os.makedirs('instance')
+    from cryptography.fernet import Fernet
+    key_file = app.config['KEY_FILE']
+    key_dir = os.path.dirname(key_file)
+    if key_dir and not os.path.exists(key_dir):
+        os.makedirs(key_dir)
     if os.path.exists(key_file):
         with open(key_file, 'rb') as f:
             return f.read()
@@ -41,57 +110,250 @@ def get_or_create_key():
         with open(key_file, 'wb') as f:
             f.write(key)
         return key
- 
-# Initialize Fernet cipher
-FERNET_KEY = get_or_create_key()
-cipher_suite = Fernet(FERNET_KEY)
+
+# Fernet cipher, created on first use so importing the app touches no key file
+_cipher_suite = None
+
+def get_cipher():
+    global _cipher_suite
+    if _cipher_suite is None:
+        from cryptography.fernet import Fernet
+        _cipher_suite = Fernet(get_or_create_key())
+    return _cipher_suite
 
 # Password helpers
 
 def get_decrypted_password(user):
+    inc_counter('lanchat_crypto_operations_total', labels=(('cipher', 'fernet'), ('op', 'decrypt')))
     token = user.password
     if isinstance(token, str):
         token = token.encode('utf-8')
-    return cipher_suite.decrypt(token).decode('utf-8')
+    with trace_span('fernet.decrypt_password', 'crypto'):
+        return get_cipher().decrypt(token).decode('utf-8')
 
 
 def set_encrypted_password(user, plain):
     """Encrypt and persist password as UTF-8 string (not bytes) for consistency."""
-    token = cipher_suite.encrypt(plain.encode('utf-8'))  # returns bytes
+    inc_counter('lanchat_crypto_operations_total', labels=(('cipher', 'fernet'), ('op', 'encrypt')))
+    with trace_span('fernet.encrypt_password', 'crypto'):
+        token = get_cipher().encrypt(plain.encode('utf-8'))  # returns bytes
     if isinstance(token, bytes):
         token = token.decode('utf-8')  # store URL-safe base64 string
     user.password = token
 
+# --- Identity cache ---
+# username -> (UserIdentity, monotonic expiry). Entries live IDENTITY_CACHE_TTL
+# seconds; promote, demote, delete and profile photo changes drop them at once
+# through invalidate_identity().
+identity_cache = {}
+
+UserIdentity = namedtuple('UserIdentity', 'id username is_admin profile_photo')
+
+def get_identity(username):
+    """Cached UserIdentity for username, or None if there is no such user."""
+    if not username:
+        return None
+    entry = identity_cache.get(username)
+    now = time.monotonic()
+    hit = entry is not None and entry[1] > now
+    count_cache_lookup('identity', hit)
+    if hit:
+        return entry[0]
+    row = db.session.query(User.id, User.username, User.is_admin, User.profile_photo).filter_by(username=username).first()
+    if row is None:
+        identity_cache.pop(username, None)
+        return None
+    identity = UserIdentity(row.id, row.username, bool(row.is_admin), row.profile_photo)
+    identity_cache[username] = (identity, now + app.config['IDENTITY_CACHE_TTL'])
+    return identity
+
+def invalidate_identity(username):
+    identity_cache.pop(username, None)
+
+@app.template_global()
+def current_user_is_admin():
+    """Whether the logged-in user is an admin now (not when they logged in)."""
+    identity = get_identity(session.get('username'))
+    return bool(identity and identity.is_admin)
+
 # Add Jinja2 filter for profile photos
 @app.template_filter('profile_photo_url')
 def profile_photo_url_filter(username):
     """Jinja2 filter to get profile photo URL."""
-    user = User.query.filter_by(username=username).first()
+    user = get_identity(username)
     if user and user.profile_photo:
         return url_for('serve_profile_photo', filename=user.profile_photo)
     else:
         return url_for('static', filename='img/default_profile.png')
  
+# --- Message cipher (versioned ciphertext) ---
+# Message content is stored as raw bytes. AES-GCM ciphertext carries a two-byte
+# header, version then key id, followed by the 12-byte nonce and ciphertext+tag;
+# the header is also the AEAD associated data. Anything else is a legacy Fernet
+# token (base64 text starting with 'gAAAAA'), still readable through KEY_FILE.
+CIPHER_VERSION_AESGCM = 1
+AESGCM_NONCE_SIZE = 12
+
+class MessageKeyring:
+    """AES-256-GCM message keys by id, persisted in KEYRING_FILE; the primary key encrypts."""
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = {}
+        self.primary = None
+        self._aead = {}
+        if os.path.exists(path):
+            self.load()
+        else:
+            self.rotate()
+
+    def load(self):
+        import json
+        with open(self.path) as f:
+            data = json.load(f)
+        self.keys = {int(key_id): base64.urlsafe_b64decode(key) for key_id, key in data['keys'].items()}
+        self.primary = int(data['primary'])
+        self._aead = {}
+
+    def save(self):
+        import json
+        key_dir = os.path.dirname(self.path)
+        if key_dir and not os.path.exists(key_dir):
+            os.makedirs(key_dir)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'primary': self.primary,
+                       'keys': {str(k): base64.urlsafe_b64encode(v).decode() for k, v in self.keys.items()}}, f)
+        os.replace(tmp_path, self.path)
+
+    def rotate(self):
+        """Add a new primary key; older keys keep decrypting until their rows are re-encrypted."""
+        key_id = max(self.keys, default=0) + 1
+        if key_id > 255:
+            raise ValueError('Keyring is full (255 keys)')
+        self.keys[key_id] = os.urandom(32)
+        self.primary = key_id
+        self.save()
+        return key_id
+
+    def aead(self, key_id):
+        if key_id not in self.keys:
+            self.load()  # rotated by another process (e.g. reencrypt.py)
+        if key_id not in self._aead:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+            self._aead[key_id] = AESGCM(self.keys[key_id])
+        return self._aead[key_id]
+
+class FernetMessageCipher:
+    """Legacy cipher: Fernet tokens (AES-128-CBC + HMAC-SHA256, base64) under KEY_FILE."""
+    name = 'fernet'
+
+    def encrypt(self, data):
+        return get_cipher().encrypt(data)
+
+    def decrypt(self, token):
+        return get_cipher().decrypt(token)
+
+    def is_current(self, token):
+        return not token.startswith(bytes((CIPHER_VERSION_AESGCM,)))
+
+class AesGcmMessageCipher:
+    """AES-256-GCM under the keyring's primary key, stored as raw bytes with a version header."""
+    name = 'aesgcm'
+
+    def __init__(self, keyring):
+        self.keyring = keyring
+
+    def encrypt(self, data):
+        header = bytes((CIPHER_VERSION_AESGCM, self.keyring.primary))
+        nonce = os.urandom(AESGCM_NONCE_SIZE)
+        return header + nonce + self.keyring.aead(self.keyring.primary).encrypt(nonce, data, header)
+
+    def decrypt(self, token):
+        header, nonce = token[:2], token[2:2 + AESGCM_NONCE_SIZE]
+        return self.keyring.aead(token[1]).decrypt(nonce, token[2 + AESGCM_NONCE_SIZE:], header)
+
+    def is_current(self, token):
+        return token[:2] == bytes((CIPHER_VERSION_AESGCM, self.keyring.primary))
+
+MESSAGE_CIPHERS = {'fernet': FernetMessageCipher, 'aesgcm': AesGcmMessageCipher}
+_message_ciphers = {}
+_message_keyring = None
+
+def get_message_keyring():
+    global _message_keyring
+    if _message_keyring is None:
+        _message_keyring = MessageKeyring(app.config['KEYRING_FILE'])
+    return _message_keyring
+
+def get_message_cipher(name=None):
+    """Cipher instance by name, defaulting to MESSAGE_CIPHER (the one new content is written with)."""
+    name = name or app.config['MESSAGE_CIPHER']
+    if name not in _message_ciphers:
+        if name not in MESSAGE_CIPHERS:
+            raise ValueError(f'Unknown message cipher: {name}')
+        cls = MESSAGE_CIPHERS[name]
+        _message_ciphers[name] = cls(get_message_keyring()) if cls is AesGcmMessageCipher else cls()
+    return _message_ciphers[name]
+
+def cipher_for_token(token):
+    """Pick the cipher a stored value was written with from its header."""
+    return get_message_cipher('aesgcm' if token[:1] == bytes((CIPHER_VERSION_AESGCM,)) else 'fernet')
+
 def encrypt_message(message):
     if not message:
         return message
-    return cipher_suite.encrypt(message.encode()).decode()
+    cipher = get_message_cipher()
+    inc_counter('lanchat_crypto_operations_total', labels=(('cipher', cipher.name), ('op', 'encrypt')))
+    with trace_span(f'{cipher.name}.encrypt', 'crypto'):
+        return cipher.encrypt(message.encode())
  
 def decrypt_message(encrypted_message):
     if not encrypted_message:
         return encrypted_message
+    if isinstance(encrypted_message, str):
+        encrypted_message = encrypted_message.encode()
+    cipher = cipher_for_token(encrypted_message)
+    inc_counter('lanchat_crypto_operations_total', labels=(('cipher', cipher.name), ('op', 'decrypt')))
     try:
-        return cipher_suite.decrypt(encrypted_message.encode()).decode()
+        with trace_span(f'{cipher.name}.decrypt', 'crypto'):
+            return cipher.decrypt(encrypted_message).decode()
     except:
         return "Message decryption failed"
+
+def reencrypt_message(token):
+    """Rewrite stored ciphertext under the current cipher and primary key; None if already current."""
+    if isinstance(token, str):
+        token = token.encode()
+    current = get_message_cipher()
+    if cipher_for_token(token) is current and current.is_current(token):
+        return None
+    return current.encrypt(cipher_for_token(token).decrypt(token))
+
+class CipherText(TypeDecorator):
+    """Encrypted message content as raw bytes.
+
+    Columns created before the switch are TEXT holding Fernet strings; SQLite
+    stores the new BLOB values in them unchanged, and both kinds read back as bytes.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return value.encode() if isinstance(value, str) else value
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            return value.encode() if isinstance(value, str) else value
+        return process
  
  
 
 ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'gif', 'bmp', 'mp4', 'webm', 'mov', 'avi', 'mkv', 'zip', 'rar', '7z', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'csv', 'mp3', 'wav', 'ogg', 'svg', 'heic', 'jfif', 'py','ipynb','html','css','js','json','xml','yaml','yml','md','markdown','exe','apk','iso','tar', 'msi'}
 
-db = SQLAlchemy(app)
-# Use eventlet for async_mode (required for Flask-SocketIO real-time features)
-socketio = SocketIO(app, async_mode='eventlet')
+# Extensions are bound to the app in create_app(), so importing this module starts nothing
+db = SQLAlchemy()
+socketio = SocketIO()
 
 # --- Database Models ---
 
@@ -132,13 +394,15 @@ class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender = db.Column(db.String(80), nullable=False)
     recipients = db.Column(db.String(255), nullable=False)  # comma-separated usernames or 'all'
-    content = db.Column(db.Text, nullable=True)
+    content = db.Column(CipherText, nullable=True)  # see encrypt_message/decrypt_message
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=True)
     status = db.Column(db.String(20), default='sent')  # 'sent' or 'read'
     reply_to = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=True)  # New: replied message id
     reactions = db.Column(db.Text, nullable=True)  # New: JSON string of reactions
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True)  # New: group message support
+    # Conversations are read newest first by (timestamp, id); see read_through
+    __table_args__ = (db.Index('ix_message_timestamp', 'timestamp', 'id'),)
     
     def __init__(self, sender, recipients, content=None, file_id=None, status='sent', reply_to=None, reactions=None, group_id=None):
         self.sender = sender
@@ -159,6 +423,17 @@ class HiddenMessage(db.Model):
         db.UniqueConstraint('msg_id', 'username', name='uniq_msg_user_hide'),
     )
 
+class ChatClear(db.Model):
+    """Per-user "clear chat" watermark: messages up to cleared_before are hidden from that user."""
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), db.ForeignKey('user.username'), nullable=False)
+    conversation = db.Column(db.String(255), nullable=False)  # other user's name or 'group-<id>'
+    cleared_before = db.Column(db.Integer, nullable=False)  # highest message id hidden
+    cleared_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.UniqueConstraint('username', 'conversation', name='uniq_chat_clear'),
+    )
+
 class File(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
@@ -221,6 +496,422 @@ class PasswordResetRequest(db.Model):
 # --- In-memory set to track online users ---
 online_users = set()
 
+# --- Missed-event replay ---
+class UserEventLog:
+    """Bounded per-user ring buffers of sequenced events, replayed after a reconnect.
+
+    Sequence numbers come from one counter, so every user's stream is strictly
+    increasing. The epoch changes on every restart, which tells clients that
+    sequence numbers they remember from an older process are meaningless.
+    """
+
+    def __init__(self, maxlen):
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        self.maxlen = maxlen
+        self.buffers = {}   # username -> deque of (seq, event, payload)
+        self.evicted = {}   # username -> highest seq pushed out of that user's buffer
+
+    def record(self, usernames, event, payload):
+        """Stamp payload with the next sequence number and buffer it for each user."""
+        self.seq += 1
+        payload['seq'] = self.seq
+        for username in usernames:
+            buf = self.buffers.get(username)
+            if buf is None:
+                buf = self.buffers[username] = deque(maxlen=self.maxlen)
+            if len(buf) == buf.maxlen:
+                self.evicted[username] = buf[0][0]
+            buf.append((self.seq, event, payload))
+        return self.seq
+
+    def since(self, username, last_seq):
+        """Events after last_seq, or None when some of them were already evicted."""
+        if last_seq > self.seq or last_seq < self.evicted.get(username, 0):
+            return None
+        return [
+            {'seq': seq, 'event': event, 'data': payload}
+            for seq, event, payload in self.buffers.get(username, ())
+            if seq > last_seq
+        ]
+
+user_event_log = UserEventLog(app.config['EVENT_REPLAY_BUFFER_SIZE'])
+
+# --- Socket.IO rate limiting ---
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.last_notice = 0.0
+
+    def consume(self, tokens=1):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def retry_after(self, tokens=1):
+        """Seconds until `tokens` are available again."""
+        if self.rate <= 0:
+            return None
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+# (user or sid, event) -> TokenBucket
+socket_rate_buckets = {}
+# event -> {'allowed': n, 'dropped': n}
+socket_rate_limit_stats = defaultdict(lambda: {'allowed': 0, 'dropped': 0})
+
+def rate_limited(event_name):
+    """Drop a Socket.IO event when the sender exceeds its budget for that event.
+
+    Budgets come from app.config['SOCKET_RATE_LIMITS'] and are tracked per user
+    (shared across that user's tabs), falling back to the socket id for
+    anonymous connections. Dropped events get a throttled 'rate_limited' reply.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            limit = app.config.get('SOCKET_RATE_LIMITS', {}).get(event_name)
+            if not limit:
+                return f(*args, **kwargs)
+            key = (session.get('username') or request.sid, event_name)
+            bucket = socket_rate_buckets.get(key)
+            if bucket is None or (bucket.capacity, bucket.rate) != tuple(limit):
+                bucket = socket_rate_buckets[key] = TokenBucket(*limit)
+            stats = socket_rate_limit_stats[event_name]
+            if bucket.consume():
+                stats['allowed'] += 1
+                return f(*args, **kwargs)
+            stats['dropped'] += 1
+            # Tell the client at most once per second so the error path can't flood either
+            now = time.monotonic()
+            if now - bucket.last_notice >= 1.0:
+                bucket.last_notice = now
+                retry_after = bucket.retry_after()
+                emit('rate_limited', {
+                    'event': event_name,
+                    'error': 'You are doing that too fast. Please slow down.',
+                    'retry_after': round(retry_after, 2) if retry_after is not None else None
+                })
+        return wrapper
+    return decorator
+
+# --- Metrics (Prometheus text format, served at /metrics) ---
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+class Histogram:
+    """Fixed-bucket histogram with one series per label tuple."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}  # labels -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+# name -> (type, help); every exported metric is declared here
+METRIC_HELP = {
+    'lanchat_http_request_duration_seconds': ('histogram', 'HTTP request latency by route.'),
+    'lanchat_socketio_event_duration_seconds': ('histogram', 'Socket.IO event handler latency.'),
+    'lanchat_emit_fanout_recipients': ('histogram', 'Number of users a tracked emit was addressed to.'),
+    'lanchat_db_queries_total': ('counter', 'SQL statements executed.'),
+    'lanchat_db_query_seconds_total': ('counter', 'Time spent executing SQL statements.'),
+    'lanchat_crypto_operations_total': ('counter', 'Message and password encrypt/decrypt calls by cipher.'),
+    'lanchat_upload_bytes_total': ('counter', 'Bytes received through /upload.'),
+    'lanchat_socketio_rate_limit_events_total': ('counter', 'Socket.IO events checked by the rate limiter.'),
+    'lanchat_cache_lookups_total': ('counter', 'In-process cache lookups by cache and result (hit or miss).'),
+    'lanchat_cache_hit_ratio': ('gauge', 'Share of lookups each in-process cache answered since start.'),
+    'lanchat_upload_bytes_per_second': ('gauge', 'Upload throughput averaged over the last minute.'),
+    'lanchat_connected_sockets': ('gauge', 'Currently connected Socket.IO clients.'),
+    'process_resident_memory_bytes': ('gauge', 'Resident memory of the server process.'),
+}
+
+http_request_latency = Histogram(LATENCY_BUCKETS)   # (method, route, status)
+socket_event_latency = Histogram(LATENCY_BUCKETS)   # (event,)
+emit_fanout = Histogram(FANOUT_BUCKETS)             # (event,)
+metric_counters = defaultdict(float)                # (name, labels) -> value
+connected_sockets = 0
+upload_window = deque()                             # (monotonic time, bytes) over the last minute
+
+def inc_counter(name, value=1, labels=()):
+    """Add to a counter; labels is a tuple of (label, value) pairs."""
+    metric_counters[(name, labels)] += value
+
+def count_cache_lookup(cache, hit):
+    inc_counter('lanchat_cache_lookups_total', labels=(('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+def cache_hit_ratios():
+    """{labels: hits / lookups} per cache, from lanchat_cache_lookups_total."""
+    totals = defaultdict(lambda: [0.0, 0.0])
+    for (name, labels), value in list(metric_counters.items()):
+        if name == 'lanchat_cache_lookups_total':
+            counts = totals[labels[:1]]
+            counts[0] += value if labels[1][1] == 'hit' else 0
+            counts[1] += value
+    return {labels: round(hits / lookups, 4) for labels, (hits, lookups) in totals.items() if lookups}
+
+def observe_upload(num_bytes):
+    inc_counter('lanchat_upload_bytes_total', num_bytes)
+    upload_window.append((time.monotonic(), num_bytes))
+
+def upload_bytes_per_second(window=60.0):
+    cutoff = time.monotonic() - window
+    while upload_window and upload_window[0][0] < cutoff:
+        upload_window.popleft()
+    return sum(n for _, n in upload_window) / window
+
+def process_rss_bytes():
+    """Resident set size from /proc where available, else None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError, IndexError):
+        return None
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start
+    inc_counter('lanchat_db_queries_total')
+    inc_counter('lanchat_db_query_seconds_total', elapsed)
+    if app.config['SQL_PROFILING'] and has_app_context():
+        profile = g.get('_sql_profile')
+        if profile is not None:
+            profile.record(statement, elapsed)
+    if app.config['TRACE_SAMPLE_RATE'] and has_app_context():
+        trace = g.get('_trace')
+        if trace is not None:
+            end = trace.now_us()
+            trace.add('db.execute', 'db', end - elapsed * 1e6, end, {'statement': statement[:200]})
+
+def observe_socket_event(event_name):
+    """Time a Socket.IO handler into lanchat_socketio_event_duration_seconds."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            if app.config['SQL_PROFILING']:
+                g._sql_profile = SqlProfile(f'socket {event_name}')
+            start_trace(f'socket {event_name}')
+            try:
+                return f(*args, **kwargs)
+            finally:
+                socket_event_latency.observe((event_name,), time.perf_counter() - start)
+                profile = g.pop('_sql_profile', None)
+                if profile is not None:
+                    profile.finish()
+                finish_trace()
+        return wrapper
+    return decorator
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+def _render_histogram(lines, name, histogram, label_names):
+    for labels, series in sorted(histogram.series.items()):
+        pairs = tuple(zip(label_names, labels))
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float('inf'),), series[:-1]):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{_format_labels(pairs + (("le", le),))} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(pairs)} {series[-1]}')
+        lines.append(f'{name}_count{_format_labels(pairs)} {cumulative}')
+
+def render_metrics():
+    """Render every metric in the Prometheus text exposition format."""
+    for event_name, counts in list(socket_rate_limit_stats.items()):
+        for outcome, value in counts.items():
+            metric_counters[('lanchat_socketio_rate_limit_events_total',
+                             (('event', event_name), ('outcome', outcome)))] = value
+    gauges = {
+        'lanchat_connected_sockets': connected_sockets,
+        'lanchat_upload_bytes_per_second': upload_bytes_per_second(),
+        'process_resident_memory_bytes': process_rss_bytes(),
+        'lanchat_cache_hit_ratio': cache_hit_ratios(),
+    }
+    histograms = {
+        'lanchat_http_request_duration_seconds': (http_request_latency, ('method', 'route', 'status')),
+        'lanchat_socketio_event_duration_seconds': (socket_event_latency, ('event',)),
+        'lanchat_emit_fanout_recipients': (emit_fanout, ('event',)),
+    }
+    lines = []
+    for name, (kind, help_text) in METRIC_HELP.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            _render_histogram(lines, name, *histograms[name])
+        elif kind == 'gauge':
+            if isinstance(gauges.get(name), dict):
+                for labels, value in sorted(gauges[name].items()):
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            elif gauges.get(name) is not None:
+                lines.append(f'{name} {gauges[name]}')
+        else:
+            for (counter, labels), value in sorted(metric_counters.items()):
+                if counter == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+@app.before_request
+def start_request_timer():
+    g._request_start = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if app.config['SQL_PROFILING']:
+        g._sql_profile = SqlProfile(f'{request.method} {route}')
+    start_trace(f'{request.method} {route}')
+
+@app.after_request
+def record_request_latency(response):
+    start = g.pop('_request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_latency.observe((request.method, route, str(response.status_code)), time.perf_counter() - start)
+    profile = g.pop('_sql_profile', None)
+    if profile is not None:
+        summary = profile.finish()
+        response.headers['X-SQL-Queries'] = str(summary['queries'])
+        response.headers['X-SQL-Time-Ms'] = str(summary['db_ms'])
+    finish_trace(path=request.path, status=response.status_code)
+    return response
+
+# --- Request tracing (sampled, see TRACE_SAMPLE_RATE) ---
+# Each sampled request or Socket.IO event becomes a tree of Chrome trace-event
+# "X" spans (one tid per trace) appended to TRACE_FILE as JSON lines. Convert
+# them with trace_export.py and open the result in Perfetto or chrome://tracing.
+trace_ids = itertools.count(1)
+trace_file_lock = threading.Lock()
+
+class Trace:
+    """Timed spans collected for one sampled request or Socket.IO event."""
+
+    def __init__(self, name):
+        self.name = name
+        self.id = uuid.uuid4().hex[:16]
+        self.tid = next(trace_ids)
+        self.events = []
+        self._wall = time.time()
+        self._start = time.perf_counter()
+        self.start_us = self.now_us()
+
+    def now_us(self):
+        """Wall-clock microseconds, monotonic within the trace."""
+        return (self._wall + time.perf_counter() - self._start) * 1e6
+
+    def add(self, name, category, start_us, end_us, args=None):
+        self.events.append({
+            'name': name, 'cat': category, 'ph': 'X', 'ts': round(start_us, 1),
+            'dur': round(end_us - start_us, 1), 'pid': os.getpid(), 'tid': self.tid,
+            'args': dict(args or {}, trace_id=self.id),
+        })
+
+def start_trace(name):
+    """Begin a trace for the current request/event if it is sampled."""
+    rate = app.config['TRACE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        g._trace = Trace(name)
+
+def finish_trace(**args):
+    """Close the root span and append the whole trace to TRACE_FILE."""
+    import json
+    trace = g.pop('_trace', None)
+    if trace is None:
+        return
+    trace.add(trace.name, 'request', trace.start_us, trace.now_us(), args)
+    lines = ''.join(json.dumps(e, default=str) + '\n' for e in trace.events)
+    try:
+        with trace_file_lock, open(app.config['TRACE_FILE'], 'a', encoding='utf-8') as f:
+            f.write(lines)
+    except OSError as e:
+        print(f"Error writing trace: {e}")
+
+@contextmanager
+def trace_span(name, category='app', **args):
+    """Time the enclosed block as a span of the current trace; a no-op when not sampled."""
+    trace = g.get('_trace') if has_app_context() else None
+    if trace is None:
+        yield
+        return
+    start = trace.now_us()
+    try:
+        yield
+    finally:
+        trace.add(name, category, start, trace.now_us(), args)
+
+# --- SQL profiling (opt-in, see SQL_PROFILING) ---
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_PLACEHOLDER_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+def sql_fingerprint(statement):
+    """Collapse literals, IN-lists and whitespace so repeats of one query share a key."""
+    statement = _SQL_LITERAL_RE.sub('?', ' '.join(statement.split()))
+    return _SQL_PLACEHOLDER_LIST_RE.sub('(?, ...)', statement)
+
+sql_profile_recent = deque(maxlen=app.config['SQL_PROFILING_HISTORY'])
+sql_profile_totals = defaultdict(lambda: {'count': 0, 'queries': 0, 'db_ms': 0.0, 'repeat_warnings': 0})
+
+class SqlProfile:
+    """SQL statements run while handling one HTTP request or Socket.IO event."""
+
+    def __init__(self, label):
+        self.label = label
+        self.queries = 0
+        self.seconds = 0.0
+        self.fingerprints = Counter()
+        self.fingerprint_seconds = defaultdict(float)
+
+    def record(self, statement, elapsed):
+        fingerprint = sql_fingerprint(statement)
+        self.queries += 1
+        self.seconds += elapsed
+        self.fingerprints[fingerprint] += 1
+        self.fingerprint_seconds[fingerprint] += elapsed
+
+    def finish(self):
+        """Warn about repeated statements and store the summary for the admin page."""
+        threshold = app.config['SQL_PROFILING_REPEAT_THRESHOLD']
+        repeated = [
+            {'statement': fp, 'count': count, 'db_ms': round(self.fingerprint_seconds[fp] * 1000, 2)}
+            for fp, count in self.fingerprints.most_common() if count > 1
+        ]
+        flagged = [r for r in repeated if r['count'] > threshold]
+        for r in flagged:
+            print(f"[WARNING] Possible N+1 in {self.label}: statement ran {r['count']} times "
+                  f"({r['db_ms']} ms): {r['statement'][:200]}")
+        summary = {
+            'label': self.label,
+            'at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'queries': self.queries,
+            'db_ms': round(self.seconds * 1000, 2),
+            'repeated': repeated[:5],
+            'repeat_warning': bool(flagged),
+        }
+        sql_profile_recent.append(summary)
+        totals = sql_profile_totals[self.label]
+        totals['count'] += 1
+        totals['queries'] += self.queries
+        totals['db_ms'] += self.seconds * 1000
+        totals['repeat_warnings'] += bool(flagged)
+        return summary
+
 # --- Helper Functions ---
 def allowed_file(filename):
     """Check if the file extension is allowed."""
@@ -256,23 +947,26 @@ def process_profile_photo(file, username):
         filename = f"{username}_{uuid.uuid4().hex[:8]}.{file_extension}"
         filepath = os.path.join(profile_folder, filename)
         
-        # Open and process the image
-        image = Image.open(file.stream)
-        
-        # Convert RGBA to RGB if necessary
-        if image.mode in ('RGBA', 'LA', 'P'):
-            # Create a white background
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            if image.mode == 'P':
-                image = image.convert('RGBA')
-            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-            image = background
-        
-        # Resize image to 300x300 (square aspect ratio)
-        image = image.resize((300, 300), Image.Resampling.LANCZOS)
-        
-        # Save the processed image
-        image.save(filepath, format='JPEG', quality=85, optimize=True)
+        from PIL import Image
+        with trace_span('pillow.profile_photo', 'image'):
+            # Open and process the image
+            image = Image.open(file.stream)
+            
+            # Convert RGBA to RGB if necessary
+            if image.mode in ('RGBA', 'LA', 'P'):
+                # Create a white background
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                if image.mode == 'P':
+                    image = image.convert('RGBA')
+                background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
+                image = background
+            
+            # Resize image to 300x300 (square aspect ratio)
+            image = image.resize((300, 300), Image.Resampling.LANCZOS)
+            
+            # Save the processed image
+            with trace_span('file.write', 'io', path=filepath):
+                image.save(filepath, format='JPEG', quality=85, optimize=True)
         
         return filename, None
         
@@ -281,7 +975,7 @@ def process_profile_photo(file, username):
 
 def get_profile_photo_url(username):
     """Get the profile photo URL for a user."""
-    user = User.query.filter_by(username=username).first()
+    user = get_identity(username)
     if user and user.profile_photo:
         return url_for('serve_profile_photo', filename=user.profile_photo)
     else:
@@ -309,26 +1003,29 @@ def process_group_photo(file, group_name):
         filename = f"group_{group_name}_{uuid.uuid4().hex[:8]}.jpg"
         filepath = os.path.join(group_folder, filename)
         
-        # Open and process the image
-        image = Image.open(file.stream)
-        
-        # Convert RGBA/Palette to RGB if necessary
-        if image.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            if image.mode == 'P':
-                image = image.convert('RGBA')
-            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-            image = background
-        else:
-            # Ensure RGB for JPEG
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-        
-        # Resize image to 300x300 (square aspect ratio)
-        image = image.resize((300, 300), Image.Resampling.LANCZOS)
-        
-        # Save the processed image as JPEG
-        image.save(filepath, format='JPEG', quality=85, optimize=True)
+        from PIL import Image
+        with trace_span('pillow.group_photo', 'image'):
+            # Open and process the image
+            image = Image.open(file.stream)
+            
+            # Convert RGBA/Palette to RGB if necessary
+            if image.mode in ('RGBA', 'LA', 'P'):
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                if image.mode == 'P':
+                    image = image.convert('RGBA')
+                background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
+                image = background
+            else:
+                # Ensure RGB for JPEG
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+            
+            # Resize image to 300x300 (square aspect ratio)
+            image = image.resize((300, 300), Image.Resampling.LANCZOS)
+            
+            # Save the processed image as JPEG
+            with trace_span('file.write', 'io', path=filepath):
+                image.save(filepath, format='JPEG', quality=85, optimize=True)
         
         return filename, None
         
@@ -343,22 +1040,280 @@ def get_group_photo_url(group_id):
     else:
         return url_for('static', filename='img/default_profile.png')
 
+def message_audience(sender, recipients):
+    """Usernames that can see a message sent by `sender` to `recipients`."""
+    if recipients == 'all':
+        return {u for (u,) in db.session.query(User.username)}
+    if recipients.startswith('group-'):
+        try:
+            group_id = int(recipients.split('-')[1])
+        except (IndexError, ValueError):
+            return set()
+        return {u for (u,) in db.session.query(GroupMember.username).filter_by(group_id=group_id)}
+    audience = {r.strip() for r in recipients.split(',') if r.strip()}
+    audience.add(sender)
+    return audience
+
+def lists_recipient(recipients, username):
+    """SQL test that a comma-separated recipients column names username exactly, as split(',') would."""
+    name = username.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    padded = literal(',') + func.replace(recipients, ', ', ',') + literal(',')
+    return padded.like(f'%,{name},%', escape='\\')
+
+def cleared_before(username, conversation):
+    """(highest hidden id, clear time) of the user's last clear of a conversation; (0, None) if never cleared."""
+    row = db.session.query(ChatClear.cleared_before, ChatClear.cleared_at).filter_by(
+        username=username, conversation=conversation).first()
+    return (row.cleared_before, row.cleared_at) if row else (0, None)
+
+def after_clear(t, clear):
+    """Criteria for what a clear left visible: later ids, and nothing dated before it.
+
+    The time matters for imported history, which gets new ids but keeps its
+    old timestamps.
+    """
+    watermark, cleared_at = clear
+    if cleared_at is None:
+        return (t.id > watermark,)
+    return (t.id > watermark, t.timestamp > cleared_at)
+
+def is_cleared(m, clear):
+    watermark, cleared_at = clear
+    return m.id <= watermark or bool(cleared_at and m.timestamp and m.timestamp <= cleared_at)
+
+def clear_conversation(username, conversation):
+    """Hide everything sent so far in a conversation from this user with one upsert; returns the watermark."""
+    from sqlalchemy.dialects.sqlite import insert
+    watermark = (db.session.query(func.max(Message.id)).scalar()
+                 or db.session.query(func.max(ArchiveMonth.max_id)).scalar() or 0)
+    stmt = insert(ChatClear).values(username=username, conversation=conversation, cleared_before=watermark,
+                                    cleared_at=datetime.utcnow())
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['username', 'conversation'],
+        set_={'cleared_before': func.max(ChatClear.cleared_before, stmt.excluded.cleared_before),
+              'cleared_at': stmt.excluded.cleared_at}
+    ))
+    db.session.commit()
+    return watermark
+
+def record_missed_event(usernames, event, payload):
+    """Sequence an outgoing event so reconnecting clients can replay it."""
+    # Every tracked emit passes through here, so this is also where fan-out is measured
+    emit_fanout.observe((event,), len(usernames))
+    return user_event_log.record(usernames, event, payload)
+
+# group_id -> {username: (notification_preference, muted)}
+group_fanout_cache = {}
+
+def get_group_fanout(group_id):
+    """Cached notification preference and mute state of every member of a group."""
+    group_id = int(group_id)
+    prefs = group_fanout_cache.get(group_id)
+    count_cache_lookup('group_fanout', prefs is not None)
+    if prefs is None:
+        muted = {u for (u,) in db.session.query(GroupMute.username).filter_by(group_id=group_id)}
+        rows = db.session.query(GroupMember.username, GroupMember.notification_preference).filter_by(group_id=group_id)
+        prefs = {username: (pref or 'all', username in muted) for username, pref in rows}
+        group_fanout_cache[group_id] = prefs
+    return prefs
+
+def invalidate_group_fanout(group_id):
+    """Drop cached fan-out preferences after membership, preference or mute changes."""
+    group_fanout_cache.pop(int(group_id), None)
+
+# group_id -> GroupAccess for groups that exist
+group_access_cache = {}
+
+GroupAccess = namedtuple('GroupAccess', 'admin_only members')   # members: {username: MemberAccess}
+MemberAccess = namedtuple('MemberAccess', 'is_admin role')
+
+def get_group_access(group_id):
+    """Cached admin_only flag and member roles of a group, or None if there is no such group.
+
+    Permission checks read this instead of querying GroupMember, so every
+    change to membership, is_admin, role or admin_only must call
+    invalidate_group_access() once it is committed.
+    """
+    group_id = int(group_id)
+    access = group_access_cache.get(group_id)
+    count_cache_lookup('group_access', access is not None)
+    if access is None:
+        group = db.session.query(Group.admin_only).filter_by(id=group_id).first()
+        if group is None:
+            return None
+        rows = db.session.query(GroupMember.username, GroupMember.is_admin, GroupMember.role).filter_by(group_id=group_id)
+        members = {username: MemberAccess(bool(is_admin), role or 'member') for username, is_admin, role in rows}
+        access = group_access_cache[group_id] = GroupAccess(bool(group.admin_only), members)
+    return access
+
+def group_member_access(group_id, username):
+    """MemberAccess of username in a group, or None if they are not a member."""
+    access = get_group_access(group_id)
+    return access.members.get(username) if access else None
+
+def is_group_admin(group_id, username):
+    member = group_member_access(group_id, username)
+    return bool(member and member.is_admin)
+
+def invalidate_group_access(group_id):
+    """Drop a group's cached permissions after membership, role, admin or admin_only changes."""
+    group_access_cache.pop(int(group_id), None)
+
+# group_id -> serialized pins, newest first
+pinned_cache = {}
+
+def serialize_pin(pin, message):
+    """Client payload for a pinned message, with the message content decrypted."""
+    return {
+        'pin_id': pin.id,
+        'group_id': pin.group_id,
+        'message_id': pin.message_id,
+        'message_content': decrypt_message(message.content) if message.content else '',
+        'message_sender': message.sender,
+        'message_timestamp': message.timestamp.isoformat() if message.timestamp else None,
+        'message_file_id': message.file_id,
+        'pinned_by': pin.pinned_by,
+        'pinned_at': pin.pinned_at.isoformat() if pin.pinned_at else None
+    }
+
+def get_pinned(group_id):
+    """Cached pins of a group, loaded with their messages in one joined query.
+
+    Pinned messages are never archived, so the hot table always has them.
+    """
+    group_id = int(group_id)
+    pins = pinned_cache.get(group_id)
+    count_cache_lookup('pinned', pins is not None)
+    if pins is None:
+        rows = (db.session.query(PinnedMessage, Message)
+                .join(Message, Message.id == PinnedMessage.message_id)
+                .filter(PinnedMessage.group_id == group_id)
+                .order_by(PinnedMessage.pinned_at.desc(), PinnedMessage.id.desc()))
+        pins = [serialize_pin(pin, message) for pin, message in rows]
+        pinned_cache[group_id] = pins
+    return pins
+
+def invalidate_pinned(group_id):
+    """Drop a group's cached pins after a pin, unpin or deletion of a pinned message."""
+    pinned_cache.pop(int(group_id), None)
+
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.\-]+)')
+
+def extract_mentions(content, members):
+    """Return the members mentioned as @username in content (case-insensitive)."""
+    if not content or '@' not in content:
+        return set()
+    by_lower = {m.lower(): m for m in members}
+    mentioned = set()
+    for name in MENTION_RE.findall(content):
+        member = by_lower.get(name.rstrip('.-').lower())
+        if member:
+            mentioned.add(member)
+    return mentioned
+
+def split_group_fanout(group_id, sender, mentioned=()):
+    """Split group members into those who get the full message and those who get an activity ping.
+
+    Members with preference 'all' who have not muted the group get the full
+    notification-bearing message, as does anyone @mentioned unless their
+    preference is 'none'. Everyone else only gets a lightweight ping.
+    """
+    full, ping = [], []
+    for username, (pref, muted) in get_group_fanout(group_id).items():
+        if username == sender:
+            full.append(username)
+        elif pref == 'none':
+            ping.append(username)
+        elif username in mentioned:
+            full.append(username)
+        elif pref == 'all' and not muted:
+            full.append(username)
+        else:
+            ping.append(username)
+    return full, ping
+
+def serialize_message(m):
+    """Client payload for a message (hot or archived), matching what /history returns."""
+    import json
+    file_info = None
+    if m.file_id:
+        f = find_file(m.file_id, getattr(m, 'archive_month', None))
+        if f:
+            file_info = {
+                'filename': f.filename,
+                'original_name': f.original_name,
+                'mimetype': f.mimetype
+            }
+    reply_msg = None
+    if m.reply_to:
+        reply = find_message(m.reply_to)
+        if reply:
+            reply_msg = {
+                'id': reply.id,
+                'sender': reply.sender,
+                'content': decrypt_message(reply.content) if reply.content else '',
+                'timestamp': reply.timestamp.isoformat() + 'Z' if reply.timestamp else None
+            }
+    return {
+        'id': m.id,
+        'sender': m.sender,
+        'recipients': m.recipients,
+        'content': decrypt_message(m.content) if m.content else '',
+        'timestamp': m.timestamp.isoformat() + 'Z' if m.timestamp else None,
+        'file': file_info,
+        'status': m.status,
+        'reply_to': reply_msg,
+        'reactions': json.loads(m.reactions) if m.reactions else {},
+        'group_id': m.group_id
+    }
+
 def log_group_activity(group_id, action_type, actor, target=None, details=None):
-    """Log an activity in the group activity log and send system message to chat."""
+    """Log an activity in the group activity log and send system message to chat.
+
+    Inside group_activity_batch(group_id) the entry is only collected; the
+    batch writes everything and sends one summary message when it ends.
+    """
+    batch = g.get('_activity_batch') if has_app_context() else None
+    if batch is not None and batch['group_id'] == group_id:
+        batch['entries'].append((action_type, actor, target, details))
+        return
+    write_group_activity(group_id, [(action_type, actor, target, details)])
+
+@contextmanager
+def group_activity_batch(group_id):
+    """Collect log_group_activity calls for group_id and write them together on exit.
+
+    All GroupActivity rows go in one commit and the chat gets a single
+    summarised system message (e.g. "X added 149 people to the group") with
+    one emit. Nothing is written if the block raises.
+    """
+    outer = g.get('_activity_batch')
+    batch = g._activity_batch = {'group_id': group_id, 'entries': []}
+    try:
+        yield batch
+    finally:
+        g._activity_batch = outer
+    if batch['entries']:
+        write_group_activity(group_id, batch['entries'])
+
+def write_group_activity(group_id, entries):
+    """Store (action_type, actor, target, details) entries and post one system message for them."""
     try:
         import json
-        details_str = json.dumps(details) if details else None
-        activity = GroupActivity(
-            group_id=group_id,
-            action_type=action_type,
-            actor=actor,
-            target=target,
-            details=details_str
-        )
-        db.session.add(activity)
+        # One executemany however many entries there are
+        db.session.execute(GroupActivity.__table__.insert(), [
+            {
+                'group_id': group_id,
+                'action_type': action_type,
+                'actor': actor,
+                'target': target,
+                'details': json.dumps(details) if details else None
+            }
+            for action_type, actor, target, details in entries
+        ])
         
         # Create system message for the group chat
-        system_message = create_activity_message(action_type, actor, target, details)
+        system_message = summarize_activity(entries)
         if system_message:
             # Create a system message in the group chat
             message = Message(
@@ -374,7 +1329,6 @@ def log_group_activity(group_id, action_type, actor, target=None, details=None):
         # Emit the system message to group members via SocketIO if available
         if system_message:
             try:
-                from flask_socketio import emit
                 socketio.emit('new_message', {
                     'sender': 'System',
                     'content': system_message,
@@ -391,6 +1345,46 @@ def log_group_activity(group_id, action_type, actor, target=None, details=None):
         # Don't fail the main operation if logging fails
         pass
 
+# Member changes that summarize_activity folds into one line per actor when there are several
+ACTIVITY_SUMMARIES = {
+    'member_added': ('👤 {actor} added {names} to the group', '👤 {actor} added {count} people to the group'),
+    'member_removed': ('👤 {actor} removed {names} from the group', '👤 {actor} removed {count} people from the group'),
+}
+
+def summarize_activity(entries):
+    """One system message text for a batch of activities (None if none of them shows in chat)."""
+    if len(entries) == 1:
+        return create_activity_message(*entries[0])
+    lines, grouped = [], {}
+    for action_type, actor, target, details in entries:
+        if action_type in ACTIVITY_SUMMARIES:
+            key = (action_type, actor)
+            if key not in grouped:
+                grouped[key] = []
+                lines.append(key)
+            grouped[key].append((target, details))
+        else:
+            text = create_activity_message(action_type, actor, target, details)
+            if text:
+                lines.append(text)
+    parts = []
+    for line in lines:
+        if isinstance(line, str):
+            parts.append(line)
+            continue
+        action_type, actor = line
+        targets = grouped[line]
+        if len(targets) == 1:
+            parts.append(create_activity_message(action_type, actor, *targets[0]))
+            continue
+        one_by_one, many = ACTIVITY_SUMMARIES[action_type]
+        if len(targets) <= 3:
+            names = ', '.join(t for t, _ in targets[:-1]) + f' and {targets[-1][0]}'
+            parts.append(one_by_one.format(actor=actor, names=names))
+        else:
+            parts.append(many.format(actor=actor, count=len(targets)))
+    return ' · '.join(parts) or None
+
 def create_activity_message(action_type, actor, target=None, details=None):
     """Create a human-readable system message for group activities."""
     if action_type == 'member_added':
@@ -468,7 +1462,6 @@ def login():
 
         if not error:
             session['username'] = username
-            session['is_admin'] = user.is_admin
             session.permanent = True  # Make session persistent
             user.online = True
             db.session.commit()
@@ -551,6 +1544,7 @@ def manage_account():
             # Update user's profile photo
             user.profile_photo = filename
             db.session.commit()
+            invalidate_identity(user.username)
             try:
                 socketio.emit('profile_photo_updated', {
                     'username': user.username,
@@ -572,6 +1566,7 @@ def manage_account():
                 
                 user.profile_photo = None
                 db.session.commit()
+                invalidate_identity(user.username)
                 try:
                     socketio.emit('profile_photo_updated', {
                         'username': user.username,
@@ -648,7 +1643,7 @@ def serve_profile_photo(filename):
 def api_profile_photo(username):
     """API endpoint to get profile photo by username."""
     try:
-        user = User.query.filter_by(username=username).first()
+        user = get_identity(username)
         if user and user.profile_photo:
             profile_folder = app.config['PROFILE_PHOTO_FOLDER']
             return send_from_directory(profile_folder, user.profile_photo)
@@ -696,7 +1691,7 @@ def api_group_info(group_id):
 
     # Compute is_admin for current user
     username = session['username']
-    gm = GroupMember.query.filter_by(group_id=group_id, username=username).first()
+    gm = group_member_access(group_id, username)
     is_admin = bool(gm and getattr(gm, 'is_admin', False))
 
     # Always provide a resilient icon URL like user profile API
@@ -744,7 +1739,7 @@ def upload_group_photo(group_id):
     if not group:
         return jsonify({'success': False, 'error': 'Group not found'}), 404
     
-    admin = GroupMember.query.filter_by(group_id=group_id, username=username, is_admin=True).first()
+    admin = is_group_admin(group_id, username)
     if not admin:
         return jsonify({'success': False, 'error': 'Only admins can change group photo'}), 403
     
@@ -794,7 +1789,7 @@ def remove_group_photo(group_id):
     if not group:
         return jsonify({'success': False, 'error': 'Group not found'}), 404
     
-    admin = GroupMember.query.filter_by(group_id=group_id, username=username, is_admin=True).first()
+    admin = is_group_admin(group_id, username)
     if not admin:
         return jsonify({'success': False, 'error': 'Only admins can remove group photo'}), 403
     
@@ -819,7 +1814,7 @@ def remove_group_photo(group_id):
 @app.route('/add-user', methods=['GET', 'POST'])
 def add_user():
     """Add User page. Requires admin login."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     
     message = None
@@ -835,6 +1830,9 @@ def add_user():
             elif User.query.filter_by(username=new_username).first():
                 flash('Username already exists.', 'error')
                 return redirect(url_for('add_user'))
+            elif user_deletion_pending(new_username):
+                flash(f'{new_username} is still being deleted. Try again once the deletion job has finished.', 'error')
+                return redirect(url_for('add_user'))
             else:
                 user = User(
                     username=new_username,
@@ -853,7 +1851,7 @@ def add_user():
 @app.route('/pending-requests', methods=['GET', 'POST'])
 def pending_requests():
     """Pending Requests page. Requires admin login."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     
     message = None
@@ -861,7 +1859,10 @@ def pending_requests():
         action = request.form.get('action')
         req_id = request.form.get('req_id')
         req = UserRequest.query.get(req_id) if req_id else None
-        if req and action == 'approve':
+        if req and action == 'approve' and user_deletion_pending(req.username):
+            flash(f'{req.username} is still being deleted. Approve the request once the deletion job has finished.', 'error')
+            return redirect(url_for('pending_requests'))
+        elif req and action == 'approve':
             user = User(
                 username=req.username,
                 password=req.password,
@@ -887,7 +1888,7 @@ def pending_requests():
 @app.route('/reset-requests', methods=['GET', 'POST'])
 def reset_requests():
     """Password Reset Requests page. Requires admin login."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     
     message = None
@@ -920,7 +1921,7 @@ def reset_requests():
 @app.route('/all-users', methods=['GET', 'POST'])
 def all_users():
     """All Users page. Requires admin login."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     
     message = None
@@ -932,9 +1933,13 @@ def all_users():
         if user:
             if action == 'delete_user':
                 if not user.is_admin:
+                    if user.profile_photo:
+                        remove_file_quietly(os.path.join(app.config['PROFILE_PHOTO_FOLDER'], user.profile_photo))
+                    # The account goes now; messages, files and memberships follow in the background
                     db.session.delete(user)
-                    db.session.commit()
-                    flash(f'User {user.username} deleted successfully!', 'success')
+                    queue_deletion('user', user.username, session['username'])
+                    invalidate_identity(user.username)
+                    flash(f'User {user.username} deleted. Their messages and files are being removed in the background.', 'success')
                     return redirect(url_for('all_users'))
                 else:
                     flash(f'Cannot delete admin user {user.username}.', 'error')
@@ -944,6 +1949,7 @@ def all_users():
                     user.is_admin = True
                     user.created_by = session['username']
                     db.session.commit()
+                    invalidate_identity(user.username)
                     flash(f'User {user.username} promoted to admin successfully!', 'success')
                     return redirect(url_for('all_users'))
                 else:
@@ -956,6 +1962,7 @@ def all_users():
                     if admin_count > 1:
                         user.is_admin = False
                         db.session.commit()
+                        invalidate_identity(user.username)
                         flash(f'User {user.username} demoted from admin successfully!', 'success')
                         return redirect(url_for('all_users'))
                     else:
@@ -971,21 +1978,26 @@ def all_users():
 @app.route('/admins')
 def admins():
     """Admins page. Requires admin login."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     
     users = User.query.all()
     return render_template('dashboard.html', username=session['username'], host_ip=get_host_ip(), active_section='admins', users=users)
 
+@app.route('/usage')
+def usage():
+    """Usage statistics page (charts load from /api/admin/stats). Requires admin login."""
+    if not current_user_is_admin():
+        return redirect(url_for('login'))
+    return render_template('dashboard.html', username=session['username'], host_ip=get_host_ip(), active_section='usage')
+
 @app.route('/logout')
 def logout():
     """Logout the user and update online status."""
     username = session.get('username')
     if username:
-        user = User.query.filter_by(username=username).first()
-        if user:
-            user.online = False
-            db.session.commit()
+        User.query.filter_by(username=username).update({'online': False})
+        db.session.commit()
         online_users.discard(username)
         session.pop('username', None)
     return redirect(url_for('login'))
@@ -1001,98 +2013,80 @@ def uploaded_file(filename):
     as_attachment = request.args.get('download') == '1'
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=as_attachment)
 
+def conversation_criteria(username, filter_user=None, group_id=None):
+    """criteria(t) for read_through: one private chat or group as `username` sees it (after any clear)."""
+    if group_id:
+        group_room = f'group-{group_id}'
+        clear = cleared_before(username, group_room)
+        return lambda t: (t.recipients == group_room, *after_clear(t, clear))
+    if filter_user == username:
+        clear = cleared_before(username, username)
+        return lambda t: (
+            or_(
+                t.sender == username,
+                t.recipients.like(f'%{username}%')
+            ),
+            t.group_id == None,
+            *after_clear(t, clear)
+        )
+    if filter_user and filter_user.startswith('group-'):
+        clear = cleared_before(username, filter_user)
+        return lambda t: (t.recipients == filter_user, *after_clear(t, clear))
+    clear = cleared_before(username, filter_user)
+    return lambda t: (
+        or_(
+            and_(t.sender == username, t.recipients.like(f"%{filter_user}%")),
+            and_(t.sender == filter_user, t.recipients.like(f"%{username}%"))
+        ),
+        t.group_id == None,
+        *after_clear(t, clear)
+    )
+
 @app.route('/history')
 def history():
-    """Return recent messages for the user, private chat, or group chat (no public chat), excluding messages the user hid."""
-    import json
+    """Return recent messages for the user, private chat, or group chat (no public chat), excluding messages the user hid.
+
+    Messages are ordered by timestamp (then id), so imported history sorts in
+    by date. Pass ?before_id=<oldest id shown> for the next older page; pages
+    continue into the message archive once the hot table runs out, and end
+    if that message has been deleted meanwhile.
+    """
     if 'username' not in session:
         return jsonify([])
     username = session['username']
     filter_user = request.args.get('user')
     group_id = request.args.get('group_id')
+    before_id = request.args.get('before_id', type=int)
+    before = None
+    if before_id is not None:
+        before = message_cursor(before_id)
+        if before is None:
+            return jsonify([])
+    criteria = conversation_criteria(username, filter_user, group_id)
+    msgs = read_through(criteria, 50, before=before, hidden_for=username)
+    result = [serialize_message(m) for m in reversed(msgs)]
+    return jsonify(result)
 
-    # Exclude messages hidden by this user
-    hidden_subq = db.session.query(HiddenMessage.msg_id).filter(HiddenMessage.username == username)
-
-    if group_id:
-        group_room = f'group-{group_id}'
-        msgs = (
-            Message.query
-            .filter_by(recipients=group_room)
-            .filter(~Message.id.in_(hidden_subq))
-            .order_by(Message.timestamp.desc())
-            .limit(50).all()
-        )
-    elif filter_user == username:
-        msgs = (
-            Message.query
-            .filter(
-                or_(
-                    Message.sender == username,
-                    Message.recipients.like(f'%{username}%')
-                ),
-                Message.group_id == None
-            )
-            .filter(~Message.id.in_(hidden_subq))
-            .order_by(Message.timestamp.desc())
-            .limit(50).all()
-        )
-    elif filter_user and filter_user.startswith('group-'):
-        msgs = (
-            Message.query
-            .filter_by(recipients=filter_user)
-            .filter(~Message.id.in_(hidden_subq))
-            .order_by(Message.timestamp.desc())
-            .limit(50).all()
-        )
+@app.route('/api/messages/<int:msg_id>')
+def get_message(msg_id):
+    """Return a single message, e.g. after a group activity ping for the open chat."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    username = session['username']
+    msg = find_message(msg_id)
+    if not msg:
+        return jsonify({'error': 'Message not found'}), 404
+    if msg.group_id:
+        allowed = group_member_access(msg.group_id, username) is not None
     else:
-        msgs = (
-            Message.query
-            .filter(
-                or_(
-                    and_(Message.sender == username, Message.recipients.like(f"%{filter_user}%")),
-                    and_(Message.sender == filter_user, Message.recipients.like(f"%{username}%"))
-                ),
-                Message.group_id == None
-            )
-            .filter(~Message.id.in_(hidden_subq))
-            .order_by(Message.timestamp.desc())
-            .limit(50).all()
-        )
-    result = []
-    for m in reversed(msgs):
-        file_info = None
-        if m.file_id:
-            f = File.query.get(m.file_id)
-            if f:
-                file_info = {
-                    'filename': f.filename,
-                    'original_name': f.original_name,
-                    'mimetype': f.mimetype
-                }
-        reply_msg = None
-        if m.reply_to:
-            reply = Message.query.get(m.reply_to)
-            if reply:
-                reply_msg = {
-                    'id': reply.id,
-                    'sender': reply.sender,
-                    'content': decrypt_message(reply.content) if reply.content else '',
-                    'timestamp': reply.timestamp.isoformat() + 'Z' if reply.timestamp else None
-                }
-        result.append({
-            'id': m.id,
-            'sender': m.sender,
-            'recipients': m.recipients,
-            'content': decrypt_message(m.content) if m.content else '',
-            'timestamp': m.timestamp.isoformat() + 'Z' if m.timestamp else None,
-            'file': file_info,
-            'status': m.status,
-            'reply_to': reply_msg,
-            'reactions': json.loads(m.reactions) if m.reactions else {},
-            'group_id': m.group_id
-        })
-    return jsonify(result)
+        allowed = msg.sender == username or username in [r.strip() for r in msg.recipients.split(',')]
+    hidden = HiddenMessage.query.filter_by(msg_id=msg_id, username=username).first() is not None
+    conversation = msg.recipients if msg.group_id else (msg.sender if msg.sender != username else msg.recipients)
+    if not hidden:
+        hidden = is_cleared(msg, cleared_before(username, conversation))
+    if not allowed or hidden:
+        return jsonify({'error': 'Not allowed'}), 403
+    return jsonify(serialize_message(msg))
 
 @app.route('/search')
 def search():
@@ -1106,13 +2100,13 @@ def search():
     user_matches = set()
     group_matches = set()
     # Private messages involving the user
-    pm_msgs = Message.query.filter(
-        Message.group_id == None,
+    pm_msgs = read_through(lambda t: (
+        t.group_id == None,
         or_(
-            Message.sender == username,
-            Message.recipients.like(f"%{username}%")
+            t.sender == username,
+            t.recipients.like(f"%{username}%")
         )
-    ).order_by(Message.timestamp.desc()).limit(2000).all()
+    ), 2000)
     for m in pm_msgs:
         if not m.content:
             continue
@@ -1132,9 +2126,7 @@ def search():
     # Group messages in groups the user belongs to
     gm_group_ids = [gm.group_id for gm in GroupMember.query.filter_by(username=username)]
     if gm_group_ids:
-        grp_msgs = Message.query.filter(
-            Message.group_id.in_(gm_group_ids)
-        ).order_by(Message.timestamp.desc()).limit(2000).all()
+        grp_msgs = read_through(lambda t: (t.group_id.in_(gm_group_ids),), 2000)
         for m in grp_msgs:
             if not m.content:
                 continue
@@ -1159,6 +2151,29 @@ def users_status():
     users = User.query.all()
     return jsonify([{ 'username': u.username, 'online': u.online } for u in users])
 
+def store_upload(stream, original_name, uploader, mimetype, timestamp=None):
+    """Copy a file into UPLOAD_FOLDER under a free name and add its File row; returns (file, size).
+
+    The caller commits. Shared by /upload and the history importer.
+    """
+    import shutil
+    filename = secure_filename(original_name)
+    save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    i = 1
+    while os.path.exists(save_path):
+        filename = f"{os.path.splitext(secure_filename(original_name))[0]}_{i}{os.path.splitext(original_name)[1]}"
+        save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        i += 1
+    with trace_span('file.write', 'io', path=save_path), open(save_path, 'wb') as out:
+        shutil.copyfileobj(stream, out, 16384)
+    size = os.path.getsize(save_path)
+    f = File(filename=filename, original_name=original_name, uploader=uploader, mimetype=mimetype)
+    if timestamp is not None:
+        f.timestamp = timestamp
+    db.session.add(f)
+    record_file_stats(f, size)
+    return f, size
+
 @app.route('/upload', methods=['POST'])
 def upload():
     """Handle file uploads and save metadata to the database."""
@@ -1169,18 +2184,10 @@ def upload():
     file = request.files['file']
     if not file.filename or file.filename == '' or not allowed_file(file.filename):
         return jsonify({'error': 'Invalid file'}), 400
-    filename = secure_filename(file.filename)
-    save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    i = 1
-    while os.path.exists(save_path):
-        filename = f"{os.path.splitext(secure_filename(file.filename))[0]}_{i}{os.path.splitext(file.filename)[1]}"
-        save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        i += 1
-    file.save(save_path)
-    f = File(filename=filename, original_name=file.filename, uploader=session['username'], mimetype=file.mimetype)
-    db.session.add(f)
+    f, size = store_upload(file.stream, file.filename, session['username'], file.mimetype)
+    observe_upload(size)
     db.session.commit()
-    return jsonify({'file_id': f.id, 'filename': filename, 'original_name': file.filename, 'mimetype': file.mimetype})
+    return jsonify({'file_id': f.id, 'filename': f.filename, 'original_name': file.filename, 'mimetype': file.mimetype})
 
 @app.route('/delete_message/<int:msg_id>', methods=['POST'])
 def delete_message(msg_id):
@@ -1202,6 +2209,7 @@ def delete_message(msg_id):
         if msg.file_id:
             file = File.query.get(msg.file_id)
             if file:
+                record_file_stats(file, file_size_on_disk(file.filename), -1)
                 try:
                     os.remove(os.path.join(app.config['UPLOAD_FOLDER'], file.filename))
                 except Exception:
@@ -1214,8 +2222,16 @@ def delete_message(msg_id):
             'group_id': msg.group_id,
             'deleted_by': username
         }
+        audience = message_audience(msg.sender, msg.recipients)
+        MessageMention.query.filter_by(message_id=msg_id).delete()
+        pinned_groups = [gid for (gid,) in db.session.query(PinnedMessage.group_id).filter_by(message_id=msg_id)]
+        PinnedMessage.query.filter_by(message_id=msg_id).delete()
+        record_message_stats(msg, -1)
         db.session.delete(msg)
         db.session.commit()
+        for gid in pinned_groups:
+            invalidate_pinned(gid)
+        record_missed_event(audience, 'message_deleted', msg_data)
 
         # Notify all relevant users
         if msg.recipients == 'all':
@@ -1245,6 +2261,7 @@ def delete_message(msg_id):
         'group_id': msg.group_id,
         'deleted_by': username
     }
+    record_missed_event([username], 'message_deleted', msg_data)
     socketio.emit('message_deleted', msg_data, to=username)
     return jsonify({'success': True, 'mode': 'soft'})
 
@@ -1261,7 +2278,7 @@ def delete_file(file_id):
     if 'username' not in session:
         return jsonify({'success': False, 'error': 'Not logged in'}), 401
     username = session['username']
-    is_admin = session.get('is_admin', False)
+    is_admin = current_user_is_admin()
 
     file = File.query.get(file_id)
     if not file:
@@ -1289,13 +2306,14 @@ def delete_file(file_id):
                 Message.group_id.isnot(None)
             ).first()
             if grp_msg:
-                gm = GroupMember.query.filter_by(group_id=grp_msg.group_id, username=username).first()
+                gm = group_member_access(grp_msg.group_id, username)
                 if gm:
                     allowed = True
 
     if not allowed:
         return jsonify({'success': False, 'error': 'Not allowed'}), 403
 
+    record_file_stats(file, file_size_on_disk(file.filename), -1)
     try:
         os.remove(os.path.join(app.config['UPLOAD_FOLDER'], file.filename))
     except Exception:
@@ -1304,8 +2322,10 @@ def delete_file(file_id):
     # Get all messages referencing this file for real-time notification
     affected_messages = Message.query.filter_by(file_id=file_id).all()
     affected_msg_data = []
+    audience = set()
     
     for msg in affected_messages:
+        audience |= message_audience(msg.sender, msg.recipients)
         affected_msg_data.append({
             'msg_id': msg.id,
             'sender': msg.sender,
@@ -1314,9 +2334,20 @@ def delete_file(file_id):
         })
     
     # Remove all messages referencing this file
+    affected_ids = [d['msg_id'] for d in affected_msg_data]
+    pinned_groups = set()
+    if affected_msg_data:
+        MessageMention.query.filter(
+            MessageMention.message_id.in_(affected_ids)
+        ).delete(synchronize_session=False)
+        pinned_groups = {gid for (gid,) in db.session.query(PinnedMessage.group_id).filter(PinnedMessage.message_id.in_(affected_ids))}
+        PinnedMessage.query.filter(PinnedMessage.message_id.in_(affected_ids)).delete(synchronize_session=False)
+    forget_message_stats(Message.file_id == file_id)
     Message.query.filter_by(file_id=file_id).delete()
     db.session.delete(file)
     db.session.commit()
+    for gid in pinned_groups:
+        invalidate_pinned(gid)
     
     # 🔥 REAL-TIME: Notify all users about file and message deletions
     file_deleted_data = {
@@ -1325,6 +2356,7 @@ def delete_file(file_id):
         'deleted_by': username,
         'affected_messages': affected_msg_data
     }
+    record_missed_event(audience, 'file_deleted', file_deleted_data)
     
     # Notify all users who had access to messages with this file
     notified_users = set()
@@ -1361,10 +2393,12 @@ def signup():
             error = 'Username and password required.'
         elif User.query.filter_by(username=username).first() or UserRequest.query.filter_by(username=username).first():
             error = 'Username already exists or pending approval.'
+        elif user_deletion_pending(username):
+            error = 'This username is not available yet. Try again later.'
         else:
             req = UserRequest(
                 username=username,
-                password=cipher_suite.encrypt(password.encode()),
+                password=get_cipher().encrypt(password.encode()),
                 requested_by=username,
                 status='pending'
             )
@@ -1378,7 +2412,7 @@ def signup():
 @app.route('/admin', methods=['GET', 'POST'])
 def admin_dashboard():
     """Redirect to the new add-user page for backward compatibility."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     return redirect(url_for('add_user'))
 
@@ -1422,6 +2456,7 @@ def create_group():
     if session['username'] not in admins:
         admins.append(session['username'])
     group = Group(name=name, description=description, icon=icon, created_by=session['username'])
+    group.id = next_group_id()
     db.session.add(group)
     db.session.commit()
     # Add members and admins
@@ -1429,17 +2464,19 @@ def create_group():
         gm = GroupMember(group_id=group.id, username=m, is_admin=(m in admins))
         db.session.add(gm)
     db.session.commit()
+    invalidate_group_fanout(group.id)
+    invalidate_group_access(group.id)
     
-    # Log group creation activity
-    log_group_activity(group.id, 'group_created', session['username'], 
-                      details={'members': list(set(members)), 'admins': list(set(admins))})
-    
-    # Log member additions
-    for m in set(members):
-        if m != session['username']:  # Don't log creator adding themselves
-            is_admin = m in admins
-            log_group_activity(group.id, 'member_added', session['username'], m, 
-                             details={'is_admin': is_admin})
+    # Log group creation and member additions: one commit, one summary message
+    with group_activity_batch(group.id):
+        log_group_activity(group.id, 'group_created', session['username'], 
+                          details={'members': list(set(members)), 'admins': list(set(admins))})
+        
+        for m in set(members):
+            if m != session['username']:  # Don't log creator adding themselves
+                is_admin = m in admins
+                log_group_activity(group.id, 'member_added', session['username'], m, 
+                                 details={'is_admin': is_admin})
     
     return jsonify({'success': True, 'group_id': group.id})
 
@@ -1474,7 +2511,7 @@ def add_group_member(group_id):
     group = Group.query.get(group_id)
     if not group:
         return jsonify({'error': 'Group not found'}), 404
-    admin = GroupMember.query.filter_by(group_id=group_id, username=session['username'], is_admin=True).first()
+    admin = is_group_admin(group_id, session['username'])
     if not admin:
         return jsonify({'error': 'Only admins can add members'}), 403
     data = request.get_json()
@@ -1483,11 +2520,13 @@ def add_group_member(group_id):
     new_member = data.get('username')
     if not new_member:
         return jsonify({'error': 'Username required'}), 400
-    if GroupMember.query.filter_by(group_id=group_id, username=new_member).first():
+    if group_member_access(group_id, new_member):
         return jsonify({'error': 'User already in group'}), 400
     gm = GroupMember(group_id=group_id, username=new_member, is_admin=False)
     db.session.add(gm)
     db.session.commit()
+    invalidate_group_fanout(group_id)
+    invalidate_group_access(group_id)
     
     # Log activity
     log_group_activity(group_id, 'member_added', session['username'], new_member)
@@ -1502,7 +2541,7 @@ def remove_group_member(group_id):
     group = Group.query.get(group_id)
     if not group:
         return jsonify({'error': 'Group not found'}), 404
-    admin = GroupMember.query.filter_by(group_id=group_id, username=session['username'], is_admin=True).first()
+    admin = is_group_admin(group_id, session['username'])
     if not admin:
         return jsonify({'error': 'Only admins can remove members'}), 403
     data = request.get_json()
@@ -1516,6 +2555,8 @@ def remove_group_member(group_id):
         return jsonify({'error': 'User not in group'}), 400
     db.session.delete(gm)
     db.session.commit()
+    invalidate_group_fanout(group_id)
+    invalidate_group_access(group_id)
     
     # Log activity
     log_group_activity(group_id, 'member_removed', session['username'], member)
@@ -1530,7 +2571,7 @@ def set_group_admin(group_id):
     group = Group.query.get(group_id)
     if not group:
         return jsonify({'error': 'Group not found'}), 404
-    admin = GroupMember.query.filter_by(group_id=group_id, username=session['username'], is_admin=True).first()
+    admin = is_group_admin(group_id, session['username'])
     if not admin:
         return jsonify({'error': 'Only admins can assign/remove admin rights'}), 403
     data = request.get_json()
@@ -1555,6 +2596,7 @@ def set_group_admin(group_id):
         gm.role = 'member'
     
     db.session.commit()
+    invalidate_group_access(group_id)
     
     # Log activity
     log_group_activity(group_id, 'admin_status_changed', session['username'], member, 
@@ -1562,6 +2604,111 @@ def set_group_admin(group_id):
     
     return jsonify({'success': True, 'is_admin': gm.is_admin, 'role': gm.role})
 
+GROUP_ROLES = ('member', 'moderator', 'admin')
+
+@app.route('/api/groups/<int:group_id>/members/bulk', methods=['POST'])
+def bulk_group_members(group_id):
+    """Add, remove and re-role many members in one transaction (admin only).
+
+    Body: {"add": ["alice", {"username": "bob", "role": "admin"}, ...],
+    "remove": ["carol", ...], "roles": {"dave": "moderator", ...}}. Every
+    change is validated up front against one membership query; if any is
+    invalid nothing is applied and the reasons come back per username.
+    """
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    group = Group.query.get(group_id)
+    if not group:
+        return jsonify({'error': 'Group not found'}), 404
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid JSON data'}), 400
+    actor = session['username']
+    try:
+        add = {}
+        for entry in data.get('add') or []:
+            if isinstance(entry, dict):
+                add[entry.get('username')] = entry.get('role') or ('admin' if entry.get('is_admin') else 'member')
+            else:
+                add[entry] = 'member'
+        remove = set(data.get('remove') or [])
+        roles = dict(data.get('roles') or {})
+        names = set(add) | remove | set(roles)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'add and remove must be lists of usernames, roles an object'}), 400
+    if not names:
+        return jsonify({'error': 'Nothing to change'}), 400
+    if len(names) > app.config['GROUP_BULK_LIMIT']:
+        return jsonify({'error': f"At most {app.config['GROUP_BULK_LIMIT']} users per request"}), 400
+
+    # One query for the actor's and every named user's current membership
+    members = {m.username: m for m in GroupMember.query.filter(
+        GroupMember.group_id == group_id, GroupMember.username.in_(names | {actor}))}
+    if actor not in members or not members[actor].is_admin:
+        return jsonify({'error': 'Only admins can change members'}), 403
+    existing_users = {u for (u,) in db.session.query(User.username).filter(User.username.in_(set(add)))} if add else set()
+
+    invalid = {}
+    for name, role in add.items():
+        if not isinstance(name, str) or not name:
+            invalid[str(name)] = 'username required'
+        elif name not in existing_users:
+            invalid[name] = 'no such user'
+        elif name in members:
+            invalid[name] = 'already in group'
+        elif role not in GROUP_ROLES:
+            invalid[name] = f'invalid role {role!r}'
+    for name in remove:
+        if name in add or name in roles:
+            invalid[name] = 'both removed and changed'
+        elif name not in members:
+            invalid[name] = 'not in group'
+    for name, role in roles.items():
+        if role not in GROUP_ROLES:
+            invalid[name] = f'invalid role {role!r}'
+        elif name in add:
+            invalid[name] = 'give the role in "add" instead'
+        elif name not in members:
+            invalid[name] = 'not in group'
+        elif name == group.created_by and role != 'admin':
+            invalid[name] = 'cannot change role of group creator'
+    if invalid:
+        return jsonify({'error': 'Some changes are invalid; nothing was applied', 'invalid': invalid}), 400
+
+    with group_activity_batch(group_id):
+        if add:
+            db.session.execute(GroupMember.__table__.insert(), [
+                {'group_id': group_id, 'username': name, 'is_admin': role == 'admin', 'role': role}
+                for name, role in add.items()
+            ])
+            for name, role in add.items():
+                log_group_activity(group_id, 'member_added', actor, name, details={'is_admin': role == 'admin'})
+        if remove:
+            GroupMember.query.filter(GroupMember.group_id == group_id, GroupMember.username.in_(remove)).delete(
+                synchronize_session=False)
+            for name in remove:
+                log_group_activity(group_id, 'member_removed', actor, name)
+        by_role = defaultdict(list)
+        for name, role in roles.items():
+            if members[name].role != role or members[name].is_admin != (role == 'admin'):
+                by_role[role].append(name)
+        for role, usernames in by_role.items():
+            GroupMember.query.filter(GroupMember.group_id == group_id, GroupMember.username.in_(usernames)).update(
+                {'role': role, 'is_admin': role == 'admin'}, synchronize_session=False)
+            for name in usernames:
+                if members[name].is_admin != (role == 'admin'):
+                    log_group_activity(group_id, 'admin_status_changed', actor, name,
+                                       details={'is_admin': role == 'admin'})
+    db.session.commit()  # no-op unless the activity write failed after the changes were staged
+    invalidate_group_fanout(group_id)
+    invalidate_group_access(group_id)
+    return jsonify({
+        'success': True,
+        'added': sorted(add),
+        'removed': sorted(remove),
+        'roles': {role: sorted(usernames) for role, usernames in by_role.items()}
+    })
+
 @app.route('/groups/<int:group_id>/leave', methods=['POST'])
 def leave_group(group_id):
     """Leave a group (if admin, must assign another admin if last admin)."""
@@ -1581,6 +2728,8 @@ def leave_group(group_id):
             return jsonify({'error': 'Assign another admin before leaving'}), 400
     db.session.delete(gm)
     db.session.commit()
+    invalidate_group_fanout(group_id)
+    invalidate_group_access(group_id)
     return jsonify({'success': True})
 
 @app.route('/api/groups/<int:group_id>/update', methods=['POST'])
@@ -1591,7 +2740,7 @@ def update_group_info(group_id):
     group = Group.query.get(group_id)
     if not group:
         return jsonify({'error': 'Group not found'}), 404
-    admin = GroupMember.query.filter_by(group_id=group_id, username=session['username'], is_admin=True).first()
+    admin = is_group_admin(group_id, session['username'])
     if not admin:
         return jsonify({'error': 'Only admins can update group info'}), 403
     data = request.get_json()
@@ -1611,39 +2760,42 @@ def update_group_info(group_id):
     
     username = session['username']
     
-    # Log activity for name change
-    if name and name != original_name:
-        group.name = name
-        log_group_activity(group_id, 'group_name_changed', username, 
-                          details={'old_name': original_name, 'new_name': name})
-    
-    # Log activity for description change
-    if description is not None and description != original_description:
-        if original_description is None or original_description == '':
-            # Adding description
-            log_group_activity(group_id, 'description_added', username, 
-                              details={'description': description})
-        elif description == '':
-            # Removing description
-            log_group_activity(group_id, 'description_removed', username, 
-                              details={'old_description': original_description})
-        else:
-            # Changing description
-            log_group_activity(group_id, 'description_changed', username, 
-                              details={'old_description': original_description, 'new_description': description})
-        group.description = description
+    # Several changes in one save become one system message
+    with group_activity_batch(group_id):
+        # Log activity for name change
+        if name and name != original_name:
+            group.name = name
+            log_group_activity(group_id, 'group_name_changed', username, 
+                              details={'old_name': original_name, 'new_name': name})
+    
+        # Log activity for description change
+        if description is not None and description != original_description:
+            if original_description is None or original_description == '':
+                # Adding description
+                log_group_activity(group_id, 'description_added', username, 
+                                  details={'description': description})
+            elif description == '':
+                # Removing description
+                log_group_activity(group_id, 'description_removed', username, 
+                                  details={'old_description': original_description})
+            else:
+                # Changing description
+                log_group_activity(group_id, 'description_changed', username, 
+                                  details={'old_description': original_description, 'new_description': description})
+            group.description = description
     
-    # Log activity for admin-only setting change
-    if admin_only is not None and bool(admin_only) != original_admin_only:
-        group.admin_only = bool(admin_only)
-        log_group_activity(group_id, 'admin_only_changed', username, 
-                          details={'admin_only': bool(admin_only)})
+        # Log activity for admin-only setting change
+        if admin_only is not None and bool(admin_only) != original_admin_only:
+            group.admin_only = bool(admin_only)
+            log_group_activity(group_id, 'admin_only_changed', username, 
+                              details={'admin_only': bool(admin_only)})
     
     if icon:
         group.icon = icon
     
     try:
         db.session.commit()
+        invalidate_group_access(group_id)
         return jsonify({
             'success': True,
             'name': group.name,
@@ -1662,7 +2814,7 @@ def set_members_admins(group_id):
     group = Group.query.get(group_id)
     if not group:
         return jsonify({'success': False, 'error': 'Group not found'}), 404
-    admin = GroupMember.query.filter_by(group_id=group_id, username=session['username'], is_admin=True).first()
+    admin = is_group_admin(group_id, session['username'])
     if not admin:
         return jsonify({'success': False, 'error': 'Only admins can update members/admins'}), 403
     data = request.get_json(force=True)
@@ -1676,6 +2828,8 @@ def set_members_admins(group_id):
         gm = GroupMember(group_id=group_id, username=m, is_admin=is_admin)
         db.session.add(gm)
     db.session.commit()
+    invalidate_group_fanout(group_id)
+    invalidate_group_access(group_id)
     return jsonify({'success': True})
 
 @app.route('/api/groups/<int:group_id>/admin_only', methods=['POST'])
@@ -1686,13 +2840,14 @@ def set_group_admin_only(group_id):
     group = Group.query.get(group_id)
     if not group:
         return jsonify({'success': False, 'error': 'Group not found'}), 404
-    admin = GroupMember.query.filter_by(group_id=group_id, username=session['username'], is_admin=True).first()
+    admin = is_group_admin(group_id, session['username'])
     if not admin:
         return jsonify({'success': False, 'error': 'Only admins can update this setting'}), 403
     data = request.get_json(force=True)
     admin_only = data.get('admin_only', False)
     group.admin_only = bool(admin_only)
     db.session.commit()
+    invalidate_group_access(group_id)
     return jsonify({'success': True, 'admin_only': group.admin_only})
 
 @app.route('/api/groups/<int:group_id>/set_role', methods=['POST'])
@@ -1703,7 +2858,7 @@ def set_group_member_role(group_id):
     group = Group.query.get(group_id)
     if not group:
         return jsonify({'error': 'Group not found'}), 404
-    admin = GroupMember.query.filter_by(group_id=group_id, username=session['username'], is_admin=True).first()
+    admin = is_group_admin(group_id, session['username'])
     if not admin:
         return jsonify({'error': 'Only admins can assign roles'}), 403
     
@@ -1741,6 +2896,7 @@ def set_group_member_role(group_id):
         member.is_admin = False
     
     db.session.commit()
+    invalidate_group_access(group_id)
     return jsonify({'success': True, 'role': member.role, 'is_admin': member.is_admin})
 
 @app.route('/api/groups/<int:group_id>/notification_preference', methods=['POST'])
@@ -1768,6 +2924,7 @@ def set_notification_preference(group_id):
     # Update preference
     member.notification_preference = preference
     db.session.commit()
+    invalidate_group_fanout(group_id)
     
     return jsonify({'success': True, 'preference': member.notification_preference})
 
@@ -1778,12 +2935,11 @@ def pin_group_message(group_id):
         return jsonify({'error': 'Not logged in'}), 401
     
     username = session['username']
-    group = Group.query.get(group_id)
-    if not group:
+    if get_group_access(group_id) is None:
         return jsonify({'error': 'Group not found'}), 404
     
     # Check if user is admin or moderator
-    member = GroupMember.query.filter_by(group_id=group_id, username=username).first()
+    member = group_member_access(group_id, username)
     if not member or (not member.is_admin and member.role != 'moderator'):
         return jsonify({'error': 'Only admins and moderators can pin messages'}), 403
     
@@ -1796,7 +2952,7 @@ def pin_group_message(group_id):
         return jsonify({'error': 'Message ID required'}), 400
     
     # Check if message exists and belongs to this group
-    message = Message.query.get(message_id)
+    message = find_message(message_id)
     if not message:
         return jsonify({'error': 'Message not found'}), 404
     
@@ -1805,6 +2961,10 @@ def pin_group_message(group_id):
     if message.recipients != group_room:
         return jsonify({'error': 'Message does not belong to this group'}), 400
     
+    # Pins are read from the hot table, so archived messages cannot be pinned
+    if getattr(message, 'archive_month', None):
+        return jsonify({'error': 'Archived messages cannot be pinned'}), 400
+    
     # Check if message is already pinned
     existing_pin = PinnedMessage.query.filter_by(group_id=group_id, message_id=message_id).first()
     if existing_pin:
@@ -1814,22 +2974,13 @@ def pin_group_message(group_id):
     pin = PinnedMessage(group_id=group_id, message_id=message_id, pinned_by=username)
     db.session.add(pin)
     db.session.commit()
+    invalidate_pinned(group_id)
     
-    # Notify all clients in the group
-    socketio.emit('message_pinned', {
-        'group_id': group_id,
-        'message_id': message_id,
-        'pinned_by': username,
-        'pinned_at': pin.pinned_at.isoformat()
-    }, room=group_room)
+    # Notify all clients in the group; the payload is the same as a /pinned_messages entry
+    payload = serialize_pin(pin, message)
+    socketio.emit('message_pinned', payload, room=group_room)
     
-    return jsonify({
-        'success': True,
-        'pin_id': pin.id,
-        'message_id': message_id,
-        'pinned_by': username,
-        'pinned_at': pin.pinned_at.isoformat()
-    })
+    return jsonify({'success': True, **payload})
 
 @app.route('/api/groups/<int:group_id>/unpin_message', methods=['POST'])
 def unpin_group_message(group_id):
@@ -1838,12 +2989,11 @@ def unpin_group_message(group_id):
         return jsonify({'error': 'Not logged in'}), 401
     
     username = session['username']
-    group = Group.query.get(group_id)
-    if not group:
+    if get_group_access(group_id) is None:
         return jsonify({'error': 'Group not found'}), 404
     
     # Check if user is admin or moderator
-    member = GroupMember.query.filter_by(group_id=group_id, username=username).first()
+    member = group_member_access(group_id, username)
     if not member or (not member.is_admin and member.role != 'moderator'):
         return jsonify({'error': 'Only admins and moderators can unpin messages'}), 403
     
@@ -1863,6 +3013,7 @@ def unpin_group_message(group_id):
     # Unpin the message
     db.session.delete(pin)
     db.session.commit()
+    invalidate_pinned(group_id)
     
     # Notify all clients in the group
     group_room = f'group-{group_id}'
@@ -1887,56 +3038,34 @@ def get_pinned_messages(group_id):
     username = session['username']
     
     # Check if user is a member of the group
-    member = GroupMember.query.filter_by(group_id=group_id, username=username).first()
+    member = group_member_access(group_id, username)
     if not member:
         return jsonify({'error': 'Not a member of this group'}), 403
     
-    # Get all pinned messages
-    pins = PinnedMessage.query.filter_by(group_id=group_id).order_by(PinnedMessage.pinned_at.desc()).all()
-    
-    result = []
-    for pin in pins:
-        message = Message.query.get(pin.message_id)
-        if message:
-            result.append({
-                'pin_id': pin.id,
-                'message_id': pin.message_id,
-                'message_content': message.content,
-                'message_sender': message.sender,
-                'message_timestamp': message.timestamp.isoformat() if message.timestamp else None,
-                'pinned_by': pin.pinned_by,
-                'pinned_at': pin.pinned_at.isoformat()
-            })
-    
-    return jsonify(result)
+    return jsonify(get_pinned(group_id))
 
 @app.route('/groups/<int:group_id>/delete', methods=['POST'])
 def delete_group(group_id):
-    """Delete a group and all its members and messages (admin only)."""
+    """Delete a group (admin only). The group disappears at once; its messages, files and
+    other rows are removed by a background deletion job whose progress is returned."""
     try:
         if 'username' not in session:
             return jsonify({'success': False, 'error': 'Not logged in'}), 401
         group = Group.query.get(group_id)
         if not group:
             return jsonify({'success': False, 'error': 'Group not found'}), 404
-        admin = GroupMember.query.filter_by(group_id=group_id, username=session['username'], is_admin=True).first()
+        admin = is_group_admin(group_id, session['username'])
         if not admin:
             return jsonify({'success': False, 'error': 'Only admins can delete group'}), 403
         
-        # Delete all pinned messages
-        PinnedMessage.query.filter_by(group_id=group_id).delete()
-        
-        # Delete all group messages
-        group_room = f'group-{group_id}'
-        Message.query.filter_by(recipients=group_room).delete()
-        # Delete all group members
-        GroupMember.query.filter_by(group_id=group_id).delete()
-        # Delete all group mutes
-        GroupMute.query.filter_by(group_id=group_id).delete()
-        # Delete the group itself
+        if group.icon and group.icon.startswith('group_'):
+            remove_file_quietly(os.path.join('static/group_photos/', group.icon))
+        # Only the group row goes now; member lists and history stop resolving with it
         db.session.delete(group)
-        db.session.commit()
-        return jsonify({'success': True})
+        job = queue_deletion('group', group_id, session['username'], label=group.name)
+        invalidate_group_fanout(group_id)
+        invalidate_group_access(group_id)
+        return jsonify({'success': True, 'job': job.to_dict()}), 202
     except Exception as e:
         import traceback
         print('Error deleting group:', e)
@@ -1982,76 +3111,1432 @@ class GroupActivity(db.Model):
         self.target = target
         self.details = details
 
-@app.route('/groups/<int:group_id>/mute', methods=['POST'])
-def mute_group(group_id):
-    if 'username' not in session:
-        return jsonify({'error': 'Not logged in'}), 401
-    if not GroupMute.query.filter_by(group_id=group_id, username=session['username']).first():
-        mute = GroupMute(group_id=group_id, username=session['username'])
-        db.session.add(mute)
-        db.session.commit()
-    return jsonify({'success': True, 'muted': True})
+class MessageMention(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False, index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    username = db.Column(db.String(80), db.ForeignKey('user.username'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.UniqueConstraint('message_id', 'username', name='uniq_message_mention'),
+        db.Index('ix_mention_user_group', 'username', 'group_id', 'message_id'),
+    )
 
-@app.route('/groups/<int:group_id>/unmute', methods=['POST'])
-def unmute_group(group_id):
-    if 'username' not in session:
-        return jsonify({'error': 'Not logged in'}), 401
-    mute = GroupMute.query.filter_by(group_id=group_id, username=session['username']).first()
-    if mute:
-        db.session.delete(mute)
+    def __init__(self, message_id, group_id, username):
+        self.message_id = message_id
+        self.group_id = group_id
+        self.username = username
+
+class JobCursor(db.Model):
+    """Resume point and counters of a batched background job, one row per job name."""
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, default=0, nullable=False)
+    processed = db.Column(db.Integer, default=0, nullable=False)
+    changed = db.Column(db.Integer, default=0, nullable=False)
+    failed = db.Column(db.Integer, default=0, nullable=False)
+    status = db.Column(db.String(20), default='idle', nullable=False)  # 'idle', 'running' or 'done'
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, name):
+        self.name = name
+        self.last_id = 0
+        self.processed = 0
+        self.changed = 0
+        self.failed = 0
+        self.status = 'idle'
+
+    def reset(self):
+        self.last_id = self.processed = self.changed = self.failed = 0
+        self.status = 'idle'
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'last_id': self.last_id,
+            'processed': self.processed,
+            'changed': self.changed,
+            'failed': self.failed,
+            'status': self.status,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+# --- Message re-encryption job ---
+REENCRYPT_JOB = 'reencrypt_messages'
+reencrypt_job_running = False
+
+def get_job_cursor(name):
+    cursor = JobCursor.query.get(name)
+    if cursor is None:
+        cursor = JobCursor(name)
+        db.session.add(cursor)
+    return cursor
+
+def reencrypt_batch(batch_size):
+    """Re-encrypt the next batch of messages after the job cursor; returns True when none are left."""
+    cursor = get_job_cursor(REENCRYPT_JOB)
+    rows = (
+        db.session.query(Message.id, Message.content)
+        .filter(Message.id > cursor.last_id, Message.content.isnot(None))
+        .order_by(Message.id)
+        .limit(batch_size)
+        .all()
+    )
+    if not rows:
+        cursor.status = 'done'
         db.session.commit()
-    return jsonify({'success': True, 'muted': False})
+        return True
+    updates = []
+    for msg_id, content in rows:
+        try:
+            new_content = reencrypt_message(content)
+        except Exception:
+            cursor.failed += 1
+            continue
+        if new_content is not None:
+            updates.append({'msg_id': msg_id, 'new_content': new_content})
+    if updates:
+        table = Message.__table__
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('msg_id')).values(content=db.bindparam('new_content', type_=CipherText())),
+            updates
+        )
+    cursor.last_id = rows[-1].id
+    cursor.processed += len(rows)
+    cursor.changed += len(updates)
+    cursor.status = 'running'
+    db.session.commit()
+    return False
 
-@app.route('/api/groups/<int:group_id>/files', methods=['GET'])
-def get_group_files(group_id):
-    """Get all files shared in a group."""
-    if 'username' not in session:
-        return jsonify({'error': 'Not logged in'}), 401
-    
-    username = session['username']
+def run_reencryption_job():
+    """Background task: walk every message in batches, yielding between them."""
+    global reencrypt_job_running
+    try:
+        with app.app_context():
+            while not reencrypt_batch(app.config['REENCRYPT_BATCH_SIZE']):
+                socketio.sleep(app.config['REENCRYPT_PAUSE'])
+            cursor = get_job_cursor(REENCRYPT_JOB)
+            print(f"Re-encryption finished: {cursor.changed} of {cursor.processed} messages rewritten, {cursor.failed} failed")
+    except Exception as e:
+        print(f"Re-encryption job stopped: {e}")
+    finally:
+        reencrypt_job_running = False
+
+def start_reencryption(rotate=False, restart=False):
+    """Optionally rotate the message key, then start (or resume) the background job."""
+    global reencrypt_job_running
+    if reencrypt_job_running:
+        return False
+    if rotate:
+        get_message_keyring().rotate()
+        restart = True
+    cursor = get_job_cursor(REENCRYPT_JOB)
+    if restart or cursor.status == 'done':
+        cursor.reset()
+    cursor.status = 'running'
+    cursor.started_at = datetime.utcnow()
+    db.session.commit()
+    reencrypt_job_running = True
+    socketio.start_background_task(run_reencryption_job)
+    return True
+
+# --- Usage statistics (daily rollups for the admin dashboard) ---
+# Extension -> type bucket, shared by the group file browser and the file-type rollups
+FILE_CATEGORIES = {
+    'image': {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg', 'heic', 'jfif'},
+    'video': {'mp4', 'webm', 'mov', 'avi', 'mkv'},
+    'audio': {'mp3', 'wav', 'ogg'},
+    'document': {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'csv'},
+    'archive': {'zip', 'rar', '7z', 'tar'},
+}
+# Group activity notices are bookkeeping, not usage
+STATS_IGNORED_SENDERS = ('System',)
+
+def file_category(filename):
+    """'image', 'video', 'audio', 'document', 'archive' or 'other', from the extension."""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    for category, extensions in FILE_CATEGORIES.items():
+        if extension in extensions:
+            return category
+    return 'other'
+
+def file_size_on_disk(filename):
+    try:
+        return os.path.getsize(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    except OSError:
+        return 0
+
+class DailyStat(db.Model):
+    """Counters for one day and one user, group, file type or the whole server (kind 'total', key '')."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'user', 'group', 'file_type' or 'total'
+    day = db.Column(db.Date, nullable=False)
+    key = db.Column(db.String(80), nullable=False, default='')  # username, group id or file category
+    messages = db.Column(db.Integer, default=0, nullable=False)
+    files = db.Column(db.Integer, default=0, nullable=False)
+    stored_bytes = db.Column(db.Integer, default=0, nullable=False)
+    __table_args__ = (db.UniqueConstraint('kind', 'day', 'key', name='uniq_daily_stat'),)
+
+def bump_daily_stats(day, keys, messages=0, files=0, stored_bytes=0):
+    """Add to the day's counters of every (kind, key) in keys with one upsert.
+
+    Runs in the caller's transaction, so the rollups commit or roll back
+    together with the change they count.
+    """
+    from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(DailyStat).values([
+        {'day': day, 'kind': kind, 'key': key, 'messages': messages, 'files': files, 'stored_bytes': stored_bytes}
+        for kind, key in keys
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['kind', 'day', 'key'],
+        set_={name: getattr(DailyStat, name) + getattr(stmt.excluded, name) for name in ('messages', 'files', 'stored_bytes')}
+    )
+    db.session.execute(stmt)
+
+def bump_daily_message_counts(counts):
+    """Add {(kind, day, key): messages} to the rollups, 500 rows per upsert; for bulk writers like the importer."""
+    from sqlalchemy.dialects.sqlite import insert
+    rows = [{'day': day, 'kind': kind, 'key': key, 'messages': n, 'files': 0, 'stored_bytes': 0}
+            for (kind, day, key), n in counts.items()]
+    for i in range(0, len(rows), 500):
+        stmt = insert(DailyStat).values(rows[i:i + 500])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['kind', 'day', 'key'],
+            set_={'messages': DailyStat.messages + stmt.excluded.messages}
+        )
+        db.session.execute(stmt)
+
+def message_stat_keys(sender, group_id):
+    keys = [('total', ''), ('user', sender)]
+    if group_id:
+        keys.append(('group', str(group_id)))
+    return keys
+
+def record_message_stats(msg, sign=1):
+    """Count a sent message (sign=-1 takes a hard-deleted one back out)."""
+    if msg.sender in STATS_IGNORED_SENDERS:
+        return
+    day = (msg.timestamp or datetime.utcnow()).date()
+    bump_daily_stats(day, message_stat_keys(msg.sender, msg.group_id), messages=sign)
+
+def forget_message_stats(*criteria):
+    """Take every message matching criteria out of the rollups; call before bulk-deleting them."""
+    rows = (
+        db.session.query(func.date(Message.timestamp), Message.sender, Message.group_id, func.count(Message.id))
+        .filter(*criteria, Message.sender.notin_(STATS_IGNORED_SENDERS))
+        .group_by(func.date(Message.timestamp), Message.sender, Message.group_id)
+        .all()
+    )
+    for day, sender, group_id, count in rows:
+        bump_daily_stats(datetime.strptime(day, '%Y-%m-%d').date(), message_stat_keys(sender, group_id), messages=-count)
+
+def record_file_stats(file, size, sign=1):
+    """Count an uploaded file of `size` bytes (sign=-1 when it is deleted)."""
+    day = (file.timestamp or datetime.utcnow()).date()
+    keys = [('total', ''), ('user', file.uploader), ('file_type', file_category(file.original_name))]
+    bump_daily_stats(day, keys, files=sign, stored_bytes=sign * size)
+
+def rebuild_daily_stats(commit=True):
+    """Recompute every rollup from Message (hot and archived) and File; returns the number of rows written."""
+    from sqlalchemy.dialects.sqlite import insert
+    counters = defaultdict(lambda: [0, 0, 0])  # (kind, day, key) -> [messages, files, stored_bytes]
+    day_column = func.date(Message.timestamp)
+    rows = (
+        db.session.query(day_column, Message.sender, Message.group_id, func.count(Message.id))
+        .filter(Message.sender.notin_(STATS_IGNORED_SENDERS), Message.timestamp.isnot(None))
+        .group_by(day_column, Message.sender, Message.group_id)
+    )
+    archived = archive_message_table
+    archived_day = func.date(archived.c.timestamp)
+    for (month,) in db.session.query(ArchiveMonth.month):
+        rows = itertools.chain(rows, archived_rows(month, (
+            select(archived_day, archived.c.sender, archived.c.group_id, func.count(archived.c.id))
+            .where(archived.c.sender.notin_(STATS_IGNORED_SENDERS), archived.c.timestamp.isnot(None))
+            .group_by(archived_day, archived.c.sender, archived.c.group_id)
+        )))
+    for day, sender, group_id, count, *_ in rows:
+        for kind, key in message_stat_keys(sender, group_id):
+            counters[(kind, day, key)][0] += count
+    files = db.session.query(File.filename, File.original_name, File.uploader, File.timestamp).filter(File.timestamp.isnot(None))
+    for filename, original_name, uploader, timestamp in files.yield_per(1000):
+        size = file_size_on_disk(filename)
+        day = timestamp.strftime('%Y-%m-%d')
+        for kind, key in (('total', ''), ('user', uploader), ('file_type', file_category(original_name))):
+            counter = counters[(kind, day, key)]
+            counter[1] += 1
+            counter[2] += size
+    DailyStat.query.delete()
+    if counters:
+        db.session.execute(insert(DailyStat), [
+            {'kind': kind, 'day': datetime.strptime(day, '%Y-%m-%d').date(), 'key': key,
+             'messages': messages, 'files': file_count, 'stored_bytes': stored_bytes}
+            for (kind, day, key), (messages, file_count, stored_bytes) in counters.items()
+        ])
+    if commit:
+        db.session.commit()
+    return len(counters)
+
+# --- Message archive (per-month SQLite files, read through on demand) ---
+class ArchiveMonth(db.Model):
+    """Manifest row for one month of messages moved into ARCHIVE_FOLDER/messages-<month>.db."""
+    month = db.Column(db.String(7), primary_key=True)  # 'YYYY-MM'
+    min_id = db.Column(db.Integer, nullable=False)
+    max_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'month': self.month,
+            'file': os.path.basename(archive_path(self.month)),
+            'min_id': self.min_id,
+            'max_id': self.max_id,
+            'messages': self.message_count,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+# Which conversations each archive month holds, so reads skip months that cannot match.
+# One row per (month, sender, recipients, group_id); id, timestamp and file_id are the
+# newest/highest of that conversation in the month. See archive_months
+archive_conversation_table = db.Table(
+    'archive_conversation',
+    db.Column('month', db.String(7), nullable=False, index=True),
+    db.Column('sender', db.String(80), nullable=False),
+    db.Column('recipients', db.String(255), nullable=False),
+    db.Column('group_id', db.Integer, nullable=True),
+    db.Column('id', db.Integer, nullable=False),
+    db.Column('timestamp', db.DateTime, nullable=True),
+    db.Column('file_id', db.Integer, nullable=True),
+)
+
+# Archive files hold copies of the message and file tables, without foreign keys
+archive_metadata = db.MetaData()
+archive_message_table = db.Table(
+    'message', archive_metadata,
+    *[db.Column(c.name, c.type, primary_key=c.primary_key) for c in Message.__table__.columns],
+    db.Index('ix_archive_message_recipients', 'recipients', 'id'),
+    db.Index('ix_archive_message_group', 'group_id', 'id'),
+    db.Index('ix_archive_message_sender', 'sender', 'id'),
+    db.Index('ix_archive_message_timestamp', 'timestamp', 'id'),
+)
+archive_file_table = db.Table(
+    'file', archive_metadata,
+    *[db.Column(c.name, c.type, primary_key=c.primary_key) for c in File.__table__.columns]
+)
+# archive path -> engine, opened on first read
+archive_engines = {}
+
+def archive_path(month):
+    return os.path.join(app.config['ARCHIVE_FOLDER'], f'messages-{month}.db')
+
+def archive_engine(month):
+    path = os.path.abspath(archive_path(month))
+    engine = archive_engines.get(path)
+    if engine is None:
+        engine = archive_engines[path] = create_engine(f'sqlite:///{path}')
+    return engine
+
+def archived_rows(month, stmt):
+    """Run a select against one archive; rows carry an extra archive_month attribute."""
+    stmt = stmt.add_columns(literal(month).label('archive_month'))
+    with archive_engine(month).connect() as conn:
+        return conn.execute(stmt).all()
+
+def archive_months(criteria):
+    """ArchiveMonth query for the months that may hold messages matching criteria(t).
+
+    criteria also runs against archive_conversation. Its id, timestamp and
+    file_id are per-conversation maxima, so the lower bounds and "has a file"
+    tests the criteria use still keep every month that could match. Months
+    archived before the index existed are always read.
+    """
+    c = archive_conversation_table.c
+    return ArchiveMonth.query.filter(or_(
+        ArchiveMonth.month.in_(select(c.month).where(*criteria(c))),
+        ArchiveMonth.month.notin_(select(c.month)),
+    ))
+
+def index_archive_month(month):
+    """Rebuild archive_conversation for one month from its archive file; the caller commits."""
+    t = archive_message_table
+    with archive_engine(month).connect() as conn:
+        rows = conn.execute(
+            select(t.c.sender, t.c.recipients, t.c.group_id,
+                   func.max(t.c.id), func.max(t.c.timestamp), func.max(t.c.file_id))
+            .group_by(t.c.sender, t.c.recipients, t.c.group_id)
+        ).all()
+    c = archive_conversation_table
+    db.session.execute(c.delete().where(c.c.month == month))
+    if rows:
+        db.session.execute(c.insert(), [
+            {'month': month, 'sender': sender, 'recipients': recipients, 'group_id': group_id,
+             'id': max_id, 'timestamp': timestamp, 'file_id': file_id}
+            for sender, recipients, group_id, max_id, timestamp, file_id in rows
+        ])
+
+def conversation_key(m):
+    """Sort key of a message within a conversation: (timestamp, id)."""
+    return (m.timestamp or datetime.min, m.id)
+
+def keyset_before(t, cursor):
+    timestamp, msg_id = cursor
+    return or_(t.timestamp < timestamp, and_(t.timestamp == timestamp, t.id < msg_id))
+
+def keyset_after(t, cursor):
+    timestamp, msg_id = cursor
+    return or_(t.timestamp > timestamp, and_(t.timestamp == timestamp, t.id > msg_id))
+
+def message_cursor(msg_id):
+    """conversation_key of a message (hot or archived) for keyset paging, or None if it is gone."""
+    m = find_message(msg_id)
+    return conversation_key(m) if m is not None else None
+
+def read_through(criteria, limit, before=None, hidden_for=None):
+    """Up to `limit` messages matching criteria, newest first, from the hot table and the archives.
+
+    Order and the `before` cursor are conversation_key, (timestamp, id):
+    imported history gets new ids but keeps its timestamps, so ids alone do
+    not follow the conversation. criteria(t) gets Message or an archive
+    table's columns and returns filter expressions, so one definition serves
+    both, and archive_months skips the months that hold none of it. Archived
+    messages come back as read-only rows; serialize_message handles both.
+    """
+    query = Message.query.filter(*criteria(Message))
+    if hidden_for:
+        query = query.filter(~Message.id.in_(db.session.query(HiddenMessage.msg_id).filter(HiddenMessage.username == hidden_for)))
+    if before is not None:
+        query = query.filter(keyset_before(Message, before))
+    rows = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit).all()
+    # Pinned and imported messages stay hot with any timestamp, so merge with the archives
+    t = archive_message_table
+    months = archive_months(criteria).order_by(ArchiveMonth.month.desc())
+    if before is not None:
+        months = months.filter(ArchiveMonth.month <= f'{before[0]:%Y-%m}')
+    for month in months.all():
+        floor = conversation_key(rows[-1]) if len(rows) >= limit else None
+        if floor is not None and month.month < f'{floor[0]:%Y-%m}':
+            break
+        # Hidden rows are dropped after the LIMIT, so keep reading this month until
+        # the page is full or the month runs out; otherwise older hot rows skip ahead
+        cursor = before
+        while True:
+            stmt = select(t).where(*criteria(t.c))
+            if cursor is not None:
+                stmt = stmt.where(keyset_before(t.c, cursor))
+            if floor is not None:
+                stmt = stmt.where(keyset_after(t.c, floor))
+            found = archived_rows(month.month, stmt.order_by(t.c.timestamp.desc(), t.c.id.desc()).limit(limit))
+            if not found:
+                break
+            cursor = conversation_key(found[-1])
+            exhausted = len(found) < limit
+            if hidden_for:
+                hidden = {msg_id for (msg_id,) in db.session.query(HiddenMessage.msg_id).filter(
+                    HiddenMessage.username == hidden_for, HiddenMessage.msg_id.in_([r.id for r in found]))}
+                found = [r for r in found if r.id not in hidden]
+            rows = sorted(rows + found, key=conversation_key, reverse=True)[:limit]
+            floor = conversation_key(rows[-1]) if len(rows) >= limit else None
+            if exhausted or (floor is not None and cursor <= floor):
+                break
+    return rows
+
+def find_message(msg_id):
+    """A message by id from the hot table, or from the archive month whose id range covers it."""
+    msg = Message.query.get(msg_id)
+    if msg is not None:
+        return msg
+    t = archive_message_table
+    months = ArchiveMonth.query.filter(ArchiveMonth.min_id <= msg_id, ArchiveMonth.max_id >= msg_id)
+    for month in months.all():
+        found = archived_rows(month.month, select(t).where(t.c.id == msg_id))
+        if found:
+            return found[0]
+    return None
+
+def find_file(file_id, month=None):
+    """File metadata from the hot table, else from the archive copy (one month's, or any)."""
+    file = File.query.get(file_id)
+    if file is not None:
+        return file
+    t = archive_file_table
+    months = [month] if month else [m for (m,) in db.session.query(ArchiveMonth.month)]
+    for month in months:
+        found = archived_rows(month, select(t).where(t.c.id == file_id))
+        if found:
+            return found[0]
+    return None
+
+def archivable_months(cutoff):
+    """[(month, count)] of messages older than cutoff that can move; pinned messages stay hot."""
+    month_column = func.strftime('%Y-%m', Message.timestamp)
+    return (
+        db.session.query(month_column, func.count(Message.id))
+        .filter(Message.timestamp < cutoff, ~Message.id.in_(db.session.query(PinnedMessage.message_id)))
+        .group_by(month_column)
+        .order_by(month_column)
+        .all()
+    )
+
+def move_to_archive(month, ids):
+    """Copy messages (and their files' metadata) into the attached month archive and delete them, atomically."""
+    id_list = ','.join(str(int(i)) for i in ids)
+    columns = ', '.join(c.name for c in Message.__table__.columns)
+    file_columns = ', '.join(c.name for c in File.__table__.columns)
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('ATTACH DATABASE ? AS archive', (os.path.abspath(archive_path(month)),))
+        try:
+            conn.exec_driver_sql(f'INSERT OR IGNORE INTO archive.message ({columns}) '
+                                 f'SELECT {columns} FROM main.message WHERE id IN ({id_list})')
+            conn.exec_driver_sql(f'INSERT OR IGNORE INTO archive.file ({file_columns}) SELECT {file_columns} FROM main.file '
+                                 f'WHERE id IN (SELECT file_id FROM main.message WHERE id IN ({id_list}))')
+            conn.exec_driver_sql(f'DELETE FROM main.message_mention WHERE message_id IN ({id_list})')
+            conn.exec_driver_sql(f'DELETE FROM main.message WHERE id IN ({id_list})')
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql('DETACH DATABASE archive')
+
+def archive_messages(older_than_days=None, batch_size=None):
+    """Move messages older than the cutoff into per-month archive files; returns {month: moved}.
+
+    Batches commit independently and re-running skips rows already copied, so
+    an interrupted run is safe to repeat.
+    """
+    days = app.config['ARCHIVE_AFTER_DAYS'] if older_than_days is None else older_than_days
+    batch_size = batch_size or app.config['ARCHIVE_BATCH_SIZE']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    os.makedirs(app.config['ARCHIVE_FOLDER'], exist_ok=True)
+    month_column = func.strftime('%Y-%m', Message.timestamp)
+    pinned = db.session.query(PinnedMessage.message_id)
+    moved = {}
+    for month, _ in archivable_months(cutoff):
+        archive_metadata.create_all(archive_engine(month))
+        moved[month] = 0
+        while True:
+            ids = [msg_id for (msg_id,) in (
+                db.session.query(Message.id)
+                .filter(Message.timestamp < cutoff, month_column == month, ~Message.id.in_(pinned))
+                .order_by(Message.id)
+                .limit(batch_size)
+            )]
+            db.session.commit()
+            if not ids:
+                break
+            move_to_archive(month, ids)
+            moved[month] += len(ids)
+        t = archive_message_table
+        with archive_engine(month).connect() as conn:
+            count, min_id, max_id = conn.execute(select(func.count(), func.min(t.c.id), func.max(t.c.id))).one()
+        entry = ArchiveMonth.query.get(month) or ArchiveMonth(month=month)
+        entry.message_count, entry.min_id, entry.max_id = count, min_id, max_id
+        db.session.add(entry)
+        index_archive_month(month)
+        db.session.commit()
+        print(f"Archived {moved[month]} messages into {archive_path(month)}")
+    # Index months archived before archive_conversation existed
+    indexed = select(archive_conversation_table.c.month)
+    for (month,) in db.session.query(ArchiveMonth.month).filter(ArchiveMonth.month.notin_(indexed)).all():
+        index_archive_month(month)
+        db.session.commit()
+        print(f"Indexed the conversations of {archive_path(month)}")
+    return moved
+
+# --- Background deletion jobs (groups and users) ---
+class DeletionJob(db.Model):
+    """A queued group or user deletion; the worker removes related rows step by step in small batches."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'group' or 'user'
+    target = db.Column(db.String(80), nullable=False)  # group id or username
+    label = db.Column(db.String(120), nullable=True)  # group name, for progress displays
+    requested_by = db.Column(db.String(80), nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # 'queued', 'running', 'done' or 'failed'
+    step = db.Column(db.String(30), nullable=True)
+    deleted = db.Column(db.Integer, default=0, nullable=False)  # rows removed so far
+    files_removed = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, kind, target, requested_by, label=None):
+        self.kind = kind
+        self.target = str(target)
+        self.requested_by = requested_by
+        self.label = label
+        self.status = 'queued'
+        self.deleted = 0
+        self.files_removed = 0
+
+    def to_dict(self):
+        steps = [name for name, _ in deletion_steps(self)]
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'target': self.target,
+            'label': self.label,
+            'requested_by': self.requested_by,
+            'status': self.status,
+            'step': self.step,
+            'steps_done': len(steps) if self.status == 'done' else (steps.index(self.step) if self.step in steps else 0),
+            'steps_total': len(steps),
+            'deleted': self.deleted,
+            'files_removed': self.files_removed,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+deletion_worker_running = False
+
+# A step takes a batch limit and returns (rows deleted, file paths to unlink, group ids
+# whose cached members and pins to drop); the worker does the last two after committing.
+
+def delete_rows(model, *criteria):
+    """Step: delete up to `limit` rows of model matching criteria."""
+    def step(limit):
+        ids = [row_id for (row_id,) in db.session.query(model.id).filter(*criteria).limit(limit)]
+        if ids:
+            model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        return len(ids), (), ()
+    return step
+
+def delete_messages(*criteria):
+    """Step: delete a batch of messages with their mentions, hides and pins, keeping the usage rollups right."""
+    def step(limit):
+        ids = [msg_id for (msg_id,) in db.session.query(Message.id).filter(*criteria).limit(limit)]
+        groups = ()
+        if ids:
+            forget_message_stats(Message.id.in_(ids))
+            groups = [group_id for (group_id,) in db.session.query(PinnedMessage.group_id).filter(
+                PinnedMessage.message_id.in_(ids)).distinct()]
+            for model, column in ((MessageMention, MessageMention.message_id), (HiddenMessage, HiddenMessage.msg_id),
+                                  (PinnedMessage, PinnedMessage.message_id)):
+                model.query.filter(column.in_(ids)).delete(synchronize_session=False)
+            Message.query.filter(Message.id.in_(ids)).delete(synchronize_session=False)
+        return len(ids), (), groups
+    return step
+
+def delete_archived_messages(criteria):
+    """Step: delete a batch of archived messages matching criteria(t) from the oldest archive that has any."""
+    def step(limit):
+        t = archive_message_table
+        for entry in ArchiveMonth.query.order_by(ArchiveMonth.month).all():
+            rows = archived_rows(entry.month, select(t.c.id, t.c.timestamp, t.c.sender, t.c.group_id).where(*criteria(t.c)).limit(limit))
+            if not rows:
+                continue
+            with archive_engine(entry.month).begin() as conn:
+                conn.execute(t.delete().where(t.c.id.in_([row.id for row in rows])))
+            counts = Counter((row.timestamp.date(), row.sender, row.group_id) for row in rows
+                             if row.timestamp and row.sender not in STATS_IGNORED_SENDERS)
+            for (day, sender, group_id), count in counts.items():
+                bump_daily_stats(day, message_stat_keys(sender, group_id), messages=-count)
+            entry.message_count -= len(rows)
+            return len(rows), (), ()
+        return 0, (), ()
+    return step
+
+def delete_files(*criteria):
+    """Step: delete a batch of File rows; the worker unlinks the returned paths after committing."""
+    def step(limit):
+        files = File.query.filter(*criteria).limit(limit).all()
+        paths = []
+        for file in files:
+            record_file_stats(file, file_size_on_disk(file.filename), -1)
+            paths.append(os.path.join(app.config['UPLOAD_FOLDER'], file.filename))
+            db.session.delete(file)
+        return len(files), paths, ()
+    return step
+
+def group_only_file_ids(room):
+    """Ids of files that messages of room reference, hot or archived, and no other conversation does."""
+    t = archive_message_table
+    months = [month for (month,) in db.session.query(ArchiveMonth.month)]
+    ids = {file_id for (file_id,) in db.session.query(Message.file_id).filter(
+        Message.recipients == room, Message.file_id.isnot(None)).distinct()}
+    for month in months:
+        ids.update(row.file_id for row in archived_rows(
+            month, select(t.c.file_id).where(t.c.recipients == room, t.c.file_id.isnot(None)).distinct()))
+    ids = sorted(ids)
+    shared = set()
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        shared.update(file_id for (file_id,) in db.session.query(Message.file_id).filter(
+            Message.recipients != room, Message.file_id.in_(chunk)))
+        for month in months:
+            shared.update(row.file_id for row in archived_rows(
+                month, select(t.c.file_id).where(t.c.recipients != room, t.c.file_id.in_(chunk))))
+    return [file_id for file_id in ids if file_id not in shared]
+
+def delete_group_files(room):
+    """Step: delete the files only this group's messages reference, found on the first batch."""
+    ids = None
+    def step(limit):
+        nonlocal ids
+        if ids is None:
+            ids = group_only_file_ids(room)
+        return delete_files(File.id.in_(ids))(limit)
+    return step
+
+def delete_pins(*criteria):
+    """Step: delete a batch of pins; the worker refreshes the cached pin list of each group."""
+    def step(limit):
+        pins = PinnedMessage.query.filter(*criteria).limit(limit).all()
+        for pin in pins:
+            db.session.delete(pin)
+        return len(pins), (), {pin.group_id for pin in pins}
+    return step
+
+def delete_memberships(username):
+    """Step: remove a user's group memberships; the worker refreshes the cached members of each group."""
+    def step(limit):
+        members = GroupMember.query.filter_by(username=username).limit(limit).all()
+        for member in members:
+            db.session.delete(member)
+        return len(members), (), {member.group_id for member in members}
+    return step
+
+def deletion_steps(job):
+    """Ordered (name, step) pairs for a job; every step is idempotent, so a failed job can rerun from its step."""
+    if job.kind == 'group':
+        group_id = int(job.target)
+        room = f'group-{group_id}'
+        return [
+            ('files', delete_group_files(room)),
+            ('messages', delete_messages(Message.recipients == room)),
+            ('archived_messages', delete_archived_messages(lambda t: (t.recipients == room,))),
+            ('mentions', delete_rows(MessageMention, MessageMention.group_id == group_id)),
+            ('pins', delete_pins(PinnedMessage.group_id == group_id)),
+            ('activity', delete_rows(GroupActivity, GroupActivity.group_id == group_id)),
+            ('members', delete_rows(GroupMember, GroupMember.group_id == group_id)),
+            ('mutes', delete_rows(GroupMute, GroupMute.group_id == group_id)),
+            ('chat_clears', delete_rows(ChatClear, ChatClear.conversation == room)),
+        ]
+    username = job.target
+    own_messages = lambda t: (or_(t.sender == username, and_(t.group_id.is_(None), t.recipients == username)),)
+    return [
+        ('files', delete_files(File.uploader == username)),
+        ('messages', delete_messages(*own_messages(Message))),
+        ('archived_messages', delete_archived_messages(own_messages)),
+        ('mentions', delete_rows(MessageMention, MessageMention.username == username)),
+        ('hidden', delete_rows(HiddenMessage, HiddenMessage.username == username)),
+        ('pins', delete_pins(PinnedMessage.pinned_by == username)),
+        ('activity', delete_rows(GroupActivity, GroupActivity.actor == username)),
+        ('members', delete_memberships(username)),
+        ('mutes', delete_rows(GroupMute, GroupMute.username == username)),
+        ('chat_clears', delete_rows(ChatClear, ChatClear.username == username)),
+        ('reset_requests', delete_rows(PasswordResetRequest, PasswordResetRequest.username == username)),
+        ('signup_requests', delete_rows(UserRequest, UserRequest.username == username)),
+    ]
+
+def run_deletion_job(job):
+    """Run a job's steps from its current one; each batch commits on its own and then yields."""
+    steps = deletion_steps(job)
+    names = [name for name, _ in steps]
+    job.status = 'running'
+    db.session.commit()
+    try:
+        for name, step in steps[names.index(job.step) if job.step in names else 0:]:
+            job.step = name
+            db.session.commit()
+            while True:
+                count, paths, groups = step(app.config['DELETION_BATCH_SIZE'])
+                if not count:
+                    break
+                job.deleted += count
+                db.session.commit()
+                # Only now, so a request in between cannot cache the rows again
+                for group_id in groups:
+                    invalidate_group_fanout(group_id)
+                    invalidate_group_access(group_id)
+                    invalidate_pinned(group_id)
+                for path in paths:
+                    try:
+                        os.remove(path)
+                        job.files_removed += 1
+                    except OSError:
+                        pass  # already gone
+                socketio.sleep(app.config['DELETION_PAUSE'])
+        job.status = 'done'
+        job.step = None
+        job.finished_at = datetime.utcnow()
+        print(f"Deletion job {job.id} ({job.kind} {job.target}) finished: {job.deleted} rows, {job.files_removed} files")
+    except Exception as e:
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(e)
+        print(f"Deletion job {job.id} ({job.kind} {job.target}) failed at {job.step}: {e}")
+    db.session.commit()
+
+def run_deletion_worker():
+    """Background task: run queued (and interrupted) deletion jobs oldest first until none are left."""
+    global deletion_worker_running
+    try:
+        with app.app_context():
+            while True:
+                job = (DeletionJob.query.filter(DeletionJob.status.in_(('queued', 'running')))
+                       .order_by(DeletionJob.id).first())
+                if job is None:
+                    break
+                run_deletion_job(job)
+    except Exception as e:
+        print(f"Deletion worker stopped: {e}")
+    finally:
+        deletion_worker_running = False
+
+def start_deletion_worker():
+    global deletion_worker_running
+    if deletion_worker_running:
+        return False
+    deletion_worker_running = True
+    socketio.start_background_task(run_deletion_worker)
+    return True
+
+def queue_deletion(kind, target, requested_by, label=None):
+    """Record a deletion job and make sure the worker is running; returns the job.
+
+    Callers delete the group or user row in the same session, so the row and
+    the job that cleans up after it commit together.
+    """
+    job = DeletionJob(kind, target, requested_by, label)
+    db.session.add(job)
+    db.session.commit()
+    start_deletion_worker()
+    return job
+
+def next_group_id():
+    """Id for a new group, never one a deletion job has used.
+
+    SQLite would hand out max(id) + 1, so a group created right after the
+    newest one was deleted got its id, along with the members, messages and
+    pins the job still had to remove by group id.
+    """
+    from sqlalchemy import Integer, cast
+    newest = db.session.query(func.max(Group.id)).scalar() or 0
+    deleted = db.session.query(func.max(cast(DeletionJob.target, Integer))).filter(DeletionJob.kind == 'group').scalar() or 0
+    return max(newest, deleted) + 1
+
+def pending_user_deletions():
+    """Usernames whose deletion job has not finished; they cannot be created again until it has."""
+    return {target for (target,) in db.session.query(DeletionJob.target).filter(
+        DeletionJob.kind == 'user', DeletionJob.status != 'done')}
+
+def user_deletion_pending(username):
+    return db.session.query(DeletionJob.id).filter(
+        DeletionJob.kind == 'user', DeletionJob.target == username, DeletionJob.status != 'done').first() is not None
+
+def remove_file_quietly(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        print(f"Error removing {path}: {e}")
+
+# --- Orphan file collection (see gc_files.py) ---
+class OrphanScan(db.Model):
+    """Resumable position of the orphan scan in one folder, with what the current pass found."""
+    folder = db.Column(db.String(30), primary_key=True)  # key of orphan_folders()
+    last_name = db.Column(db.String(255), nullable=True)  # files are checked in name order
+    scanned = db.Column(db.Integer, default=0, nullable=False)
+    orphans = db.Column(db.Integer, default=0, nullable=False)
+    orphan_bytes = db.Column(db.Integer, default=0, nullable=False)
+    status = db.Column(db.String(20), default='idle', nullable=False)  # 'idle', 'running' or 'done'
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.reset()
+
+    def reset(self):
+        self.last_name = None
+        self.scanned = self.orphans = self.orphan_bytes = 0
+        self.status = 'idle'
+
+    def to_dict(self):
+        return {
+            'folder': self.folder,
+            'last_name': self.last_name,
+            'scanned': self.scanned,
+            'orphans': self.orphans,
+            'orphan_bytes': self.orphan_bytes,
+            'status': self.status,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+class OrphanFile(db.Model):
+    """An unreferenced file moved into ORPHAN_QUARANTINE_FOLDER; purged once it has sat there long enough."""
+    id = db.Column(db.Integer, primary_key=True)
+    folder = db.Column(db.String(30), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.Integer, default=0, nullable=False)
+    quarantined_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def quarantine_path(self):
+        return os.path.join(app.config['ORPHAN_QUARANTINE_FOLDER'], self.folder, f'{self.id}_{self.filename}')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'folder': self.folder,
+            'filename': self.filename,
+            'size': self.size,
+            'quarantined_at': self.quarantined_at.isoformat() if self.quarantined_at else None,
+        }
+
+def orphan_folders():
+    """Folder key -> (directory, function returning which of a batch of names a row still references)."""
+    def referenced(column):
+        return lambda names: {name for (name,) in db.session.query(column).filter(column.in_(names))}
+    return {
+        'uploads': (app.config['UPLOAD_FOLDER'], referenced(File.filename)),
+        'profile_photos': (app.config['PROFILE_PHOTO_FOLDER'], referenced(User.profile_photo)),
+        'group_photos': ('static/group_photos/', referenced(Group.icon)),
+    }
+
+def list_folder(path):
+    """Sorted names of the regular files in a folder (empty if it does not exist)."""
+    try:
+        return sorted(entry.name for entry in os.scandir(path) if entry.is_file() and not entry.name.startswith('.'))
+    except FileNotFoundError:
+        return []
+
+def quarantine_file(folder, path, name, size):
+    orphan = OrphanFile(folder=folder, filename=name, size=size)
+    db.session.add(orphan)
+    db.session.flush()
+    os.makedirs(os.path.dirname(orphan.quarantine_path), exist_ok=True)
+    try:
+        os.replace(os.path.join(path, name), orphan.quarantine_path)
+    except OSError as e:
+        print(f"Could not quarantine {name}: {e}")
+        db.session.delete(orphan)
+
+def scan_orphans(folder, dry_run=False, batch_size=None):
+    """Check one folder against the database from its saved position; returns its OrphanScan.
+
+    Unreferenced files older than ORPHAN_GRACE_HOURS (so uploads still being
+    committed are safe) move to quarantine unless dry_run. Progress commits
+    after every batch, so an interrupted scan resumes where it stopped; a
+    dry run keeps no position and moves nothing.
+    """
+    path, referenced = orphan_folders()[folder]
+    batch_size = batch_size or app.config['ORPHAN_SCAN_BATCH_SIZE']
+    if dry_run:
+        cursor = OrphanScan(folder)
+    else:
+        cursor = OrphanScan.query.get(folder)
+        if cursor is None:
+            cursor = OrphanScan(folder)
+            db.session.add(cursor)
+    if cursor.status == 'done':
+        cursor.reset()
+    cursor.status = 'running'
+    newest = time.time() - app.config['ORPHAN_GRACE_HOURS'] * 3600
+    names = list_folder(path)
+    start = bisect.bisect_right(names, cursor.last_name) if cursor.last_name else 0
+    for i in range(start, len(names), batch_size):
+        batch = names[i:i + batch_size]
+        in_use = referenced(batch)
+        for name in batch:
+            if name in in_use:
+                continue
+            try:
+                stat = os.stat(os.path.join(path, name))
+            except OSError:
+                continue  # removed since the listing
+            if stat.st_mtime > newest:
+                continue
+            cursor.orphans += 1
+            cursor.orphan_bytes += stat.st_size
+            if not dry_run:
+                quarantine_file(folder, path, name, stat.st_size)
+        cursor.scanned += len(batch)
+        cursor.last_name = batch[-1]
+        db.session.commit()
+    cursor.status = 'done'
+    db.session.commit()
+    return cursor
+
+def purge_quarantine(older_than_days=None):
+    """Delete quarantined files older than ORPHAN_PURGE_AFTER_DAYS; returns (files, bytes) reclaimed."""
+    days = app.config['ORPHAN_PURGE_AFTER_DAYS'] if older_than_days is None else older_than_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    purged, reclaimed = 0, 0
+    for orphan in OrphanFile.query.filter(OrphanFile.quarantined_at <= cutoff).all():
+        try:
+            os.remove(orphan.quarantine_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Could not purge {orphan.quarantine_path}: {e}")
+            continue
+        purged += 1
+        reclaimed += orphan.size
+        db.session.delete(orphan)
+    db.session.commit()
+    return purged, reclaimed
+
+def restore_orphan(orphan):
+    """Move a quarantined file back where it was found (a row referencing it reappeared)."""
+    path = orphan_folders()[orphan.folder][0]
+    os.replace(orphan.quarantine_path, os.path.join(path, orphan.filename))
+    db.session.delete(orphan)
+    db.session.commit()
+
+def storage_report():
+    """Disk usage per scanned folder, the last scan of each, and what quarantine holds and can purge."""
+    folders = {}
+    for folder, (path, _) in orphan_folders().items():
+        sizes = []
+        for name in list_folder(path):
+            try:
+                sizes.append(os.path.getsize(os.path.join(path, name)))
+            except OSError:
+                pass
+        scan = OrphanScan.query.get(folder)
+        folders[folder] = {'files': len(sizes), 'bytes': sum(sizes), 'last_scan': scan.to_dict() if scan else None}
+    purge_cutoff = datetime.utcnow() - timedelta(days=app.config['ORPHAN_PURGE_AFTER_DAYS'])
+    quarantined = db.session.query(func.count(OrphanFile.id), func.coalesce(func.sum(OrphanFile.size), 0))
+    files, size = quarantined.one()
+    purgeable_files, purgeable_bytes = quarantined.filter(OrphanFile.quarantined_at <= purge_cutoff).one()
+    return {
+        'folders': folders,
+        'quarantine': {'files': files, 'bytes': size, 'purgeable_files': purgeable_files,
+                       'purgeable_bytes': purgeable_bytes},
+        'reclaimable_bytes': size,
+    }
+
+# --- Bulk history import (see import_history.py) ---
+class ImportJob(db.Model):
+    """One import of a JSONL file; offset/line point just past the last committed batch, so a rerun resumes there."""
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(500), nullable=False)  # absolute path of the JSONL file
+    offset = db.Column(db.Integer, default=0, nullable=False)
+    line = db.Column(db.Integer, default=0, nullable=False)
+    imported = db.Column(db.Integer, default=0, nullable=False)
+    files = db.Column(db.Integer, default=0, nullable=False)
+    skipped = db.Column(db.Integer, default=0, nullable=False)
+    user_map = db.Column(db.Text, nullable=True)  # JSON {source name: username}
+    group_map = db.Column(db.Text, nullable=True)  # JSON {source group id: group id}, grows as groups are created
+    deferred_indexes = db.Column(db.Text, nullable=True)  # JSON [CREATE INDEX ...] dropped for the run
+    status = db.Column(db.String(20), default='running', nullable=False)  # 'running', 'failed' or 'done'
+    error = db.Column(db.Text, nullable=True)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'source': self.source,
+            'line': self.line,
+            'imported': self.imported,
+            'files': self.files,
+            'skipped': self.skipped,
+            'status': self.status,
+            'error': self.error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class ImportedMessage(db.Model):
+    """Source message id -> Message.id of an import, so replies link up across batches and resumed runs."""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('import_job.id'), nullable=False)
+    source_id = db.Column(db.String(255), nullable=False)
+    message_id = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.UniqueConstraint('job_id', 'source_id', name='uniq_imported_message'),)
+
+# Tables whose secondary indexes are dropped during an import and rebuilt once at the end
+IMPORT_DEFERRED_INDEX_TABLES = ('message', 'file')
+
+def init_import_worker(config):
+    """Pool initializer: spawned workers (Windows) need the key settings; forked ones already have them.
+
+    Ctrl-C is left to the parent, which marks the job failed and stops the pool.
+    """
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    app.config.update(config)
+
+def encrypt_texts(texts):
+    """Worker task: encrypt a chunk of message texts (None/'' stay None)."""
+    return [encrypt_message(text) if text else None for text in texts]
+
+def parse_import_time(value):
+    """ISO 8601 (offset or 'Z' honoured) or Unix seconds -> naive UTC datetime; None if unusable."""
+    from datetime import timezone
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.utcfromtimestamp(value)
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def defer_import_indexes(job):
+    """Drop the non-unique indexes of IMPORT_DEFERRED_INDEX_TABLES, remembering them on the job."""
+    import json
+    tables = ', '.join(f"'{t}'" for t in IMPORT_DEFERRED_INDEX_TABLES)
+    rows = db.session.execute(db.text(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name IN ({tables}) "
+        "AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%'"
+    )).all()
+    saved = json.loads(job.deferred_indexes or '[]')
+    job.deferred_indexes = json.dumps(saved + [sql for _, sql in rows])
+    db.session.commit()
+    for name, _ in rows:
+        db.session.execute(db.text(f'DROP INDEX IF EXISTS "{name}"'))
+    db.session.commit()
+    return [name for name, _ in rows]
+
+def restore_import_indexes(job):
+    """Recreate the indexes defer_import_indexes dropped (also after a failed run)."""
+    import json
+    for sql in json.loads(job.deferred_indexes or '[]'):
+        db.session.execute(db.text(sql.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1)))
+    job.deferred_indexes = None
+    db.session.commit()
+
+class HistoryImport:
+    """Reads an import file in batches, maps users and groups, and writes messages with one insert per batch."""
+
+    def __init__(self, job, create_users=True, batch_size=None, warn_limit=20):
+        import json
+        self.job = job
+        self.base_dir = os.path.dirname(job.source)
+        self.create_users = create_users
+        self.batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+        self.user_map = json.loads(job.user_map or '{}')
+        self.group_map = json.loads(job.group_map or '{}')
+        self.usernames = {name for (name,) in db.session.query(User.username)}
+        # Names still being removed by a deletion job would lose the imported rows to it
+        self.deleting = pending_user_deletions()
+        self.warnings = 0
+        self.warn_limit = warn_limit
+
+    def warn(self, line, message):
+        self.warnings += 1
+        if self.warnings <= self.warn_limit:
+            print(f"[IMPORT] line {line}: {message}")
+        elif self.warnings == self.warn_limit + 1:
+            print("[IMPORT] further warnings suppressed")
+
+    def user(self, name, is_admin=False):
+        """Mapped username, creating the account (no password) if allowed; None when unknown."""
+        if not name:
+            return None
+        name = self.user_map.get(name, name)
+        if name not in self.usernames:
+            if not self.create_users or name in self.deleting:
+                return None
+            db.session.add(User(username=name, password='', is_admin=bool(is_admin), created_by='import'))
+            self.usernames.add(name)
+        return name
+
+    def group(self, record, line):
+        import json
+        key = str(record.get('id', ''))
+        if not key or not record.get('name'):
+            self.warn(line, 'group needs "id" and "name"')
+            return
+        if key in self.group_map:
+            return
+        creator = self.user(record.get('created_by')) or 'import'
+        group = Group(name=record['name'], created_by=creator, description=record.get('description'))
+        group.id = next_group_id()
+        group.created_at = parse_import_time(record.get('created_at')) or datetime.utcnow()
+        db.session.add(group)
+        db.session.flush()
+        admins = {self.user(name) for name in record.get('admins', [])}
+        for name in {self.user(name) for name in record.get('members', [])} | admins:
+            if name:
+                db.session.add(GroupMember(group_id=group.id, username=name, is_admin=name in admins))
+        self.group_map[key] = group.id
+        self.job.group_map = json.dumps(self.group_map)
+
+    def message(self, record, line):
+        """The record as insert-ready values (content still plain text), or None to skip it."""
+        sender = self.user(record.get('from'))
+        timestamp = parse_import_time(record.get('timestamp'))
+        if not sender or timestamp is None:
+            self.warn(line, 'message skipped: unknown sender or bad timestamp')
+            return None
+        if record.get('group') is not None:
+            group_id = self.group_map.get(str(record['group']))
+            if group_id is None:
+                self.warn(line, f"message skipped: group {record['group']!r} was not defined before it")
+                return None
+            recipients = f'group-{group_id}'
+        else:
+            to = record.get('to') or []
+            to = [self.user(name) for name in (to.split(',') if isinstance(to, str) else to)]
+            if not to or None in to:
+                self.warn(line, 'message skipped: unknown or missing recipient')
+                return None
+            group_id, recipients = None, ','.join(to)
+        return {
+            'line': line,
+            'source_id': str(record['id']) if record.get('id') is not None else None,
+            'sender': sender,
+            'recipients': recipients,
+            'group_id': group_id,
+            'text': record.get('text') or None,
+            'timestamp': timestamp,
+            'reply_to': str(record['reply_to']) if record.get('reply_to') is not None else None,
+            'reactions': record.get('reactions') or None,
+            'file': record.get('file'),
+        }
+
+    def batches(self, f):
+        """Yield (messages, offset, line, skipped) per batch_size messages; user/group records apply inline."""
+        import json
+        messages, skipped, line = [], 0, self.job.line
+        yielded = line
+        while True:
+            raw = f.readline()
+            if not raw:
+                break
+            line += 1
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+                kind = record.get('type', 'message')
+            except (ValueError, AttributeError):
+                self.warn(line, 'not a JSON object')
+                skipped += 1
+                continue
+            if kind == 'user':
+                if not self.user(record.get('username'), record.get('is_admin')):
+                    self.warn(line, 'user needs "username"')
+            elif kind == 'group':
+                self.group(record, line)
+            elif kind == 'message':
+                values = self.message(record, line)
+                if values is None:
+                    skipped += 1
+                else:
+                    messages.append(values)
+            else:
+                self.warn(line, f'unknown record type {kind!r}')
+                skipped += 1
+            if len(messages) >= self.batch_size:
+                yield messages, f.tell(), line, skipped
+                messages, skipped, yielded = [], 0, line
+        if line != yielded:
+            yield messages, f.tell(), line, skipped
+
+    def attach(self, spec, uploader, timestamp, line):
+        """Copy a referenced file into the upload store; returns the File id or None."""
+        import mimetypes
+        if isinstance(spec, str):
+            spec = {'path': spec}
+        path = os.path.join(self.base_dir, spec.get('path') or '')
+        name = spec.get('name') or os.path.basename(path)
+        if not allowed_file(name):
+            self.warn(line, f'file {name!r} has a type uploads do not allow; message kept without it')
+            return None
+        mimetype = spec.get('mimetype') or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        try:
+            with open(path, 'rb') as src:
+                file, _ = store_upload(src, name, uploader, mimetype, timestamp)
+        except OSError as e:
+            self.warn(line, f'file not attached ({e}); message kept without it')
+            return None
+        db.session.flush()
+        self.job.files += 1
+        return file.id
+
+    def write(self, messages, contents, offset, line, skipped):
+        """Insert one batch and move the job past it, in one transaction."""
+        import json
+        job = self.job
+        job.offset, job.line = offset, line
+        job.skipped += skipped
+        # The UPDATE takes SQLite's write lock, so no other writer can claim the ids chosen below
+        db.session.flush()
+        next_id = 1 + max(db.session.query(func.max(Message.id)).scalar() or 0,
+                          db.session.query(func.max(ArchiveMonth.max_id)).scalar() or 0)
+        wanted = {m['reply_to'] for m in messages if m['reply_to']}
+        known = {}
+        wanted = list(wanted)
+        for i in range(0, len(wanted), 500):
+            known.update(db.session.query(ImportedMessage.source_id, ImportedMessage.message_id).filter(
+                ImportedMessage.job_id == job.id, ImportedMessage.source_id.in_(wanted[i:i + 500])))
+        rows, mapped, counts = [], [], Counter()
+        for i, (m, content) in enumerate(zip(messages, contents)):
+            msg_id = next_id + i
+            if m['source_id']:
+                known[m['source_id']] = msg_id
+                mapped.append({'job_id': job.id, 'source_id': m['source_id'], 'message_id': msg_id})
+            file_id = self.attach(m['file'], m['sender'], m['timestamp'], m['line']) if m['file'] else None
+            rows.append({
+                'id': msg_id,
+                'sender': m['sender'],
+                'recipients': m['recipients'],
+                'content': content,
+                'timestamp': m['timestamp'],
+                'file_id': file_id,
+                'status': 'read',  # history, not unread mail
+                'reply_to': known.get(m['reply_to']),
+                'reactions': json.dumps(m['reactions']) if m['reactions'] else None,
+                'group_id': m['group_id'],
+            })
+            if m['sender'] not in STATS_IGNORED_SENDERS:
+                day = m['timestamp'].date()
+                for kind, key in message_stat_keys(m['sender'], m['group_id']):
+                    counts[(kind, day, key)] += 1
+        # Core executemany: one statement per table, no ORM unit-of-work per row
+        if rows:
+            db.session.execute(Message.__table__.insert(), rows)
+        if mapped:
+            db.session.execute(ImportedMessage.__table__.insert(), mapped)
+        bump_daily_message_counts(counts)
+        job.imported += len(rows)
+        db.session.commit()
+
+def import_history(path, user_map=None, group_map=None, create_users=True, workers=None, batch_size=None,
+                   defer_indexes=True, restart=False):
+    """Import a history JSONL file (format: import_history.py), resuming an unfinished run of the same file.
+
+    Message texts are encrypted by `workers` processes while the previous
+    batch is inserted; each batch is one transaction that also records the
+    file position, so a crash loses at most the batch in flight.
+    """
+    import json
+    from multiprocessing import Pool
+    source = os.path.abspath(path)
+    job = ImportJob.query.filter_by(source=source).order_by(ImportJob.id.desc()).first()
+    if job is not None and job.status == 'done' and not restart:
+        print(f"[IMPORT] {source} was already imported (job {job.id}); --restart imports it again")
+        return job
+    if job is None or restart:
+        job = ImportJob(source=source, user_map=json.dumps(user_map or {}),
+                        group_map=json.dumps({str(k): int(v) for k, v in (group_map or {}).items()}))
+        db.session.add(job)
+    else:
+        print(f"[IMPORT] resuming job {job.id} at line {job.line}")
+    job.status, job.error = 'running', None
+    db.session.commit()
+
+    workers = app.config['IMPORT_WORKERS'] if workers is None else workers
+    get_message_cipher()  # create the key before workers fork, so they all encrypt with it
+    pool = None
+    if workers > 0:
+        pool = Pool(workers, initializer=init_import_worker, initargs=({
+            key: app.config[key] for key in ('MESSAGE_CIPHER', 'KEY_FILE', 'KEYRING_FILE')},))
+    run = HistoryImport(job, create_users=create_users, batch_size=batch_size)
+    total = os.path.getsize(source)
+    started = time.time()
+    first = job.imported
+    try:
+        if defer_indexes:
+            dropped = defer_import_indexes(job)
+            if dropped:
+                print(f"[IMPORT] deferred indexes: {', '.join(dropped)}")
+        in_flight = deque()
+
+        def write_oldest():
+            messages, pending, offset, line, skipped = in_flight.popleft()
+            contents = [c for chunk in pending.get() for c in chunk] if pool else pending
+            run.write(messages, contents, offset, line, skipped)
+            rate = (job.imported - first) / max(time.time() - started, 1e-6)
+            print(f"[IMPORT] line {job.line} ({100 * job.offset / max(total, 1):.1f}%): {job.imported} messages, "
+                  f"{job.files} files, {job.skipped} skipped, {rate:.0f} msg/s")
+
+        with open(source, 'rb') as f:
+            f.seek(job.offset)
+            for messages, offset, line, skipped in run.batches(f):
+                texts = [m['text'] for m in messages]
+                if pool:
+                    size = max(1, -(-len(texts) // workers))
+                    pending = pool.map_async(encrypt_texts, [texts[i:i + size] for i in range(0, len(texts), size)])
+                else:
+                    pending = encrypt_texts(texts)
+                in_flight.append((messages, pending, offset, line, skipped))
+                # Keep one batch encrypting while the one before it is written
+                if len(in_flight) > 1:
+                    write_oldest()
+            while in_flight:
+                write_oldest()
+        job.status, job.finished_at = 'done', datetime.utcnow()
+        db.session.commit()
+    except BaseException as e:
+        db.session.rollback()
+        job.status, job.error = 'failed', repr(e)
+        db.session.commit()
+        raise
+    finally:
+        if pool:
+            pool.terminate()
+        if job.deferred_indexes:
+            print("[IMPORT] rebuilding deferred indexes")
+            restore_import_indexes(job)
+    return job
+
+@app.route('/groups/<int:group_id>/mute', methods=['POST'])
+def mute_group(group_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    if not GroupMute.query.filter_by(group_id=group_id, username=session['username']).first():
+        mute = GroupMute(group_id=group_id, username=session['username'])
+        db.session.add(mute)
+        db.session.commit()
+        invalidate_group_fanout(group_id)
+    return jsonify({'success': True, 'muted': True})
+
+@app.route('/groups/<int:group_id>/unmute', methods=['POST'])
+def unmute_group(group_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    mute = GroupMute.query.filter_by(group_id=group_id, username=session['username']).first()
+    if mute:
+        db.session.delete(mute)
+        db.session.commit()
+        invalidate_group_fanout(group_id)
+    return jsonify({'success': True, 'muted': False})
+
+@app.route('/api/groups/<int:group_id>/files', methods=['GET'])
+def get_group_files(group_id):
+    """Get all files shared in a group."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    username = session['username']
     
     # Check if user is a member of the group
-    member = GroupMember.query.filter_by(group_id=group_id, username=username).first()
+    member = group_member_access(group_id, username)
     if not member:
         return jsonify({'error': 'Not a member of this group'}), 403
     
     file_type = request.args.get('type', 'all')
     
-    # Get all messages with files in this group
-    messages_with_files = Message.query.filter(
-        Message.group_id == group_id,
-        Message.file_id.isnot(None)
-    ).order_by(Message.timestamp.desc()).all()
+    # Get all messages with files in this group, newest first, including archived months
+    messages_with_files = list(iter_conversation(lambda t: (
+        t.group_id == group_id,
+        t.file_id.isnot(None)
+    )))[::-1]
     
     files = []
     for message in messages_with_files:
-        file = File.query.get(message.file_id)
+        file = find_file(message.file_id, getattr(message, 'archive_month', None))
         if file:
-            # Determine file type for filtering
             file_extension = file.original_name.split('.')[-1].lower() if '.' in file.original_name else ''
-            
-            if file_extension in {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg', 'heic', 'jfif'}:
-                file_category = 'image'
-            elif file_extension in {'mp4', 'webm', 'mov', 'avi', 'mkv'}:
-                file_category = 'video'
-            elif file_extension in {'mp3', 'wav', 'ogg'}:
-                file_category = 'audio'
-            elif file_extension in {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'csv'}:
-                file_category = 'document'
-            elif file_extension in {'zip', 'rar', '7z', 'tar'}:
-                file_category = 'archive'
-            else:
-                file_category = 'other'
+            category = file_category(file.original_name)
             
             # Apply file type filter
-            if file_type != 'all' and file_category != file_type:
+            if file_type != 'all' and category != file_type:
                 continue
             
             files.append({
                 'id': file.id,
                 'file_name': file.original_name,
-                'file_path': url_for('serve_file', file_id=file.id),
-                'file_type': file_category,
+                'file_path': url_for('uploaded_file', filename=file.filename),
+                'file_type': category,
                 'file_extension': f'.{file_extension}',
                 'uploader': file.uploader,
                 'upload_date': file.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
@@ -2070,7 +4555,7 @@ def get_group_activity(group_id):
     username = session['username']
     
     # Check if user is a member of the group
-    member = GroupMember.query.filter_by(group_id=group_id, username=username).first()
+    member = group_member_access(group_id, username)
     if not member:
         return jsonify({'error': 'Not a member of this group'}), 403
     
@@ -2143,7 +4628,7 @@ def reset_password():
                 error = 'Passwords do not match.'
                 show_reset_form = True
             else:
-                user.password = cipher_suite.encrypt(new_password.encode())
+                user.password = get_cipher().encrypt(new_password.encode())
                 # Mark the reset request as used instead of deleting
                 req.status = 'used'
                 req.approved_at = datetime.utcnow()
@@ -2187,123 +4672,429 @@ def reset_password():
 @app.route('/test-notifications')
 def test_notifications():
     """Test page for real-time notifications - Admin only for security."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     return send_from_directory('.', 'test_notifications.html')
 
 @app.route('/silent-test')
 def silent_test():
     """Silent real-time updates test page - Admin only for security."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     return send_from_directory('.', 'silent_realtime_test.html')
 
 @app.route('/demo-deletion')
 def demo_deletion():
     """Complete message deletion demo page - Admin only for security."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     return send_from_directory('.', 'demo_complete_deletion.html')
 
 @app.route('/test-sidebar')
 def test_sidebar():
     """Sidebar notifications test page - Admin only for security."""
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
     return send_from_directory('.', 'test_sidebar_notifications.html')
 
 @app.route('/register')
 def register():
-    """Admin-only route to view system data (passwords are NOT exposed)."""
+    """Admin-only data explorer; the tables page through /api/admin/{users,messages,files}."""
     # SECURITY: Only allow admin access
-    if 'username' not in session or not session.get('is_admin'):
+    if not current_user_is_admin():
         return redirect(url_for('login'))
-    
-    users = User.query.all()
-    messages = Message.query.all()
-    files = File.query.all()
- 
-    # Format data (NO PASSWORD EXPOSURE)
-    user_data = [
-        {
-            'id': user.id,
-            'username': user.username,
-            'password_set': bool(user.password),  # Only show if password exists
-            'online': user.online,
-            'is_admin': user.is_admin,
-            'created_by': user.created_by
-        }
-        for user in users
-    ]
- 
-    message_data = [
-        {
-            'id': message.id,
-            'sender': message.sender,
-            'recipients': message.recipients,
-            'content': decrypt_message(message.content) if message.content else '',
-            'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'status': message.status,
-            'reply_to': message.reply_to,
-            'reactions': message.reactions
-        }
-        for message in messages
-    ]
- 
-    file_data = [
-        {
-            'id': file.id,
-            'filename': file.filename,
-            'original_name': file.original_name,
-            'uploader': file.uploader,
-            'timestamp': file.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'mimetype': file.mimetype
-        }
-        for file in files
+    return render_template('register.html')
+
+def admin_page_limit(default=50, maximum=200):
+    """Page size from ?limit=, clamped to 1..maximum."""
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
+
+def admin_before_id():
+    """Keyset cursor from ?before_id= (rows with a smaller id come next), or None for the first page."""
+    try:
+        return int(request.args['before_id'])
+    except (KeyError, ValueError):
+        return None
+
+@app.route('/api/admin/users')
+def admin_users():
+    """Admin-only, paginated user list (passwords are NOT exposed). Filters: q, admin, online."""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    limit = admin_page_limit()
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        offset = 0
+    query = User.query
+    q = (request.args.get('q') or '').strip()
+    if q:
+        query = query.filter(User.username.ilike(f'%{q}%'))
+    if request.args.get('admin') in ('0', '1'):
+        query = query.filter(User.is_admin == (request.args['admin'] == '1'))
+    if request.args.get('online') in ('0', '1'):
+        query = query.filter(User.online == (request.args['online'] == '1'))
+    total = query.count()
+    users = query.order_by(User.id).offset(offset).limit(limit).all()
+    return jsonify({
+        'items': [
+            {
+                'id': user.id,
+                'username': user.username,
+                'password_set': bool(user.password),  # Only show if password exists
+                'online': user.online,
+                'is_admin': user.is_admin,
+                'created_by': user.created_by
+            }
+            for user in users
+        ],
+        'total': total,
+        'offset': offset,
+        'limit': limit
+    })
+
+@app.route('/api/admin/messages')
+def admin_messages():
+    """Admin-only messages, newest first, keyset-paginated by before_id.
+
+    Filters: sender, recipients, group_id, from/to (YYYY-MM-DD). Only the rows
+    on the page are decrypted. A q content search has to decrypt as it scans,
+    so it stops after ADMIN_MESSAGE_SCAN_LIMIT rows and returns the cursor to
+    continue from.
+    """
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    limit = admin_page_limit()
+    before_id = admin_before_id()
+    query = Message.query
+    if request.args.get('sender'):
+        query = query.filter(Message.sender == request.args['sender'])
+    if request.args.get('recipients'):
+        query = query.filter(Message.recipients == request.args['recipients'])
+    if request.args.get('group_id', '').isdigit():
+        query = query.filter(Message.group_id == int(request.args['group_id']))
+    try:
+        if request.args.get('from'):
+            query = query.filter(Message.timestamp >= datetime.strptime(request.args['from'], '%Y-%m-%d'))
+        if request.args.get('to'):
+            query = query.filter(Message.timestamp < datetime.strptime(request.args['to'], '%Y-%m-%d') + timedelta(days=1))
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    q = (request.args.get('q') or '').strip().lower()
+
+    # Without q one extra row tells whether another page exists; with q, scan in larger batches
+    batch_size = 500 if q else limit + 1
+    items, scanned, cursor, more = [], 0, before_id, True
+    while more and len(items) < limit and scanned < app.config['ADMIN_MESSAGE_SCAN_LIMIT']:
+        batch_query = query.filter(Message.id < cursor) if cursor is not None else query
+        batch = batch_query.order_by(Message.id.desc()).limit(batch_size).all()
+        more = len(batch) == batch_size
+        for message in batch:
+            if len(items) >= limit:
+                more = True
+                break
+            scanned += 1
+            cursor = message.id
+            content = decrypt_message(message.content) if message.content else ''
+            if q and q not in content.lower():
+                continue
+            items.append({
+                'id': message.id,
+                'sender': message.sender,
+                'recipients': message.recipients,
+                'group_id': message.group_id,
+                'content': content,
+                'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S') if message.timestamp else None,
+                'status': message.status,
+                'reply_to': message.reply_to,
+                'reactions': message.reactions,
+                'file_id': message.file_id
+            })
+    next_before_id = cursor if more else None
+    return jsonify({'items': items, 'next_before_id': next_before_id, 'scanned': scanned, 'limit': limit})
+
+@app.route('/api/admin/files')
+def admin_files():
+    """Admin-only file metadata, newest first, keyset-paginated by before_id. Filters: q (name), uploader, type."""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    limit = admin_page_limit()
+    before_id = admin_before_id()
+    query = File.query
+    q = (request.args.get('q') or '').strip()
+    if q:
+        query = query.filter(File.original_name.ilike(f'%{q}%'))
+    if request.args.get('uploader'):
+        query = query.filter(File.uploader == request.args['uploader'])
+    if request.args.get('type'):
+        query = query.filter(File.mimetype.like(f"{request.args['type']}%"))
+    if before_id is not None:
+        query = query.filter(File.id < before_id)
+    files = query.order_by(File.id.desc()).limit(limit + 1).all()
+    has_more = len(files) > limit
+    files = files[:limit]
+    return jsonify({
+        'items': [
+            {
+                'id': file.id,
+                'filename': file.filename,
+                'original_name': file.original_name,
+                'uploader': file.uploader,
+                'timestamp': file.timestamp.strftime('%Y-%m-%d %H:%M:%S') if file.timestamp else None,
+                'mimetype': file.mimetype,
+                'download_url': url_for('uploaded_file', filename=file.filename)
+            }
+            for file in files
+        ],
+        'next_before_id': files[-1].id if has_more else None,
+        'limit': limit
+    })
+
+@app.route('/api/admin/stats')
+def admin_stats():
+    """Admin-only usage charts over the last ?days= (default 30), read from the DailyStat rollups only."""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    days = max(1, min(request.args.get('days', 30, type=int), 366))
+    start = datetime.utcnow().date() - timedelta(days=days - 1)
+    in_window = (DailyStat.day >= start,)
+    totals = {row.day: row for row in DailyStat.query.filter(DailyStat.kind == 'total', *in_window)}
+    active = dict(
+        db.session.query(DailyStat.day, func.count(DailyStat.id))
+        .filter(DailyStat.kind == 'user', DailyStat.messages > 0, *in_window)
+        .group_by(DailyStat.day)
+    )
+    storage = (
+        db.session.query(func.coalesce(func.sum(DailyStat.stored_bytes), 0))
+        .filter(DailyStat.kind == 'total', DailyStat.day < start)
+        .scalar()
+    )
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = totals.get(day)
+        storage += row.stored_bytes if row else 0
+        series.append({
+            'day': day.isoformat(),
+            'messages': row.messages if row else 0,
+            'active_users': active.get(day, 0),
+            'files': row.files if row else 0,
+            'bytes': row.stored_bytes if row else 0,
+            'storage_bytes': storage,
+        })
+
+    def top(kind, limit=10):
+        messages = func.sum(DailyStat.messages)
+        return (
+            db.session.query(DailyStat.key, messages)
+            .filter(DailyStat.kind == kind, *in_window)
+            .group_by(DailyStat.key)
+            .having(messages > 0)
+            .order_by(messages.desc())
+            .limit(limit)
+            .all()
+        )
+
+    top_groups = top('group')
+    names = dict(db.session.query(Group.id, Group.name).filter(Group.id.in_([int(key) for key, _ in top_groups])))
+    file_types = (
+        db.session.query(DailyStat.key, func.sum(DailyStat.files), func.sum(DailyStat.stored_bytes))
+        .filter(DailyStat.kind == 'file_type', *in_window)
+        .group_by(DailyStat.key)
+        .all()
+    )
+    return jsonify({
+        'days': series,
+        'top_users': [{'username': key, 'messages': count} for key, count in top('user')],
+        'top_groups': [{'group_id': int(key), 'name': names.get(int(key), f'Group {key}'), 'messages': count}
+                       for key, count in top_groups],
+        'file_types': [{'type': key, 'files': count, 'bytes': size} for key, count, size in file_types if count],
+    })
+
+@app.route('/api/admin/archive')
+def admin_archive():
+    """Admin-only archive manifest: one entry per month file, plus what the next archive.py run would move."""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    cutoff = datetime.utcnow() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+    return jsonify({
+        'months': [month.to_dict() for month in ArchiveMonth.query.order_by(ArchiveMonth.month)],
+        'hot_messages': db.session.query(func.count(Message.id)).scalar(),
+        'archive_after_days': app.config['ARCHIVE_AFTER_DAYS'],
+        'pending': {month: count for month, count in archivable_months(cutoff)},
+    })
+
+@app.route('/api/deletions/<int:job_id>')
+def deletion_status(job_id):
+    """Progress of a deletion job, for the user who requested it or an admin."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    job = DeletionJob.query.get(job_id)
+    if not job or (job.requested_by != session['username'] and not current_user_is_admin()):
+        return jsonify({'error': 'Deletion job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/admin/deletions', methods=['GET', 'POST'])
+def admin_deletions():
+    """Admin-only: recent deletion jobs; POST restarts the worker for queued, interrupted or failed jobs."""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    if request.method == 'POST':
+        DeletionJob.query.filter_by(status='failed').update({'status': 'queued', 'error': None})
+        db.session.commit()
+        started = start_deletion_worker()
+        return jsonify({'started': started}), 202 if started else 409
+    jobs = DeletionJob.query.order_by(DeletionJob.id.desc()).limit(admin_page_limit()).all()
+    return jsonify({'items': [job.to_dict() for job in jobs], 'worker_running': deletion_worker_running})
+
+@app.route('/api/admin/storage')
+def admin_storage():
+    """Admin-only storage reconciliation report: disk usage, last orphan scans, quarantine and reclaimable bytes."""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    report = storage_report()
+    report['quarantined'] = [orphan.to_dict() for orphan in
+                             OrphanFile.query.order_by(OrphanFile.id.desc()).limit(admin_page_limit())]
+    return jsonify(report)
+
+@app.route('/api/admin/rate_limits')
+def admin_rate_limits():
+    """Admin-only view of Socket.IO rate limit budgets and allowed/dropped counters."""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    return jsonify({
+        'limits': {event: {'burst': burst, 'per_second': rate}
+                   for event, (burst, rate) in app.config.get('SOCKET_RATE_LIMITS', {}).items()},
+        'events': {event: dict(counts) for event, counts in socket_rate_limit_stats.items()}
+    })
+
+@app.route('/api/admin/reencrypt', methods=['GET', 'POST'])
+def admin_reencrypt():
+    """Admin-only: report or start the background message re-encryption (optionally rotating the key first)."""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    started = False
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        started = start_reencryption(rotate=bool(data.get('rotate')), restart=bool(data.get('restart')))
+        if not started:
+            return jsonify({'error': 'Re-encryption is already running'}), 409
+    cursor = JobCursor.query.get(REENCRYPT_JOB)
+    return jsonify({
+        'started': started,
+        'running': reencrypt_job_running,
+        'cipher': app.config['MESSAGE_CIPHER'],
+        'primary_key_id': get_message_keyring().primary if app.config['MESSAGE_CIPHER'] == 'aesgcm' else None,
+        'last_message_id': db.session.query(func.max(Message.id)).scalar() or 0,
+        'job': cursor.to_dict() if cursor else None,
+    })
+
+@app.route('/api/admin/sql_profile')
+def admin_sql_profile():
+    """Admin-only SQL profiling summary: per-route totals and the most recent requests/events."""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    routes = [
+        {'label': label, 'count': t['count'], 'avg_queries': round(t['queries'] / t['count'], 2),
+         'avg_db_ms': round(t['db_ms'] / t['count'], 2), 'repeat_warnings': t['repeat_warnings']}
+        for label, t in sql_profile_totals.items() if t['count']
     ]
- 
-    return render_template('register.html', users=user_data, messages=message_data, files=file_data)
+    routes.sort(key=lambda r: r['avg_queries'], reverse=True)
+    return jsonify({
+        'enabled': app.config['SQL_PROFILING'],
+        'repeat_threshold': app.config['SQL_PROFILING_REPEAT_THRESHOLD'],
+        'routes': routes,
+        'recent': list(reversed(sql_profile_recent)),
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for admins, loopback scrapers or holders of METRICS_TOKEN."""
+    token = app.config.get('METRICS_TOKEN')
+    allowed = (
+        current_user_is_admin()
+        or request.remote_addr in ('127.0.0.1', '::1')
+        or (token and request.headers.get('Authorization') == f'Bearer {token}')
+    )
+    if not allowed:
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
  
  
 
 
 # --- SocketIO Events for Real-Time Features ---
 @socketio.on('connect')
-def handle_connect():
+@observe_socket_event('connect')
+def handle_connect(auth=None):
     """Handle new WebSocket connection and update online users."""
+    global connected_sockets
+    connected_sockets += 1
     username = session.get('username')
     if username:
         online_users.add(username)
-        user = User.query.filter_by(username=username).first()
-        if user:
-            user.online = True
-            db.session.commit()
+        User.query.filter_by(username=username).update({'online': True})
+        db.session.commit()
         emit('user_list', list(online_users), broadcast=True)
 
 @socketio.on('disconnect')
+@observe_socket_event('disconnect')
 def handle_disconnect():
     """Handle WebSocket disconnect and update online users."""
+    global connected_sockets
+    connected_sockets = max(0, connected_sockets - 1)
     username = session.get('username')
     if username:
         online_users.discard(username)
-        user = User.query.filter_by(username=username).first()
-        if user:
-            user.online = False
-            db.session.commit()
+        User.query.filter_by(username=username).update({'online': False})
+        db.session.commit()
 
 @socketio.on('join')
+@observe_socket_event('join')
 def on_join(data):
     """Join a private or group chat room."""
     room = data.get('room')
     join_room(room)
 
 @socketio.on('leave')
+@observe_socket_event('leave')
 def on_leave(data):
     """Leave a private or group chat room."""
     room = data.get('room')
     leave_room(room)
 
+@socketio.on('resume')
+@observe_socket_event('resume')
+@rate_limited('resume')
+def handle_resume(data):
+    """Replay events a reconnecting client missed, or ask it to resync fully."""
+    username = session.get('username')
+    if not username:
+        return
+    data = data or {}
+    last_seq = data.get('last_seq')
+    if last_seq is None:
+        # First connect: just hand out the current position in the stream
+        emit('replay_events', {'epoch': user_event_log.epoch, 'seq': user_event_log.seq, 'events': []})
+        return
+    events = None
+    if data.get('epoch') == user_event_log.epoch:
+        try:
+            events = user_event_log.since(username, int(last_seq))
+        except (TypeError, ValueError):
+            events = None
+    if events is None:
+        emit('resync_required', {'epoch': user_event_log.epoch, 'seq': user_event_log.seq})
+        return
+    emit('replay_events', {'epoch': user_event_log.epoch, 'seq': user_event_log.seq, 'events': events})
+
 @socketio.on('send_message')
+@observe_socket_event('send_message')
+@rate_limited('send_message')
 def handle_message(data):
     """Handle sending messages (public, private, group) and broadcast to recipients."""
     import json
@@ -2318,13 +5109,15 @@ def handle_message(data):
     # --- Admin-only group message enforcement ---
     if recipients.startswith('group-'):
         try:
-            group_id = int(recipients.split('-')[1])
-            group = Group.query.get(group_id)
-            if group and group.admin_only:
-                gm = GroupMember.query.filter_by(group_id=group_id, username=sender).first()
-                if not gm or not gm.is_admin:
-                    emit('group_admin_only_error', {'error': 'Only admins can send messages in this group.'}, to=sender)
-                    return  # Do not process message
+            with trace_span('group_admin_check', 'auth'):
+                group_id = int(recipients.split('-')[1])
+                access = get_group_access(group_id)
+                allowed = True
+                if access and access.admin_only:
+                    allowed = is_group_admin(group_id, sender)
+            if not allowed:
+                emit('group_admin_only_error', {'error': 'Only admins can send messages in this group.'}, to=sender)
+                return  # Do not process message
         except Exception as e:
             emit('group_admin_only_error', {'error': 'Group admin check failed.'}, to=sender)
             return
@@ -2332,11 +5125,20 @@ def handle_message(data):
     # Always set group_id for group messages
     msg = Message(sender=sender, recipients=recipients, content=encrypted_content, file_id=file_id, status='sent', reply_to=reply_to, group_id=group_id)
     db.session.add(msg)
-    db.session.commit()
+    record_message_stats(msg)
+    mentioned = set()
+    if group_id is not None:
+        mentioned = extract_mentions(content, get_group_fanout(group_id)) - {sender}
+        if mentioned:
+            db.session.flush()
+            for username in mentioned:
+                db.session.add(MessageMention(message_id=msg.id, group_id=group_id, username=username))
+    with trace_span('db.commit', 'db'):
+        db.session.commit()
     # Fetch reply message if any
     reply_msg = None
     if reply_to:
-        reply = Message.query.get(reply_to)
+        reply = find_message(reply_to)
         if reply:
             reply_msg = {
                 'id': reply.id,
@@ -2348,7 +5150,7 @@ def handle_message(data):
         'id': msg.id,
         'sender': sender,
         'recipients': recipients,
-        'content': decrypt_message(msg.content) if msg.content else '',
+        'content': content if encrypted_content else '',  # plaintext we just encrypted; no decrypt round-trip
         'timestamp': msg.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ') if msg.timestamp else None,
         'file': None,
         'status': msg.status,
@@ -2364,17 +5166,39 @@ def handle_message(data):
                 'original_name': f.original_name,
                 'mimetype': f.mimetype
             }
-    if recipients == 'all':
-        emit('receive_message', msg_data, broadcast=True)
-    elif recipients.startswith('group-'):
-        emit('receive_message', msg_data, to=recipients)
-    else:
-        for r in recipients.split(','):
-            emit('receive_message', msg_data, to=r.strip())
-        emit('receive_message', msg_data, to=sender)
+    if group_id is not None:
+        # Only members who want notifications get the full payload; the rest get a ping
+        full, ping = split_group_fanout(group_id, sender, mentioned)
+        msg_data['mentions'] = sorted(mentioned)
+        activity = {
+            'id': msg.id,
+            'group_id': group_id,
+            'recipients': recipients,
+            'sender': sender,
+            'timestamp': msg_data['timestamp']
+        }
+        if full:
+            with trace_span('emit.receive_message', 'emit', recipients=len(full)):
+                record_missed_event(full, 'receive_message', msg_data)
+                emit('receive_message', msg_data, to=full)
+        if ping:
+            with trace_span('emit.group_activity', 'emit', recipients=len(ping)):
+                record_missed_event(ping, 'group_activity', activity)
+                emit('group_activity', activity, to=ping)
+        return
+    with trace_span('emit.receive_message', 'emit', recipients=recipients):
+        record_missed_event(message_audience(sender, recipients), 'receive_message', msg_data)
+        if recipients == 'all':
+            emit('receive_message', msg_data, broadcast=True)
+        else:
+            for r in recipients.split(','):
+                emit('receive_message', msg_data, to=r.strip())
+            emit('receive_message', msg_data, to=sender)
 
 # New: React to a message
 @socketio.on('react_message')
+@observe_socket_event('react_message')
+@rate_limited('react_message')
 def handle_react_message(data):
     import json
     msg_id = data.get('msg_id')
@@ -2389,10 +5213,15 @@ def handle_react_message(data):
             reactions[emoji].append(username)
         msg.reactions = json.dumps(reactions)
         db.session.commit()
-        emit('update_reactions', {'msg_id': msg_id, 'reactions': reactions}, broadcast=True)
+        payload = {'msg_id': msg_id, 'reactions': reactions}
+        with trace_span('emit.update_reactions', 'emit'):
+            record_missed_event(message_audience(msg.sender, msg.recipients), 'update_reactions', payload)
+            emit('update_reactions', payload, broadcast=True)
 
 # New: Remove reaction
 @socketio.on('remove_reaction')
+@observe_socket_event('remove_reaction')
+@rate_limited('remove_reaction')
 def handle_remove_reaction(data):
     import json
     msg_id = data.get('msg_id')
@@ -2407,9 +5236,13 @@ def handle_remove_reaction(data):
                 del reactions[emoji]
             msg.reactions = json.dumps(reactions)
             db.session.commit()
-            emit('update_reactions', {'msg_id': msg_id, 'reactions': reactions}, broadcast=True)
+            payload = {'msg_id': msg_id, 'reactions': reactions}
+            with trace_span('emit.update_reactions', 'emit'):
+                record_missed_event(message_audience(msg.sender, msg.recipients), 'update_reactions', payload)
+                emit('update_reactions', payload, broadcast=True)
 
 @socketio.on('message_read')
+@observe_socket_event('message_read')
 def handle_message_read(data):
     """Mark a message as read and notify the sender."""
     msg_id = data.get('msg_id')
@@ -2421,7 +5254,56 @@ def handle_message_read(data):
         # Notify the sender
         emit('message_read', {'msg_id': msg_id}, to=msg.sender)
 
+@socketio.on('messages_read')
+@observe_socket_event('messages_read')
+@rate_limited('messages_read')
+def handle_messages_read(data):
+    """Mark everything up to `up_to` in one conversation as read with a single write.
+
+    `conversation` is the other user's name for a private chat or 'group-<id>'.
+    Each affected sender gets one coalesced 'message_read' carrying the highest
+    id of theirs that was read, instead of one event per message.
+    """
+    username = session.get('username')
+    data = data or {}
+    conversation = data.get('conversation')
+    try:
+        up_to = int(data.get('up_to'))
+    except (TypeError, ValueError):
+        return
+    if not username or not conversation:
+        return
+    if conversation.startswith('group-'):
+        try:
+            group_id = int(conversation.split('-')[1])
+        except (IndexError, ValueError):
+            return
+        if not group_member_access(group_id, username):
+            return
+        scope = [Message.group_id == group_id, Message.sender != username]
+    else:
+        scope = [
+            Message.group_id.is_(None),
+            Message.sender == conversation,
+            lists_recipient(Message.recipients, username)
+        ]
+    scope += [Message.id <= up_to, Message.status != 'read']
+    senders = db.session.query(Message.sender, func.max(Message.id)).filter(*scope).group_by(Message.sender).all()
+    if not senders:
+        return
+    Message.query.filter(*scope).update({'status': 'read'}, synchronize_session=False)
+    db.session.commit()
+    for sender, last_id in senders:
+        # From the sender's side the conversation is either the group or the reader
+        emit('message_read', {
+            'up_to': last_id,
+            'reader': username,
+            'conversation': conversation if conversation.startswith('group-') else username
+        }, to=sender)
+
 @socketio.on('typing')
+@observe_socket_event('typing')
+@rate_limited('typing')
 def handle_typing(data):
     to = data.get('to')
     sender = session.get('username')
@@ -2432,6 +5314,8 @@ def handle_typing(data):
             emit('show_typing', {'from': sender}, to=to)
 
 @socketio.on('stop_typing')
+@observe_socket_event('stop_typing')
+@rate_limited('stop_typing')
 def handle_stop_typing(data):
     to = data.get('to')
     sender = session.get('username')
@@ -2442,11 +5326,15 @@ def handle_stop_typing(data):
             emit('hide_typing', {'from': sender}, to=to)
 
 @socketio.on('group_deleted')
+@observe_socket_event('group_deleted')
+@rate_limited('group_deleted')
 def handle_group_deleted(data):
     group_id = data.get('group_id')
     emit('group_deleted', {'group_id': group_id}, broadcast=True)
 
 @socketio.on('group_read')
+@observe_socket_event('group_read')
+@rate_limited('group_read')
 def handle_group_read(data):
     group_id = data.get('group_id')
     if group_id:
@@ -2462,32 +5350,14 @@ def clear_chat():
     if not other_user:
         return jsonify({'success': False, 'error': 'No user specified'}), 400
 
-    from sqlalchemy import or_, and_
-    messages = Message.query.filter(
-        or_(
-            and_(Message.sender == username, Message.recipients.like(f"%{other_user}%")),
-            and_(Message.sender == other_user, Message.recipients.like(f"%{username}%"))
-        ),
-        Message.group_id.is_(None)
-    ).all()
-
-    # Mark all these messages as hidden for this user (soft clear)
-    from sqlalchemy.exc import IntegrityError
-    deleted_msg_ids = []
-    for m in messages:
-        try:
-            db.session.add(HiddenMessage(msg_id=m.id, username=username))
-            deleted_msg_ids.append(m.id)
-        except IntegrityError:
-            db.session.rollback()
-            # Already hidden
-    db.session.commit()
+    # Soft clear: everything up to the watermark is hidden for this user only
+    watermark = clear_conversation(username, other_user)
 
     # Notify only this user about clearing
     clear_data = {
         'cleared_by': username,
         'other_user': other_user,
-        'deleted_msg_ids': deleted_msg_ids,
+        'cleared_before': watermark,
         'chat_type': 'private'
     }
     socketio.emit('chat_cleared', clear_data, to=username)
@@ -2501,36 +5371,24 @@ def clear_group_chat():
         return jsonify({'success': False, 'error': 'Not logged in'}), 401
     
     username = session['username']
-    group_id = request.form.get('group_id')
+    group_id = request.form.get('group_id', type=int)
     
     if not group_id:
         return jsonify({'success': False, 'error': 'No group specified'}), 400
     
     # Check if user is a member of the group
-    group_member = GroupMember.query.filter_by(group_id=group_id, username=username).first()
+    group_member = group_member_access(group_id, username)
     if not group_member:
         return jsonify({'success': False, 'error': 'Not a group member'}), 403
     
-    # Get all group messages
-    messages = Message.query.filter_by(group_id=group_id).all()
-    deleted_msg_ids = []
-    
-    # Mark hidden for this user instead of deleting
-    from sqlalchemy.exc import IntegrityError
-    for m in messages:
-        try:
-            db.session.add(HiddenMessage(msg_id=m.id, username=username))
-            deleted_msg_ids.append(m.id)
-        except IntegrityError:
-            db.session.rollback()
-            # Already hidden
-    db.session.commit()
+    # Hide everything sent so far for this user instead of deleting
+    watermark = clear_conversation(username, f'group-{group_id}')
     
     # Notify only this user about chat clearing
     clear_data = {
         'cleared_by': username,
         'group_id': group_id,
-        'deleted_msg_ids': deleted_msg_ids,
+        'cleared_before': watermark,
         'chat_type': 'group'
     }
     
@@ -2538,6 +5396,173 @@ def clear_group_chat():
     
     return jsonify({'success': True})
 
+# --- Conversation export (zip streamed as it is built: messages.jsonl + files/) ---
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+class ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink for zipfile; drain() hands out what was written since the last call."""
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_conversation(criteria, batch_size=EXPORT_BATCH_SIZE):
+    """Every message matching criteria, oldest first, from the archives and the hot table in keyset batches."""
+    import heapq
+
+    def batches(fetch):
+        after = None
+        while True:
+            rows = fetch(after)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = conversation_key(rows[-1])
+
+    def hot(after):
+        query = Message.query.filter(*criteria(Message))
+        if after is not None:
+            query = query.filter(keyset_after(Message, after))
+        return query.order_by(Message.timestamp, Message.id).limit(batch_size).all()
+
+    def archived(month):
+        t = archive_message_table
+        def fetch(after):
+            stmt = select(t).where(*criteria(t.c))
+            if after is not None:
+                stmt = stmt.where(keyset_after(t.c, after))
+            return archived_rows(month, stmt.order_by(t.c.timestamp, t.c.id).limit(batch_size))
+        return fetch
+
+    # Pinned and imported messages stay hot with any timestamp, so merge the sources
+    sources = [batches(archived(entry.month)) for entry in archive_months(criteria).order_by(ArchiveMonth.month)]
+    sources.append(batches(hot))
+    return heapq.merge(*sources, key=conversation_key)
+
+def export_record(m, f):
+    """One messages.jsonl line: the decrypted message, with its file's path inside the zip."""
+    import json
+    return {
+        'id': m.id,
+        'sender': m.sender,
+        'recipients': m.recipients,
+        'content': decrypt_message(m.content) if m.content else '',
+        'timestamp': m.timestamp.isoformat() + 'Z' if m.timestamp else None,
+        'file': {
+            'id': f.id,
+            'original_name': f.original_name,
+            'mimetype': f.mimetype,
+            'path': export_file_path(f)
+        } if f else None,
+        'status': m.status,
+        'reply_to': m.reply_to,
+        'reactions': json.loads(m.reactions) if m.reactions else {},
+        'group_id': m.group_id
+    }
+
+def export_file_path(f):
+    return f'files/{f.id}_{secure_filename(f.original_name) or f.filename}'
+
+def export_zip(criteria, username, manifest):
+    """Yield a zip archive of one conversation chunk by chunk; memory stays at about one batch."""
+    import json
+    import zipfile
+    sink = ZipStream()
+    files = {}
+    messages = 0
+    stamp = time.localtime()[:6]
+    with zipfile.ZipFile(sink, 'w') as zf:
+        info = zipfile.ZipInfo('messages.jsonl', date_time=stamp)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with zf.open(info, 'w', force_zip64=True) as out:
+            stream = iter_conversation(criteria)
+            while True:
+                batch = list(itertools.islice(stream, EXPORT_BATCH_SIZE))
+                if not batch:
+                    break
+                hidden = {msg_id for (msg_id,) in db.session.query(HiddenMessage.msg_id).filter(
+                    HiddenMessage.username == username, HiddenMessage.msg_id.in_([m.id for m in batch]))}
+                wanted = {m.file_id for m in batch if m.file_id and m.file_id not in files}
+                if wanted:
+                    files.update({f.id: f for f in File.query.filter(File.id.in_(wanted))})
+                for m in batch:
+                    if m.id in hidden:
+                        continue
+                    if m.file_id and m.file_id not in files:
+                        files[m.file_id] = find_file(m.file_id, getattr(m, 'archive_month', None))
+                    line = json.dumps(export_record(m, files.get(m.file_id)), ensure_ascii=False) + '\n'
+                    out.write(line.encode('utf-8'))
+                    messages += 1
+                yield sink.drain()
+
+        missing = []
+        for f in files.values():
+            if f is None:
+                continue
+            path = os.path.join(app.config['UPLOAD_FOLDER'], f.filename)
+            if not os.path.isfile(path):
+                missing.append(f.id)
+                continue
+            # Uploads are mostly compressed already (images, video, archives): store them as-is
+            info = zipfile.ZipInfo(export_file_path(f), date_time=stamp)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, zf.open(info, 'w', force_zip64=True) as out:
+                while True:
+                    chunk = src.read(EXPORT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    yield sink.drain()
+
+        manifest.update({
+            'exported_at': datetime.utcnow().isoformat() + 'Z',
+            'messages': messages,
+            'files': sum(1 for f in files.values() if f is not None) - len(missing),
+            'missing_files': missing
+        })
+        zf.writestr(zipfile.ZipInfo('export.json', date_time=stamp), json.dumps(manifest, indent=2))
+    yield sink.drain()
+
+@app.route('/export')
+def export_conversation():
+    """Download a private chat (?user=) or group (?group_id=) as the current user sees it, as a streamed zip."""
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    username = session['username']
+    filter_user = request.args.get('user')
+    group_id = request.args.get('group_id', type=int)
+    if group_id:
+        if not group_member_access(group_id, username):
+            return jsonify({'error': 'Not a group member'}), 403
+        group = db.session.get(Group, group_id)
+        conversation = f'group-{group_id}'
+        label = group.name if group else conversation
+    elif filter_user and not filter_user.startswith('group-'):
+        conversation = label = filter_user
+    else:
+        return jsonify({'error': 'Pass user or group_id'}), 400
+
+    criteria = conversation_criteria(username, filter_user, group_id)
+    manifest = {'conversation': conversation, 'name': label, 'exported_by': username}
+    filename = secure_filename(f'lanchat-{label}-{datetime.utcnow():%Y%m%d-%H%M%S}.zip') or 'lanchat-export.zip'
+    print(f"[EXPORT] {username} exporting {conversation}")
+    return Response(
+        stream_with_context(export_zip(criteria, username, manifest)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 @app.route('/unread_counts')
 def unread_counts():
     if 'username' not in session:
@@ -2548,10 +5573,13 @@ def unread_counts():
     unread_chats = 0
     individual_badges = defaultdict(int)
     hidden_subq = db.session.query(HiddenMessage.msg_id).filter(HiddenMessage.username == username)
-    private_msgs = Message.query.filter(
+    private_msgs = Message.query.outerjoin(
+        ChatClear, and_(ChatClear.username == username, ChatClear.conversation == Message.sender)
+    ).filter(
         Message.recipients.like(f'%{username}%'),
         Message.status != 'read',
         Message.group_id.is_(None),
+        Message.id > func.coalesce(ChatClear.cleared_before, 0),
         ~Message.id.in_(hidden_subq)
     ).all()
     for msg in private_msgs:
@@ -2565,10 +5593,13 @@ def unread_counts():
     group_badges = defaultdict(int)
     if group_ids:
         hidden_subq = db.session.query(HiddenMessage.msg_id).filter(HiddenMessage.username == username)
-        group_msgs = Message.query.filter(
+        group_msgs = Message.query.outerjoin(
+            ChatClear, and_(ChatClear.username == username, ChatClear.conversation == Message.recipients)
+        ).filter(
             Message.group_id.in_(group_ids),
             Message.status != 'read',
             Message.sender != username,
+            Message.id > func.coalesce(ChatClear.cleared_before, 0),
             ~Message.id.in_(hidden_subq)
         ).all()
         for msg in group_msgs:
@@ -2625,7 +5656,7 @@ def files_data():
     if 'username' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     username = session['username']
-    is_admin = session.get('is_admin', False)
+    is_admin = current_user_is_admin()
     files = []
     if is_admin:
         # Admin: show all files
@@ -2642,25 +5673,25 @@ def files_data():
             })
     else:
         # User: show files where user is sender, recipient, or uploader
-        # 1. Files attached to messages where user is sender or recipient
-        messages = Message.query.filter(
+        # 1. Files attached to messages where user is sender or recipient, hot or archived
+        messages = iter_conversation(lambda t: (
             or_(
-                Message.sender == username,
-                Message.recipients.like(f'%{username}%')
+                t.sender == username,
+                t.recipients.like(f'%{username}%')
             ),
-            Message.file_id != None
-        ).order_by(Message.timestamp.desc()).all()
-        file_ids = set()
+            t.file_id != None
+        ))
+        file_ids = {}  # file id -> archive month of the message that references it, if archived
         for msg in messages:
             if msg.file_id:
-                file_ids.add(msg.file_id)
+                file_ids[msg.file_id] = getattr(msg, 'archive_month', None)
         # 2. Files uploaded by the user (even if not attached to a message)
         user_files = File.query.filter_by(uploader=username).all()
         for file in user_files:
-            file_ids.add(file.id)
+            file_ids[file.id] = None
         # Now fetch all unique files
-        for file_id in file_ids:
-            file = File.query.get(file_id)
+        for file_id, month in file_ids.items():
+            file = find_file(file_id, month)
             if not file:
                 continue
             files.append({
@@ -2681,41 +5712,6 @@ def files():
         return redirect(url_for('login'))
     return render_template('dashboard.html', username=session['username'], host_ip=get_host_ip(), active_section='files')
 
-# --- Main Entrypoint ---
-if __name__ == '__main__':
-    import signal
-    import sys
-    
-    def signal_handler(sig, frame):
-        print('\nShutting down LANChat server...')
-        sys.exit(0)
-    
-    signal.signal(signal.SIGINT, signal_handler)
-    # Ensure upload directory exists
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    with app.app_context():
-        db.create_all()
-        # --- Add default admins only if they don't exist ---
-        admin_list: list[dict[str, str]] = [
-            {'username': 'Vicky', 'password': 'vickyadmin'},
-            {'username': 'Ajinkya', 'password': 'ajinkyaadmin'}
-        ]
-        for admin in admin_list:
-            # Check if admin already exists
-            existing_user = User.query.filter_by(username=admin['username']).first()
-            if not existing_user:
-                user = User(
-                    username=admin['username'],
-                    password=cipher_suite.encrypt(admin['password'].encode()).decode(),  # Store as string
-                    is_admin=True,
-                    created_by='system'
-                )
-                db.session.add(user)
-                print(f"Created default admin: {admin['username']}")
-            else:
-                print(f"Admin {admin['username']} already exists, skipping...")
-        db.session.commit()
-
 def get_private_ip():
     try:
         # Get all addresses associated with the host
@@ -2752,12 +5748,75 @@ def find_available_port(start_port=5000, max_attempts=10):
     return start_port  # Fallback to original port
 
 
-# Find available port
-port = find_available_port(5000)
+def init_db():
+    """Create missing tables and the default admin accounts."""
+    with app.app_context():
+        db.create_all()
+        # create_all skips the indexes of tables that already exist
+        for index in Message.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        # --- Add default admins only if they don't exist ---
+        admin_list: list[dict[str, str]] = [
+            {'username': 'Vicky', 'password': 'vickyadmin'},
+            {'username': 'Ajinkya', 'password': 'ajinkyaadmin'}
+        ]
+        for admin in admin_list:
+            # Check if admin already exists
+            existing_user = User.query.filter_by(username=admin['username']).first()
+            if not existing_user:
+                user = User(
+                    username=admin['username'],
+                    password=get_cipher().encrypt(admin['password'].encode()).decode(),  # Store as string
+                    is_admin=True,
+                    created_by='system'
+                )
+                db.session.add(user)
+                print(f"Created default admin: {admin['username']}")
+            else:
+                print(f"Admin {admin['username']} already exists, skipping...")
+        db.session.commit()
+
+def create_app(config=None):
+    """Apply config overrides, bind db and socketio, and return the app.
+
+    Importing this module has no side effects; scripts, tests and wsgi.py call
+    create_app() and then serve or drive the returned app.
+    """
+    global sql_profile_recent
+    if config:
+        app.config.update(config)
+    if 'sqlalchemy' not in app.extensions:
+        db.init_app(app)
+    if 'socketio' not in app.extensions:
+        socketio.init_app(app, async_mode=app.config['SOCKETIO_ASYNC_MODE'])
+    # Buffers sized from config at import time follow later overrides
+    user_event_log.maxlen = app.config['EVENT_REPLAY_BUFFER_SIZE']
+    if sql_profile_recent.maxlen != app.config['SQL_PROFILING_HISTORY']:
+        sql_profile_recent = deque(sql_profile_recent, maxlen=app.config['SQL_PROFILING_HISTORY'])
+    return app
+
+
+# --- Development Entrypoint (production: wsgi.py) ---
+if __name__ == '__main__':
+    import signal
+    import sys
+    
+    def signal_handler(sig, frame):
+        print('\nShutting down LANChat server...')
+        sys.exit(0)
+    
+    signal.signal(signal.SIGINT, signal_handler)
+    create_app()
+    # Ensure upload directory exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    init_db()
+
+    # Find available port
+    port = find_available_port(5000)
 
-# Print both
-print(f"LANChatShare server running at:")
-print(f"  → Private IP:   http://{get_private_ip()}:{port}")
-print(f"  → Localhost IP: http://{get_localhost_ip()}:{port}")
+    # Print both
+    print(f"LANChatShare server running at:")
+    print(f"  → Private IP:   http://{get_private_ip()}:{port}")
+    print(f"  → Localhost IP: http://{get_localhost_ip()}:{port}")
 
-socketio.run(app, host='0.0.0.0', port=port, debug=True)
+    socketio.run(app, host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,61 @@
+"""Move old messages out of the hot database into per-month archive files.
+
+Messages older than ARCHIVE_AFTER_DAYS (LANCHAT_ARCHIVE_AFTER_DAYS, default
+180) are copied into ARCHIVE_FOLDER/messages-YYYY-MM.db together with their
+files' metadata, then deleted from the hot table in the same transaction.
+Pinned messages stay hot. /history, search and message/file lookups read
+through to the archives, so nothing disappears for users. Each run also
+records which conversations every month holds, so reads only open the
+archives that can match:
+
+    python archive.py --dry-run
+    python archive.py --older-than-days 90 --vacuum
+    python archive.py --status
+
+--vacuum rebuilds the hot database afterwards to give the freed pages back to
+the filesystem; it needs free disk space about the size of the database.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import app as chat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--older-than-days', type=int, help='archive age (default: ARCHIVE_AFTER_DAYS)')
+    parser.add_argument('--batch-size', type=int, help='messages per transaction (default: ARCHIVE_BATCH_SIZE)')
+    parser.add_argument('--dry-run', action='store_true', help='print what would move per month and exit')
+    parser.add_argument('--status', action='store_true', help='print the archive manifest and exit')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM the hot database after archiving')
+    args = parser.parse_args()
+
+    flask_app = chat.create_app({'SOCKETIO_ASYNC_MODE': 'threading'})
+    with flask_app.app_context():
+        chat.db.create_all()
+        if args.status:
+            for month in chat.ArchiveMonth.query.order_by(chat.ArchiveMonth.month):
+                print(month.to_dict())
+            return
+        days = flask_app.config['ARCHIVE_AFTER_DAYS'] if args.older_than_days is None else args.older_than_days
+        if args.dry_run:
+            cutoff = datetime.utcnow() - timedelta(days=days)
+            pending = chat.archivable_months(cutoff)
+            for month, count in pending:
+                print(f'  {month}: {count} messages')
+            print(f'{sum(count for _, count in pending)} messages older than {cutoff:%Y-%m-%d} would be archived')
+            return
+
+        started = time.time()
+        moved = chat.archive_messages(days, args.batch_size)
+        print(f'Done: {sum(moved.values())} messages into {len(moved)} archive files in {time.time() - started:.1f}s')
+        if args.vacuum:
+            started = time.time()
+            with chat.db.engine.connect() as conn:
+                conn.exec_driver_sql('VACUUM')
+            print(f'Vacuumed the hot database in {time.time() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
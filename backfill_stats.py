@@ -0,0 +1,51 @@
+"""Rebuild the usage statistics rollups (DailyStat) from messages and files.
+
+The server keeps the daily per-user, per-group and per-file-type counters up
+to date as messages are sent and deleted and files are uploaded. Run this once
+after upgrading, after importing or generating data outside the app, or to
+repair drift:
+
+    python backfill_stats.py
+    python backfill_stats.py --check    # compare the rollups with a rebuild, change nothing
+
+File sizes are read from UPLOAD_FOLDER; files missing on disk count as 0 bytes.
+"""
+import argparse
+import time
+
+import app as chat
+
+
+def snapshot():
+    """{(kind, day, key): (messages, files, stored_bytes)} for every rollup row."""
+    rows = chat.db.session.query(chat.DailyStat.kind, chat.DailyStat.day, chat.DailyStat.key, chat.DailyStat.messages,
+                                 chat.DailyStat.files, chat.DailyStat.stored_bytes)
+    return {(kind, day, key): counts for kind, day, key, *counts in rows if any(counts)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--check', action='store_true', help='report rows that differ from a rebuild, then roll back')
+    args = parser.parse_args()
+
+    flask_app = chat.create_app({'SOCKETIO_ASYNC_MODE': 'threading'})
+    with flask_app.app_context():
+        chat.db.create_all()
+        before = snapshot() if args.check else None
+        started = time.time()
+        if args.check:
+            chat.rebuild_daily_stats(commit=False)
+            after = snapshot()
+            chat.db.session.rollback()
+            differing = sorted(k for k in before.keys() | after.keys() if before.get(k) != after.get(k))
+            for kind, day, key in differing[:20]:
+                print(f'  {day} {kind} {key!r}: stored {before.get((kind, day, key))}, '
+                      f'rebuilt {after.get((kind, day, key))}')
+            print(f'{len(differing)} of {len(after)} rollup rows differ')
+            return
+        rows = chat.rebuild_daily_stats()
+        print(f'Rebuilt {rows} rollup rows in {time.time() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Take an online backup of the chat database with SQLite's backup API.
+
+Pages are copied a few at a time (--pages per step, --sleep between steps),
+so the server keeps reading and writing while the copy runs. A write from
+another connection makes SQLite restart the copy, so the result is always a
+consistent snapshot; raise --pages if a busy server keeps it restarting.
+Archive files (ARCHIVE_FOLDER) are copied the same way:
+
+    python backup.py                            # into backups/lanchat-<timestamp>/
+    python backup.py --dest /mnt/nas/lanchat --verify --output backup.json
+    python backup.py --include-keys             # also copy KEY_FILE and KEYRING_FILE
+
+Messages are encrypted. A backup without the key files cannot be read, so
+keep copies of them somewhere safe (--include-keys puts them next to the
+database, which means whoever has the backup can read the messages).
+Uploaded files in static/ are plain files; copy them with rsync or similar.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import app as chat
+
+
+def backup_database(source, target, pages, sleep, verify):
+    """Copy one SQLite file page by page; returns a report dict."""
+    started = time.time()
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if steps % 100 == 0 or remaining == 0:
+            print(f'  {os.path.basename(source)}: {total - remaining}/{total} pages')
+
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+        report = {
+            'source': source,
+            'target': target,
+            'bytes': os.path.getsize(target),
+            'steps': steps,
+            'seconds': round(time.time() - started, 2),
+        }
+        if verify:
+            report['integrity_check'] = dst.execute('PRAGMA integrity_check').fetchone()[0]
+        return report
+    finally:
+        dst.close()
+        src.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dest', help='backup directory (default: backups/lanchat-<UTC timestamp>)')
+    parser.add_argument('--pages', type=int, default=256, help='pages copied per step (default: 256)')
+    parser.add_argument('--sleep', type=float, default=0.05, help='seconds to pause between steps (default: 0.05)')
+    parser.add_argument('--no-archives', action='store_true', help='skip the monthly message archives')
+    parser.add_argument('--include-keys', action='store_true', help='copy the message key files into the backup')
+    parser.add_argument('--verify', action='store_true', help='run PRAGMA integrity_check on every copy')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    flask_app = chat.create_app({'SOCKETIO_ASYNC_MODE': 'threading'})
+    with flask_app.app_context():
+        source = chat.db.engine.url.database
+        if not source or chat.db.engine.url.get_backend_name() != 'sqlite':
+            raise SystemExit('backup.py only supports file-based SQLite databases')
+        dest = args.dest or os.path.join('backups', f'lanchat-{datetime.utcnow():%Y%m%d-%H%M%S}')
+        os.makedirs(dest, exist_ok=True)
+
+        started = time.time()
+        report = {'dest': dest, 'databases': [], 'keys': []}
+        report['databases'].append(backup_database(
+            source, os.path.join(dest, os.path.basename(source)), args.pages, args.sleep, args.verify))
+        if not args.no_archives:
+            archive_dest = os.path.join(dest, 'archive')
+            for path in sorted(glob.glob(os.path.join(flask_app.config['ARCHIVE_FOLDER'], 'messages-*.db'))):
+                os.makedirs(archive_dest, exist_ok=True)
+                report['databases'].append(backup_database(
+                    path, os.path.join(archive_dest, os.path.basename(path)), args.pages, args.sleep, args.verify))
+        if args.include_keys:
+            for key in ('KEY_FILE', 'KEYRING_FILE'):
+                path = flask_app.config[key]
+                if os.path.exists(path):
+                    shutil.copy2(path, os.path.join(dest, os.path.basename(path)))
+                    report['keys'].append(os.path.basename(path))
+        report['seconds'] = round(time.time() - started, 2)
+        print(f"Backed up {len(report['databases'])} databases into {dest} in {report['seconds']}s")
+
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark bulk group membership changes against the per-user endpoints.
+
+Runs on a temporary copy of --db (the original is never modified). An admin
+creates a group, then --users people are added, made admins and removed
+twice: once per user through add_member / set_admin / remove_member, and
+once through /api/groups/<id>/members/bulk. Reports wall time, requests,
+SQL statements and system messages per phase as JSON:
+
+    python bench_group_members.py --db instance/bench.db --users 200
+    python bench_group_members.py --db instance/bench.db --users 500 --output bench_members.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+def query_count(chat):
+    return chat.metric_counters[('lanchat_db_queries_total', ())]
+
+
+def run_phase(chat, client, group_id, requests):
+    """Send (path, body) requests in order; returns timing, statement and system message counts."""
+    with chat.app.app_context():
+        messages_before = chat.Message.query.filter_by(group_id=group_id, sender='System').count()
+    before = query_count(chat)
+    started = time.perf_counter()
+    # The app's debug prints would otherwise land in the JSON report on stdout
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for path, body in requests:
+            resp = client.post(path, json=body)
+            if resp.status_code != 200:
+                sys.exit(f'{path} returned {resp.status_code}: {resp.get_data(as_text=True)}')
+    elapsed = time.perf_counter() - started
+    queries = query_count(chat) - before
+    with chat.app.app_context():
+        messages = chat.Message.query.filter_by(group_id=group_id, sender='System').count() - messages_before
+    return {'requests': len(requests), 'seconds': round(elapsed, 3), 'sql_statements': int(queries),
+            'system_messages': messages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='SQLite database to copy and run against')
+    parser.add_argument('--users', type=int, default=200, help='users added, promoted and removed per path')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        shutil.copyfile(args.db, db_path)
+        import app as chat
+        chat.create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}', 'SOCKETIO_ASYNC_MODE': 'threading',
+                         'GROUP_BULK_LIMIT': max(args.users, 1000)})
+        with chat.app.app_context():
+            chat.db.create_all()
+            names = [u for (u,) in chat.db.session.query(chat.User.username).order_by(chat.User.id)]
+            for i in range(len(names), args.users + 1):
+                user = chat.User(username=f'BenchUser{i:05d}', password='', created_by='bench')
+                chat.db.session.add(user)
+                names.append(user.username)
+            chat.db.session.commit()
+        admin, users = names[0], names[1:args.users + 1]
+
+        client = chat.app.test_client()
+        with client.session_transaction() as sess:
+            sess['username'] = admin
+        report = {'users': len(users), 'per_user': {}, 'bulk': {}}
+        for path_kind in ('per_user', 'bulk'):
+            resp = client.post('/api/groups', json={'name': f'bench-{path_kind}', 'members': [admin]})
+            group_id = resp.get_json()['group_id']
+            base = f'/api/groups/{group_id}'
+            if path_kind == 'per_user':
+                phases = {
+                    'add': [(f'{base}/add_member', {'username': u}) for u in users],
+                    'make_admin': [(f'{base}/set_admin', {'username': u, 'is_admin': True}) for u in users],
+                    'remove': [(f'{base}/remove_member', {'username': u}) for u in users],
+                }
+            else:
+                phases = {
+                    'add': [(f'{base}/members/bulk', {'add': users})],
+                    'make_admin': [(f'{base}/members/bulk', {'roles': {u: 'admin' for u in users}})],
+                    'remove': [(f'{base}/members/bulk', {'remove': users})],
+                }
+            for phase, requests in phases.items():
+                report[path_kind][phase] = run_phase(chat, client, group_id, requests)
+        report['speedup'] = {
+            phase: round(report['per_user'][phase]['seconds'] / max(report['bulk'][phase]['seconds'], 1e-6), 1)
+            for phase in report['bulk']
+        }
+        # Release the copy before the temporary directory goes away
+        with chat.app.app_context():
+            chat.db.engine.dispose()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
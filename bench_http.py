@@ -0,0 +1,237 @@
+"""HTTP benchmark for the hot LAN Chat read paths.
+
+Drives /history (private and group), /search, /unread_counts, /users_status,
+/files_data and /api/groups against a seeded database (see
+generate_dataset.py) and reports per-endpoint latency percentiles, SQL
+statements per request and peak RSS as JSON.
+
+Two targets:
+
+    # in-process, through the Flask test client
+    python bench_http.py --db instance/bench.db --user User00001 --save-baseline bench_baseline.json
+    # a real server (launched on --db with --start-server, or an existing --url)
+    python bench_http.py --target server --start-server --db instance/bench.db --password password
+
+Pass --baseline to compare the run with a saved report; endpoints whose p50,
+p95 or query count grew by more than --threshold percent are listed as
+regressions and the exit status is 1.
+"""
+import argparse
+import contextlib
+import json
+import os
+import re
+import resource
+import sys
+import time
+
+from loadtest import start_server, summarize
+
+COMPARED = ('p50_ms', 'p95_ms', 'queries_per_request')
+
+
+def endpoint_paths(peer, group_id, query):
+    paths = {
+        'history_private': f'/history?user={peer}' if peer else None,
+        'history_group': f'/history?group_id={group_id}' if group_id else None,
+        'search': f'/search?q={query}',
+        'unread_counts': '/unread_counts',
+        'users_status': '/users_status',
+        'files_data': '/files_data',
+        'api_groups': '/api/groups',
+    }
+    return {name: path for name, path in paths.items() if path}
+
+
+def load_app(db_path):
+    """Import the app module and bind it to db_path (or its default database)."""
+    import app as chat
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(db_path)}'} if db_path else None
+    chat.create_app(config)
+    return chat
+
+
+def pick_targets(chat, username):
+    """Busiest private chat partner and busiest group of username, read straight from the database."""
+    from sqlalchemy import func
+    Message, GroupMember = chat.Message, chat.GroupMember
+    with chat.app.app_context():
+        partner = (
+            chat.db.session.query(Message.recipients, func.count())
+            .filter(Message.sender == username, Message.group_id.is_(None))
+            .group_by(Message.recipients).order_by(func.count().desc()).first()
+        )
+        group = (
+            chat.db.session.query(Message.group_id, func.count())
+            .join(GroupMember, (GroupMember.group_id == Message.group_id) & (GroupMember.username == username))
+            .group_by(Message.group_id).order_by(func.count().desc()).first()
+        )
+        user = chat.User.query.filter_by(username=username).first()
+    if user is None:
+        sys.exit(f'user {username} not found in the database')
+    return (partner[0] if partner else None), (group[0] if group else None)
+
+
+def query_count(chat):
+    return chat.metric_counters[('lanchat_db_queries_total', ())]
+
+
+def bench_client(args):
+    """Run every endpoint in-process through app.test_client()."""
+    chat = load_app(args.db)
+    peer, group_id = pick_targets(chat, args.user)
+    peer, group_id = args.peer or peer, args.group_id or group_id
+    client = chat.app.test_client()
+    with client.session_transaction() as sess:
+        sess['username'] = args.user
+
+    results = {}
+    for name, path in endpoint_paths(peer, group_id, args.query).items():
+        latencies, queries, peak_rss = [], [], 0
+        for i in range(args.warmup + args.iterations):
+            before = query_count(chat)
+            # The app's debug prints would otherwise land in the JSON report on stdout
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                started = time.perf_counter()
+                resp = client.get(path)
+                elapsed = time.perf_counter() - started
+            if resp.status_code != 200:
+                sys.exit(f'{path} returned {resp.status_code}')
+            if i >= args.warmup:
+                latencies.append(elapsed)
+                queries.append(query_count(chat) - before)
+                peak_rss = max(peak_rss, chat.process_rss_bytes() or 0)
+        results[name] = dict(summarize(latencies), path=path,
+                             queries_per_request=round(sum(queries) / len(queries), 2),
+                             max_queries=max(queries), peak_rss_mb=round(peak_rss / 2 ** 20, 1))
+    return results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def scrape_metrics(http, url):
+    """Total SQL statements and RSS from the server's /metrics (loopback or admin session)."""
+    text = http.get(f'{url}/metrics').text
+    queries = sum(float(v) for v in re.findall(r'^lanchat_db_queries_total(?:\{[^}]*\})? (\S+)$', text, re.M))
+    rss = re.search(r'^process_resident_memory_bytes (\S+)$', text, re.M)
+    return queries, float(rss.group(1)) if rss else 0.0
+
+
+def bench_server(args):
+    """Run every endpoint over HTTP against a live server."""
+    import requests
+    peer, group_id = args.peer, args.group_id
+    if args.db and not (peer and group_id):
+        chat = load_app(args.db)
+        db_peer, db_group = pick_targets(chat, args.user)
+        peer, group_id = peer or db_peer, group_id or db_group
+
+    http = requests.Session()
+    resp = http.post(f'{args.url}/login', data={'username': args.user, 'password': args.password},
+                     allow_redirects=False)
+    if resp.status_code not in (302, 303):
+        sys.exit(f'login as {args.user} failed; pass --user/--password')
+    if not group_id:
+        groups = http.get(f'{args.url}/api/groups').json()
+        group_id = groups[0]['id'] if groups else None
+
+    results, peak_rss = {}, 0.0
+    for name, path in endpoint_paths(peer, group_id, args.query).items():
+        latencies = []
+        for i in range(args.warmup + args.iterations):
+            if i == args.warmup:
+                queries_before, _ = scrape_metrics(http, args.url)
+            started = time.perf_counter()
+            resp = http.get(f'{args.url}{path}')
+            elapsed = time.perf_counter() - started
+            if resp.status_code != 200:
+                sys.exit(f'{path} returned {resp.status_code}')
+            if i >= args.warmup:
+                latencies.append(elapsed)
+        queries_after, rss = scrape_metrics(http, args.url)
+        peak_rss = max(peak_rss, rss)
+        results[name] = dict(summarize(latencies), path=path,
+                             queries_per_request=round((queries_after - queries_before) / args.iterations, 2),
+                             peak_rss_mb=round(rss / 2 ** 20, 1))
+    return results, peak_rss / 2 ** 20
+
+
+def compare(report, baseline, threshold):
+    """Per-endpoint percentage change against a baseline report; returns (diff, regressions)."""
+    diff, regressions = {}, []
+    for name, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        changes = {}
+        for key in COMPARED:
+            old, new = previous.get(key), current.get(key)
+            if old is None or new is None:
+                continue
+            pct = round((new - old) / old * 100, 1) if old else (0.0 if new == old else float('inf'))
+            changes[key] = {'baseline': old, 'current': new, 'change_pct': pct}
+            if pct > threshold:
+                regressions.append(f'{name}.{key}: {old} -> {new} (+{pct}%)')
+        diff[name] = changes
+    return diff, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=('client', 'server'), default='client',
+                        help='Flask test client in this process, or a live server over HTTP')
+    parser.add_argument('--db', help='seeded SQLite file the app (and --start-server) runs against')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='server base URL for --target server')
+    parser.add_argument('--start-server', action='store_true', help='launch app.py on --db and target it')
+    parser.add_argument('--user', default='User00001', help='user the requests run as')
+    parser.add_argument('--password', default='password', help='password of --user (server target only)')
+    parser.add_argument('--peer', help='private chat partner for /history (default: busiest partner in --db)')
+    parser.add_argument('--group-id', type=int, help='group for /history (default: busiest group in --db)')
+    parser.add_argument('--query', default='report', help='search term for /search')
+    parser.add_argument('--iterations', type=int, default=50, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per endpoint')
+    parser.add_argument('--baseline', help='saved report to compare against')
+    parser.add_argument('--threshold', type=float, default=20.0, help='percent growth counted as a regression')
+    parser.add_argument('--save-baseline', help='also write this report as a new baseline file')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    server = None
+    if args.target == 'server' and args.start_server:
+        env = {'LANCHAT_DATABASE_URI': f'sqlite:///{os.path.abspath(args.db)}'} if args.db else None
+        server, args.url = start_server(env=env)
+    try:
+        if args.target == 'client':
+            endpoints, peak_rss_mb = bench_client(args)
+        else:
+            endpoints, peak_rss_mb = bench_server(args)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report = {
+        'config': {'target': args.target, 'db': args.db, 'url': args.url if args.target == 'server' else None,
+                   'user': args.user, 'iterations': args.iterations, 'warmup': args.warmup, 'query': args.query},
+        'endpoints': endpoints,
+        'peak_rss_mb': round(peak_rss_mb, 1),
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['baseline_diff'], regressions = compare(report, json.load(f), args.threshold)
+        report['regressions'] = regressions
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({k: v for k, v in report.items() if k not in ('baseline_diff', 'regressions')}, f, indent=2)
+            f.write('\n')
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Startup-time benchmark for LAN Chat.
+
+Times three stages in fresh interpreter processes, so module caches never
+carry over between runs:
+
+    import      `import app`; must not bind ports, touch the key file or load Pillow
+    create_app  binding db and socketio to the app
+    first       the first request through the test client (GET /login)
+
+    python bench_startup.py --runs 10
+    python bench_startup.py --runs 10 --budget-ms 1000   # exit 1 if import + create_app is slower
+
+The report also lists the heavy modules and files a bare import created. The
+target is none of either: no PIL, eventlet or cryptography.fernet, and no
+instance/ directory.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HEAVY_MODULES = ('PIL.Image', 'eventlet', 'cryptography.fernet')
+
+PROBE = r'''
+import json, os, sys, time
+t0 = time.perf_counter()
+import app as chat
+t1 = time.perf_counter()
+heavy = [m for m in {heavy!r} if m in sys.modules]
+created = sorted(os.listdir('.'))
+flask_app = chat.create_app({{'SQLALCHEMY_DATABASE_URI': {uri!r}}})
+t2 = time.perf_counter()
+with flask_app.app_context():
+    chat.db.create_all()
+t3 = time.perf_counter()
+status = flask_app.test_client().get('/login').status_code
+t4 = time.perf_counter()
+print(json.dumps({{'import': t1 - t0, 'create_app': t2 - t1, 'first': t4 - t3, 'status': status,
+                  'heavy': heavy, 'created': created}}))
+'''
+
+
+def run_probe(here, uri):
+    """One fresh interpreter, started in an empty directory so files created on import show up."""
+    code = PROBE.format(heavy=HEAVY_MODULES, uri=uri)
+    with tempfile.TemporaryDirectory() as cwd:
+        out = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], cwd=cwd, capture_output=True, text=True,
+                             env=dict(os.environ, PYTHONPATH=here))
+    if out.returncode:
+        sys.exit(out.stderr)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, help='fail if median import + create_app exceeds this')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f'sqlite:///{os.path.join(tmp, "startup.db")}'
+        samples = [run_probe(here, uri) for _ in range(args.runs)]
+
+    report = {'runs': args.runs}
+    for stage in ('import', 'create_app', 'first'):
+        values = sorted(s[stage] * 1000 for s in samples)
+        report[f'{stage}_ms'] = {'median': round(statistics.median(values), 1), 'min': round(values[0], 1),
+                                 'max': round(values[-1], 1)}
+    startup = statistics.median(s['import'] + s['create_app'] for s in samples) * 1000
+    report['startup_median_ms'] = round(startup, 1)
+    report['heavy_modules_on_import'] = samples[0]['heavy']
+    report['files_created_on_import'] = samples[0]['created']
+    report['first_request_status'] = samples[0]['status']
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.budget_ms and startup > args.budget_ms:
+        sys.exit(f'startup {startup:.0f} ms exceeds budget {args.budget_ms:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Find, quarantine and purge files on disk that no database row references.
+
+Compares static/uploads/ with File, static/profile_photos/ with
+User.profile_photo and static/group_photos/ with Group.icon, in name order
+and in batches. The position is saved after every batch, so an interrupted
+scan continues where it stopped. Orphans are moved to ORPHAN_QUARANTINE_FOLDER
+first and only deleted by --purge once they are older than
+ORPHAN_PURGE_AFTER_DAYS, which leaves time to --restore a false positive:
+
+    python gc_files.py --dry-run          # report reclaimable bytes, change nothing
+    python gc_files.py                    # scan every folder, quarantine orphans
+    python gc_files.py --purge            # delete quarantined files past the retention period
+    python gc_files.py --restore 12       # put quarantined file 12 back
+    python gc_files.py --status --output storage.json
+"""
+import argparse
+import json
+import time
+
+import app as chat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--folder', action='append', help='only scan this folder key (repeatable): uploads, '
+                                                         'profile_photos, group_photos')
+    parser.add_argument('--dry-run', action='store_true', help='count orphans and their bytes without moving them')
+    parser.add_argument('--restart', action='store_true', help='forget saved positions and scan from the start')
+    parser.add_argument('--purge', action='store_true', help='delete quarantined files instead of scanning')
+    parser.add_argument('--older-than-days', type=int, help='with --purge: retention (default: ORPHAN_PURGE_AFTER_DAYS)')
+    parser.add_argument('--restore', type=int, metavar='ID', help='move a quarantined file back and exit')
+    parser.add_argument('--status', action='store_true', help='print the storage report and exit')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    flask_app = chat.create_app({'SOCKETIO_ASYNC_MODE': 'threading'})
+    with flask_app.app_context():
+        chat.db.create_all()
+        if args.restore is not None:
+            orphan = chat.OrphanFile.query.get(args.restore)
+            if orphan is None:
+                raise SystemExit(f'No quarantined file with id {args.restore}')
+            chat.restore_orphan(orphan)
+            print(f'Restored {orphan.folder}/{orphan.filename}')
+            return
+        if args.purge:
+            files, reclaimed = chat.purge_quarantine(args.older_than_days)
+            print(f'Purged {files} quarantined files, {reclaimed / 1e6:.1f} MB reclaimed')
+            return
+        if not args.status:
+            if args.restart:
+                chat.OrphanScan.query.delete()
+                chat.db.session.commit()
+            started = time.time()
+            for folder in args.folder or chat.orphan_folders():
+                scan = chat.scan_orphans(folder, dry_run=args.dry_run)
+                verb = 'found' if args.dry_run else 'quarantined'
+                print(f'  {folder}: {scan.scanned} files checked, {scan.orphans} orphans {verb} '
+                      f'({scan.orphan_bytes / 1e6:.1f} MB)')
+            print(f'Scan finished in {time.time() - started:.1f}s')
+            if args.dry_run:
+                return
+
+        text = json.dumps(chat.storage_report(), indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+
+
+if __name__ == '__main__':
+    main()
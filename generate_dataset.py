@@ -0,0 +1,257 @@
+"""Synthetic dataset generator for scale-testing LAN Chat.
+
+Fills a fresh SQLite database with users, groups, group members, messages
+(encrypted with encrypt_message, exactly as the app stores them), files,
+hidden messages, pinned messages and group activity. The shape comes from
+configurable distributions, and rows go in through bulk inserts, so a
+1M-message database takes minutes:
+
+    python generate_dataset.py --db instance/bench.db --users 500 --groups 60 \\
+        --days 365 --messages-per-day 2740 --seed 42
+
+The same seed and --end-date always produce the same users, groups,
+conversations and plaintext. Only the ciphertext differs between runs, because
+every encryption uses a fresh random nonce. Every generated user can log in
+with --password.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+WORDS = (
+    'ok sure thanks meeting today tomorrow report deploy server build release review lunch call '
+    'please check the file update fixed broken network printer backup ticket invoice client '
+    'project deadline draft slides notes agenda minutes budget schedule shift leave approved '
+    'can you send me when is done working on it looks good let me know asap later now'
+).split()
+FILE_TYPES = (
+    ('report.pdf', 'application/pdf'), ('photo.jpg', 'image/jpeg'), ('screenshot.png', 'image/png'),
+    ('notes.txt', 'text/plain'), ('data.xlsx', 'application/vnd.ms-excel'), ('clip.mp4', 'video/mp4'),
+    ('archive.zip', 'application/zip'), ('slides.pptx', 'application/vnd.ms-powerpoint'),
+)
+EMOJIS = ('👍', '❤️', '😂', '🎉', '✅')
+CHUNK = 10000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='instance/bench.db', help='SQLite file to create')
+    parser.add_argument('--force', action='store_true', help='overwrite --db if it exists')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--groups', type=int, default=30)
+    parser.add_argument('--groups-per-user', type=float, default=3.0, help='mean group memberships per user')
+    parser.add_argument('--contacts-per-user', type=int, default=12, help='private chat partners per user')
+    parser.add_argument('--days', type=int, default=90, help='days of history ending at --end-date')
+    parser.add_argument('--end-date', type=lambda v: datetime.strptime(v, '%Y-%m-%d'),
+                        default=datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0),
+                        help='last day of history, YYYY-MM-DD (default: today); fix it for reproducible timestamps')
+    parser.add_argument('--messages-per-day', type=int, default=1000)
+    parser.add_argument('--group-ratio', type=float, default=0.6, help='share of messages sent to groups')
+    parser.add_argument('--attachment-ratio', type=float, default=0.03)
+    parser.add_argument('--reply-ratio', type=float, default=0.1)
+    parser.add_argument('--reaction-ratio', type=float, default=0.05)
+    parser.add_argument('--hidden-ratio', type=float, default=0.01, help='share of messages a recipient hid')
+    parser.add_argument('--pins-per-group', type=int, default=3)
+    parser.add_argument('--password', default='password', help='password of every generated user')
+    parser.add_argument('--write-files', action='store_true', help='also write tiny placeholder upload files')
+    return parser.parse_args()
+
+
+def weighted_picker(rng, items, skew=1.2):
+    """Heavy-tailed picker so a few users/groups are much busier than the rest."""
+    weights = [1.0 / (rank + 1) ** skew for rank in range(len(items))]
+    shuffled = list(items)
+    rng.shuffle(shuffled)
+    cumulative, total = [], 0.0
+    for w in weights:
+        total += w
+        cumulative.append(total)
+    return lambda: rng.choices(shuffled, cum_weights=cumulative)[0]
+
+
+def sentence(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 14))).capitalize()
+
+
+def insert_rows(db, table, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(table.insert(), rows[start:start + CHUNK])
+
+
+def main():
+    args = parse_args()
+    db_path = os.path.abspath(args.db)
+    if os.path.exists(db_path):
+        if not args.force:
+            sys.exit(f'{args.db} exists; pass --force to overwrite it')
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    import app as chat
+    from app import (db, User, Group, GroupMember, Message, File, HiddenMessage, PinnedMessage,
+                     GroupActivity, encrypt_message)
+    flask_app = chat.create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}', 'SOCKETIO_ASYNC_MODE': 'threading'})
+
+    rng = random.Random(args.seed)
+    started = time.time()
+    with flask_app.app_context():
+        db.create_all()
+        conn = db.session.connection()
+        conn.exec_driver_sql('PRAGMA journal_mode=MEMORY')
+        conn.exec_driver_sql('PRAGMA synchronous=OFF')
+
+        # --- Users ---
+        template = User(username='template', password='')
+        chat.set_encrypted_password(template, args.password)
+        usernames = [f'User{i:05d}' for i in range(1, args.users + 1)]
+        insert_rows(db, User.__table__, [
+            {'id': i, 'username': name, 'password': template.password, 'online': False,
+             'is_admin': i == 1, 'created_by': 'generator', 'profile_photo': None}
+            for i, name in enumerate(usernames, start=1)
+        ])
+
+        # --- Groups and memberships ---
+        pick_group = weighted_picker(rng, list(range(1, args.groups + 1)))
+        members = {gid: [] for gid in range(1, args.groups + 1)}
+        for name in usernames:
+            wanted = min(args.groups, int(rng.expovariate(1.0 / args.groups_per_user) + 0.5)) if args.groups else 0
+            joined = set()
+            for _ in range(wanted * 3):
+                if len(joined) >= wanted:
+                    break
+                joined.add(pick_group())
+            for gid in sorted(joined):
+                members[gid].append(name)
+        start_day = args.end_date - timedelta(days=args.days - 1)
+        group_rows, member_rows, activity_rows = [], [], []
+        for gid in range(1, args.groups + 1):
+            if not members[gid]:
+                members[gid].append(rng.choice(usernames))
+            creator = members[gid][0]
+            created_at = start_day - timedelta(days=rng.randint(1, 30))
+            group_rows.append({'id': gid, 'name': f'Team {gid:03d}', 'description': sentence(rng), 'icon': None,
+                               'created_by': creator, 'created_at': created_at, 'admin_only': rng.random() < 0.05})
+            activity_rows.append({'group_id': gid, 'action_type': 'group_created', 'actor': creator, 'target': None,
+                                  'details': json.dumps({'members': members[gid]}), 'timestamp': created_at})
+            for name in members[gid]:
+                is_admin = name == creator or rng.random() < 0.05
+                member_rows.append({'group_id': gid, 'username': name, 'is_admin': is_admin,
+                                    'role': 'admin' if is_admin else 'member', 'joined_at': created_at,
+                                    'notification_preference': rng.choice(('all', 'all', 'all', 'mentions', 'none'))})
+                if name != creator:
+                    activity_rows.append({'group_id': gid, 'action_type': 'member_added', 'actor': creator,
+                                          'target': name, 'details': None, 'timestamp': created_at})
+        insert_rows(db, Group.__table__, group_rows)
+        insert_rows(db, GroupMember.__table__, member_rows)
+        user_groups = {name: [] for name in usernames}
+        for gid, names in members.items():
+            for name in names:
+                user_groups[name].append(gid)
+
+        # --- Private chat partners ---
+        contacts = {}
+        for name in usernames:
+            others = [u for u in usernames if u != name]
+            contacts[name] = rng.sample(others, min(args.contacts_per_user, len(others)))
+
+        # --- Messages, files, hidden messages ---
+        pick_sender = weighted_picker(rng, usernames, skew=0.8)
+        recent = {}  # conversation key -> recent message ids, reply targets
+        group_message_ids = {gid: [] for gid in members}
+        msg_id, file_id, hidden_count, total = 0, 0, 0, args.days * args.messages_per_day
+        upload_folder = flask_app.config['UPLOAD_FOLDER']
+        if args.write_files:
+            os.makedirs(upload_folder, exist_ok=True)
+        messages, files, hidden = [], [], []
+
+        def flush():
+            insert_rows(db, File.__table__, files)
+            insert_rows(db, Message.__table__, messages)
+            insert_rows(db, HiddenMessage.__table__, hidden)
+            db.session.commit()
+            files.clear()
+            messages.clear()
+            hidden.clear()
+
+        for day in range(args.days):
+            day_start = start_day + timedelta(days=day)
+            offsets = sorted(rng.randrange(86400) for _ in range(args.messages_per_day))
+            for offset in offsets:
+                msg_id += 1
+                timestamp = day_start + timedelta(seconds=offset)
+                sender = pick_sender()
+                groups = user_groups[sender]
+                group_id = None
+                if groups and rng.random() < args.group_ratio:
+                    group_id = rng.choice(groups)
+                    recipients = f'group-{group_id}'
+                    key = recipients
+                    group_message_ids[group_id].append(msg_id)
+                else:
+                    recipients = rng.choice(contacts[sender])
+                    key = tuple(sorted((sender, recipients)))
+                content = sentence(rng)
+                attachment = None
+                if rng.random() < args.attachment_ratio:
+                    file_id += 1
+                    original, mimetype = rng.choice(FILE_TYPES)
+                    stem, ext = os.path.splitext(original)
+                    filename = f'{stem}_{file_id}{ext}'
+                    files.append({'id': file_id, 'filename': filename, 'original_name': original,
+                                  'uploader': sender, 'timestamp': timestamp, 'mimetype': mimetype})
+                    if args.write_files:
+                        with open(os.path.join(upload_folder, filename), 'wb') as f:
+                            f.write(b'lanchat synthetic file\n')
+                    attachment = file_id
+                    if rng.random() < 0.5:
+                        content = ''
+                reply_to = None
+                history = recent.setdefault(key, [])
+                if history and rng.random() < args.reply_ratio:
+                    reply_to = rng.choice(history)
+                history.append(msg_id)
+                if len(history) > 20:
+                    del history[0]
+                reactions = None
+                if rng.random() < args.reaction_ratio:
+                    reactions = json.dumps({rng.choice(EMOJIS): rng.sample(usernames, min(3, len(usernames)))[:rng.randint(1, 3)]})
+                messages.append({
+                    'id': msg_id, 'sender': sender, 'recipients': recipients,
+                    'content': encrypt_message(content) if content else None,
+                    'timestamp': timestamp, 'file_id': attachment,
+                    'status': 'read' if day < args.days - 1 else 'sent',
+                    'reply_to': reply_to, 'reactions': reactions, 'group_id': group_id,
+                })
+                if rng.random() < args.hidden_ratio:
+                    viewer = recipients if group_id is None else rng.choice(members[group_id])
+                    hidden_count += 1
+                    hidden.append({'msg_id': msg_id, 'username': viewer, 'created_at': timestamp})
+                if len(messages) >= CHUNK:
+                    flush()
+            if (day + 1) % 10 == 0 or day == args.days - 1:
+                rate = msg_id / max(time.time() - started, 1e-6)
+                print(f'  day {day + 1}/{args.days}: {msg_id}/{total} messages ({rate:,.0f}/s)', flush=True)
+        flush()
+
+        # --- Pins and activity ---
+        pin_rows = []
+        for gid, ids in group_message_ids.items():
+            for message_id in rng.sample(ids, min(args.pins_per_group, len(ids))):
+                pin_rows.append({'group_id': gid, 'message_id': message_id, 'pinned_by': members[gid][0],
+                                 'pinned_at': args.end_date + timedelta(days=1)})
+        insert_rows(db, PinnedMessage.__table__, pin_rows)
+        insert_rows(db, GroupActivity.__table__, activity_rows)
+        db.session.commit()
+
+    print(f'Wrote {args.db}: {len(usernames)} users, {len(group_rows)} groups, {len(member_rows)} memberships, '
+          f'{msg_id} messages, {file_id} files, {hidden_count} hidden, {len(pin_rows)} pins '
+          f'in {time.time() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
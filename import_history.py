@@ -0,0 +1,89 @@
+"""Bulk-import chat history from other tools out of a JSONL file.
+
+One JSON object per line, processed in file order. "type" defaults to
+"message"; users and groups must appear before the messages that use them:
+
+    {"type": "user", "username": "alice", "is_admin": false}
+    {"type": "group", "id": "eng", "name": "Engineering", "description": "...",
+     "members": ["alice", "bob"], "admins": ["alice"], "created_by": "alice",
+     "created_at": "2021-03-01T09:00:00Z"}
+    {"type": "message", "id": "m1", "from": "alice", "to": ["bob"],
+     "timestamp": "2021-03-01T09:05:00+01:00", "text": "hi"}
+    {"id": "m2", "from": "bob", "group": "eng", "timestamp": 1614589500,
+     "text": "see attached", "reply_to": "m1", "reactions": {"👍": ["alice"]},
+     "file": {"path": "files/plan.pdf", "name": "plan.pdf", "mimetype": "application/pdf"}}
+
+Timestamps are ISO 8601 (offsets converted to UTC) or Unix seconds. "file"
+paths are relative to the JSONL file and are copied into UPLOAD_FOLDER like
+normal uploads; "file" may also be just the path. Names go through --user-map
+and source group ids through --group-map (JSON objects); unmapped groups are
+created, and unknown users are created without a password unless
+--no-create-users, which skips their messages instead (as it always does
+for names whose account deletion is still running). Imported messages
+are marked read and count towards the usage statistics; @mentions in them
+do not notify anyone. They get new ids but sort into conversations by their
+timestamps, and a user's earlier "clear chat" hides those dated before it.
+
+Texts are encrypted in --workers processes while the previous batch is
+inserted, each batch is one transaction, and non-unique indexes on message
+and file are dropped for the run and rebuilt at the end. The file position
+is committed with every batch, so running the same command again after a
+crash or Ctrl-C resumes where it stopped (with the maps the job started
+with):
+
+    python import_history.py export.jsonl --user-map users.json
+    python import_history.py export.jsonl --workers 8 --batch-size 5000
+    python import_history.py --status
+"""
+import argparse
+import json
+import time
+
+import app as chat
+
+
+def load_map(path):
+    if not path:
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', nargs='?', help='JSONL file to import')
+    parser.add_argument('--user-map', help='JSON file {"source name": "LAN chat username"}')
+    parser.add_argument('--group-map', help='JSON file {"source group id": existing group id}')
+    parser.add_argument('--no-create-users', action='store_true', help='skip messages of unknown users')
+    parser.add_argument('--workers', type=int, help='encryption processes, 0 encrypts in-process '
+                                                    '(default: IMPORT_WORKERS)')
+    parser.add_argument('--batch-size', type=int, help='messages per transaction (default: IMPORT_BATCH_SIZE)')
+    parser.add_argument('--keep-indexes', action='store_true', help='do not drop indexes during the import')
+    parser.add_argument('--restart', action='store_true', help='import the file again from the start')
+    parser.add_argument('--status', action='store_true', help='list import jobs and exit')
+    args = parser.parse_args()
+
+    flask_app = chat.create_app({'SOCKETIO_ASYNC_MODE': 'threading'})
+    with flask_app.app_context():
+        chat.db.create_all()
+        if args.status or not args.source:
+            for job in chat.ImportJob.query.order_by(chat.ImportJob.id):
+                print(job.to_dict())
+            return
+        started = time.time()
+        job = chat.import_history(
+            args.source,
+            user_map=load_map(args.user_map),
+            group_map=load_map(args.group_map),
+            create_users=not args.no_create_users,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            defer_indexes=not args.keep_indexes,
+            restart=args.restart,
+        )
+        print(f'Job {job.id} {job.status}: {job.imported} messages, {job.files} files, {job.skipped} skipped '
+              f'in {time.time() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""Socket.IO load generator for LAN Chat.
+
+Logs N simulated users in through /login, connects a python-socketio client for
+each of them and drives a configurable mix of private messages, group
+messages, reactions and typing events. Reports end-to-end delivery latency
+percentiles, throughput and error rate as JSON.
+
+Only needs a locally running server (or --start-server to launch app.py):
+
+    pip install "python-socketio[client]"
+    python loadtest.py --users 20 --duration 30 --output bench_output.txt
+    python loadtest.py --start-server --users 50 --mix private=5,group=3,reaction=1,typing=1
+
+Missing load-test users are created through /add-user with the admin account
+given by --admin-user/--admin-password (the default admins from app.py).
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+import socketio
+
+EVENT_TYPES = ('private', 'group', 'reaction', 'typing')
+EMOJIS = ('👍', '❤️', '😂', '🎉')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2),
+        'mean_ms': round(sum(values) / len(values) * 1000, 2),
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in EVENT_TYPES:
+            raise argparse.ArgumentTypeError(f'unknown event type {name!r}; use {", ".join(EVENT_TYPES)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Stats:
+    """Shared counters and latency samples, guarded by one lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {name: 0 for name in EVENT_TYPES}
+        self.errors = {}
+        self.latency = {'private': [], 'group': [], 'reaction': []}
+        self.pending = {}          # message token -> (send time, kind, expected deliveries)
+        self.delivered = {}        # message token -> deliveries seen
+        self.pending_reactions = {}  # (msg_id, emoji, user) -> send time
+        self.message_ids = []      # ids of delivered messages, targets for reactions
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class SimulatedUser:
+    def __init__(self, base_url, username, password, stats):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.stats = stats
+        self.http = requests.Session()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('receive_message', self.on_receive_message)
+        self.sio.on('update_reactions', self.on_update_reactions)
+        self.sio.on('rate_limited', lambda data: stats.error(f"rate_limited:{data.get('event')}"))
+        self.sio.on('group_admin_only_error', lambda data: stats.error('group_admin_only'))
+
+    def login(self):
+        resp = self.http.post(f'{self.base_url}/login', data={'username': self.username, 'password': self.password},
+                              allow_redirects=False)
+        return resp.status_code in (302, 303) and 'session' in self.http.cookies
+
+    def connect(self):
+        cookie = '; '.join(f'{k}={v}' for k, v in self.http.cookies.items())
+        self.sio.connect(self.base_url, headers={'Cookie': cookie}, transports=['websocket'])
+        self.sio.emit('join', {'room': self.username})
+
+    def on_receive_message(self, msg):
+        now = time.time()
+        content = msg.get('content') or ''
+        if msg.get('sender') == self.username or not content.startswith('lt '):
+            return
+        token = content.split(' ', 2)[1]
+        stats = self.stats
+        with stats.lock:
+            entry = stats.pending.get(token)
+            if entry is None:
+                return
+            sent_at, kind, _ = entry
+            stats.latency[kind].append(now - sent_at)
+            stats.delivered[token] = stats.delivered.get(token, 0) + 1
+            stats.message_ids.append(msg['id'])
+            if len(stats.message_ids) > 1000:
+                del stats.message_ids[:500]
+
+    def on_update_reactions(self, data):
+        now = time.time()
+        stats = self.stats
+        with stats.lock:
+            for emoji, users in (data.get('reactions') or {}).items():
+                sent_at = stats.pending_reactions.pop((data.get('msg_id'), emoji, self.username), None)
+                if sent_at is not None and self.username in users:
+                    stats.latency['reaction'].append(now - sent_at)
+
+    def send_message(self, kind, recipients, expected):
+        token = uuid.uuid4().hex
+        with self.stats.lock:
+            self.stats.pending[token] = (time.time(), kind, expected)
+            self.stats.sent[kind] += 1
+        self.sio.emit('send_message', {'recipients': recipients, 'content': f'lt {token} load test message'})
+
+    def react(self, rng):
+        with self.stats.lock:
+            if not self.stats.message_ids:
+                return False
+            msg_id = rng.choice(self.stats.message_ids)
+            emoji = rng.choice(EMOJIS)
+            self.stats.pending_reactions[(msg_id, emoji, self.username)] = time.time()
+            self.stats.sent['reaction'] += 1
+        self.sio.emit('react_message', {'msg_id': msg_id, 'emoji': emoji})
+        return True
+
+    def typing(self, to):
+        with self.stats.lock:
+            self.stats.sent['typing'] += 1
+        self.sio.emit('typing', {'to': to})
+        self.sio.emit('stop_typing', {'to': to})
+
+
+def ensure_users(base_url, names, password, admin_user, admin_password):
+    """Create any missing load-test users through the admin /add-user form."""
+    admin = requests.Session()
+    resp = admin.post(f'{base_url}/login', data={'username': admin_user, 'password': admin_password},
+                      allow_redirects=False)
+    if resp.status_code not in (302, 303):
+        raise SystemExit(f'admin login as {admin_user} failed; pass --admin-user/--admin-password')
+    for name in names:
+        admin.post(f'{base_url}/add-user', data={'action': 'create_user', 'new_username': name,
+                                                 'new_password': password}, allow_redirects=False)
+
+
+def start_server(startup_timeout=30, env=None):
+    """Launch app.py from this directory and return (process, base_url)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=here, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True, bufsize=1,
+                            env=dict(os.environ, **(env or {})))
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        line = proc.stdout.readline()
+        if not line:
+            break
+        match = re.search(r'Localhost IP:\s+(http://\S+)', line)
+        if match:
+            base_url = match.group(1)
+            while time.time() < deadline:
+                try:
+                    requests.get(f'{base_url}/login', timeout=1)
+                    threading.Thread(target=proc.stdout.read, daemon=True).start()
+                    return proc, base_url
+                except requests.ConnectionError:
+                    time.sleep(0.2)
+    proc.kill()
+    raise SystemExit('server did not start')
+
+
+def run(args):
+    stats = Stats()
+    rng = random.Random(args.seed)
+    names = [f'{args.user_prefix}{i}'.title() for i in range(1, args.users + 1)]
+    if args.admin_user:
+        ensure_users(args.url, names, args.password, args.admin_user, args.admin_password)
+
+    users = []
+    for name in names:
+        user = SimulatedUser(args.url, name, args.password, stats)
+        if not user.login():
+            stats.error('login')
+            continue
+        try:
+            user.connect()
+        except socketio.exceptions.ConnectionError:
+            stats.error('connect')
+            continue
+        users.append(user)
+    if len(users) < 2:
+        raise SystemExit('need at least two logged-in users to generate traffic')
+
+    group_room = None
+    resp = users[0].http.post(f'{args.url}/api/groups',
+                              json={'name': f'Load test {uuid.uuid4().hex[:6]}', 'members': [u.username for u in users]})
+    if resp.ok and resp.json().get('group_id'):
+        group_room = f"group-{resp.json()['group_id']}"
+    else:
+        stats.error('group_create')
+
+    kinds = [k for k in EVENT_TYPES if args.mix.get(k) and (k != 'group' or group_room)]
+    weights = [args.mix[k] for k in kinds]
+    interval = 1.0 / args.rate if args.rate > 0 else 0
+    stop_at = time.time() + args.duration
+
+    def drive(user, seed):
+        local = random.Random(seed)
+        peers = [u.username for u in users if u is not user]
+        next_at = time.time() + local.random() * interval
+        while time.time() < stop_at:
+            kind = local.choices(kinds, weights)[0]
+            try:
+                if kind == 'private':
+                    user.send_message('private', local.choice(peers), 1)
+                elif kind == 'group':
+                    user.send_message('group', group_room, len(users) - 1)
+                elif kind == 'reaction':
+                    if not user.react(local):
+                        user.send_message('private', local.choice(peers), 1)
+                else:
+                    user.typing(local.choice(peers))
+            except socketio.exceptions.SocketIOError:
+                stats.error('emit')
+            next_at += interval
+            time.sleep(max(0.0, next_at - time.time()))
+
+    started = time.time()
+    threads = [threading.Thread(target=drive, args=(u, rng.random()), daemon=True) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+    time.sleep(args.drain)  # let in-flight deliveries arrive
+
+    for user in users:
+        try:
+            user.sio.disconnect()
+        except Exception:
+            pass
+
+    with stats.lock:
+        expected = sum(exp for _, _, exp in stats.pending.values())
+        delivered = sum(stats.delivered.values())
+        undelivered = max(0, expected - delivered)
+        if undelivered:
+            stats.errors['undelivered'] = undelivered
+        unanswered = len(stats.pending_reactions)
+        if unanswered:
+            stats.errors['reaction_unconfirmed'] = unanswered
+        total_sent = sum(stats.sent.values())
+        total_errors = sum(stats.errors.values())
+        return {
+            'config': {
+                'url': args.url, 'users': args.users, 'connected': len(users), 'duration_s': args.duration,
+                'rate_per_user': args.rate, 'mix': args.mix, 'seed': args.seed,
+            },
+            'elapsed_s': round(elapsed, 3),
+            'sent': dict(stats.sent),
+            'throughput_events_per_s': round(total_sent / elapsed, 2) if elapsed else None,
+            'deliveries': {'expected': expected, 'delivered': delivered},
+            'delivery_rate_per_s': round(delivered / elapsed, 2) if elapsed else None,
+            'latency': {kind: summarize(values) for kind, values in stats.latency.items()},
+            'errors': dict(stats.errors),
+            'error_rate': round(total_errors / max(1, total_sent + expected), 4),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='server base URL')
+    parser.add_argument('--start-server', action='store_true', help='launch app.py locally and target it')
+    parser.add_argument('--users', type=int, default=10, help='number of simulated users')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of traffic')
+    parser.add_argument('--rate', type=float, default=1.0, help='events per second per user')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('private=5,group=3,reaction=1,typing=1'),
+                        help='weighted event mix, e.g. private=5,group=3,reaction=1,typing=1')
+    parser.add_argument('--user-prefix', default='loadtest', help='username prefix for simulated users')
+    parser.add_argument('--password', default='loadtest-password', help='password of the simulated users')
+    parser.add_argument('--admin-user', default='Vicky', help='admin used to create missing users ("" to skip)')
+    parser.add_argument('--admin-password', default='vickyadmin')
+    parser.add_argument('--drain', type=float, default=2.0, help='seconds to wait for in-flight deliveries')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    server = None
+    if args.start_server:
+        server, args.url = start_server()
+    try:
+        report = run(args)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
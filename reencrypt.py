@@ -0,0 +1,56 @@
+"""Re-encrypt stored messages under the current cipher and primary key.
+
+Runs the same resumable, batched job as POST /api/admin/reencrypt, but in the
+foreground. Progress is committed after every batch (JobCursor), so an
+interrupted run continues where it stopped:
+
+    python reencrypt.py                # legacy Fernet rows -> AES-GCM (MESSAGE_CIPHER)
+    python reencrypt.py --rotate       # new primary key, then rewrite every row
+    python reencrypt.py --status
+
+Rotate with the server stopped, or use the admin endpoint instead; a running
+server keeps encrypting with the primary key it loaded at startup.
+"""
+import argparse
+import time
+
+import app as chat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rotate', action='store_true', help='add a new primary key first (implies --restart)')
+    parser.add_argument('--restart', action='store_true', help='start again from the first message')
+    parser.add_argument('--batch-size', type=int, help='rows per batch (default: REENCRYPT_BATCH_SIZE)')
+    parser.add_argument('--status', action='store_true', help='print the job cursor and exit')
+    args = parser.parse_args()
+
+    flask_app = chat.create_app({'SOCKETIO_ASYNC_MODE': 'threading'})
+    with flask_app.app_context():
+        chat.db.create_all()
+        cursor = chat.get_job_cursor(chat.REENCRYPT_JOB)
+        if args.status:
+            print(cursor.to_dict())
+            return
+        if args.rotate:
+            key_id = chat.get_message_keyring().rotate()
+            print(f'New primary message key: {key_id}')
+        if args.rotate or args.restart or cursor.status == 'done':
+            cursor.reset()
+        chat.db.session.commit()
+
+        batch_size = args.batch_size or flask_app.config['REENCRYPT_BATCH_SIZE']
+        last_id = chat.db.session.query(chat.func.max(chat.Message.id)).scalar() or 0
+        started, resumed_at = time.time(), cursor.processed
+        while not chat.reencrypt_batch(batch_size):
+            cursor = chat.get_job_cursor(chat.REENCRYPT_JOB)
+            rate = (cursor.processed - resumed_at) / max(time.time() - started, 1e-6)
+            print(f'  up to id {cursor.last_id}/{last_id}: {cursor.changed} rewritten, '
+                  f'{cursor.failed} failed ({rate:,.0f} rows/s)', flush=True)
+        cursor = chat.get_job_cursor(chat.REENCRYPT_JOB)
+        print(f'Done: {cursor.changed} of {cursor.processed} messages rewritten, {cursor.failed} failed '
+              f'in {time.time() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
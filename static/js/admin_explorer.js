@@ -0,0 +1,104 @@
+// Admin data explorer: pages users, messages and files through /api/admin/*
+document.addEventListener('DOMContentLoaded', function() {
+  const PAGE_SIZE = 50;
+
+  function escapeHtml(value) {
+    return String(value === null || value === undefined ? '' : value)
+      .replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+      .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+  }
+
+  function cells(values) {
+    return '<tr>' + values.map(v => '<td>' + escapeHtml(v) + '</td>').join('') + '</tr>';
+  }
+
+  const tables = {
+    users: {
+      url: '/api/admin/users',
+      columns: 6,
+      row: u => cells([u.id, u.username, u.password_set ? 'Yes' : 'No', u.online, u.is_admin, u.created_by])
+    },
+    messages: {
+      url: '/api/admin/messages',
+      columns: 8,
+      row: m => cells([m.id, m.sender, m.recipients, m.content, m.timestamp, m.status, m.reply_to, m.reactions])
+    },
+    files: {
+      url: '/api/admin/files',
+      columns: 6,
+      row: f => '<tr><td>' + escapeHtml(f.id) + '</td><td><a href="' + escapeHtml(f.download_url) + '" target="_blank">' +
+        escapeHtml(f.filename) + '</a></td><td>' + escapeHtml(f.original_name) + '</td><td>' + escapeHtml(f.uploader) +
+        '</td><td>' + escapeHtml(f.timestamp) + '</td><td>' + escapeHtml(f.mimetype) + '</td></tr>'
+    }
+  };
+
+  // Per table: current filters and the page history (offsets for users, before_id cursors otherwise)
+  Object.keys(tables).forEach(function(name) {
+    const table = tables[name];
+    table.filters = {};
+    table.pages = [null];
+    table.next = null;
+    table.body = document.getElementById(name + '-body');
+    table.pager = document.getElementById(name + '-pager');
+    table.pager.querySelector('[data-page="prev"]').addEventListener('click', function() {
+      if (table.pages.length > 1) {
+        table.pages.pop();
+        load(name);
+      }
+    });
+    table.pager.querySelector('[data-page="next"]').addEventListener('click', function() {
+      if (table.next !== null) {
+        table.pages.push(table.next);
+        load(name);
+      }
+    });
+  });
+
+  document.querySelectorAll('.explorer-filters').forEach(function(form) {
+    form.addEventListener('submit', function(e) {
+      e.preventDefault();
+      const table = tables[form.dataset.table];
+      table.filters = {};
+      new FormData(form).forEach(function(value, key) {
+        if (value) table.filters[key] = value;
+      });
+      table.pages = [null];
+      load(form.dataset.table);
+    });
+  });
+
+  function load(name) {
+    const table = tables[name];
+    const params = new URLSearchParams(table.filters);
+    params.set('limit', PAGE_SIZE);
+    const page = table.pages[table.pages.length - 1];
+    if (page !== null) params.set(name === 'users' ? 'offset' : 'before_id', page);
+    table.body.innerHTML = '<tr><td colspan="' + table.columns + '" class="text-center text-muted">Loading...</td></tr>';
+    fetch(table.url + '?' + params.toString())
+      .then(res => res.json())
+      .then(function(data) {
+        if (data.error) throw new Error(data.error);
+        table.body.innerHTML = data.items.length
+          ? data.items.map(table.row).join('')
+          : '<tr><td colspan="' + table.columns + '" class="text-center text-muted">No results</td></tr>';
+        let info = 'Page ' + table.pages.length;
+        if (name === 'users') {
+          const offset = data.offset + data.items.length;
+          table.next = offset < data.total ? offset : null;
+          info += ' of ' + Math.max(1, Math.ceil(data.total / PAGE_SIZE)) + ' (' + data.total + ' users)';
+        } else {
+          table.next = data.next_before_id;
+          if (data.scanned !== undefined && table.filters.q) info += ' (' + data.scanned + ' messages searched)';
+        }
+        table.pager.querySelector('[data-page="info"]').textContent = info;
+        table.pager.querySelector('[data-page="prev"]').disabled = table.pages.length <= 1;
+        table.pager.querySelector('[data-page="next"]').disabled = table.next === null;
+      })
+      .catch(function(err) {
+        table.body.innerHTML = '<tr><td colspan="' + table.columns + '" class="text-center text-danger">' +
+          escapeHtml(err.message) + '</td></tr>';
+      });
+  }
+
+  Object.keys(tables).forEach(load);
+});
@@ -113,6 +113,24 @@ function getChatBody() {
   }
 }
 
+// Coalesce read receipts: remember the highest id seen per conversation and
+// acknowledge the whole range in one 'messages_read' event
+let pendingReadUpTo = {};
+let readFlushTimer = null;
+function queueReadReceipt(msg) {
+  const conversation = msg.recipients.startsWith('group-') ? msg.recipients : msg.sender;
+  pendingReadUpTo[conversation] = Math.max(pendingReadUpTo[conversation] || 0, msg.id);
+  if (readFlushTimer) return;
+  readFlushTimer = setTimeout(function() {
+    readFlushTimer = null;
+    const batch = pendingReadUpTo;
+    pendingReadUpTo = {};
+    Object.keys(batch).forEach(function(conversation) {
+      socket.emit('messages_read', {conversation: conversation, up_to: batch[conversation]});
+    });
+  }, 250);
+}
+
 function renderMessage(msg, isLatest = false) {
   // Handle system messages differently
   if (msg.sender === 'System' || msg.is_system) {
@@ -167,7 +185,7 @@ function renderMessage(msg, isLatest = false) {
     msgClass = 'theirs';
     // Mark as read if not already
     if (msg.status !== 'read') {
-      socket.emit('message_read', {msg_id: msg.id});
+      queueReadReceipt(msg);
     }
   }
   if (isLatest) msgClass += ' latest';
@@ -405,6 +423,49 @@ socket.on('hide_typing', function(data) {
   $('#typing-indicator').remove();
 });
 
+// --- Missed-event replay after reconnect ---
+// The server stamps chat events with a sequence number; on (re)connect we send the
+// last one we saw and get back only what we missed, or a request to resync fully.
+let lastEventSeq = null;
+let eventEpoch = null;
+
+socket.onAny(function(event, data) {
+  if (data && typeof data.seq === 'number' && (lastEventSeq === null || data.seq > lastEventSeq)) {
+    lastEventSeq = data.seq;
+  }
+});
+
+socket.on('connect', function() {
+  // Rooms do not survive a reconnect, so join them again before resuming
+  socket.emit('join', {room: USERNAME});
+  if (currentRecipients && currentRecipients.startsWith('group-')) {
+    socket.emit('join', {room: currentRecipients});
+  }
+  socket.emit('resume', {last_seq: lastEventSeq, epoch: eventEpoch});
+});
+
+socket.on('replay_events', function(data) {
+  eventEpoch = data.epoch;
+  (data.events || []).forEach(function(ev) {
+    socket.listeners(ev.event).forEach(function(handler) {
+      try { handler(ev.data); } catch (e) { console.error('Replay of', ev.event, 'failed:', e); }
+    });
+  });
+  lastEventSeq = data.seq;
+});
+
+socket.on('resync_required', function(data) {
+  eventEpoch = data.epoch;
+  lastEventSeq = data.seq;
+  // The gap is no longer buffered on the server: reload what is on screen
+  if (currentRecipients && currentRecipients.startsWith('group-')) {
+    loadGroupHistory(currentRecipients.split('-')[1]);
+  } else if (currentRecipients) {
+    loadHistory(currentRecipients);
+  }
+  fetchAndUpdateUnreadCounts();
+});
+
 $(function() {
   socket.emit('join', {room: USERNAME});
   $('#chat-body').html('<div class="text-center text-muted">Select a user or group to start chatting.</div>');
@@ -727,6 +788,18 @@ $(function() {
     }
   });
 
+  // Lightweight ping for group messages this user muted or only wants mentions for:
+  // keep ordering and badges current, but never raise a notification
+  socket.on('group_activity', function(data) {
+    try { updateConversationOrderForMessage(data); } catch (e) {}
+    if (currentRecipients === data.recipients) {
+      // The group is open, so fetch the full message to render it
+      $.get('/api/messages/' + data.id, function(msg) { renderMessage(msg); });
+    } else if (data.sender !== USERNAME) {
+      showGroupBadge(data.group_id, data.sender);
+    }
+  });
+
   // Handle new_message event (for system messages and real-time updates)
   socket.on('new_message', function(msg) {
     console.log('📨 New message received:', msg);
@@ -805,9 +878,20 @@ $(function() {
   });
 
   socket.on('message_read', function(data) {
+    const readTicks = "<i class='bi bi-check2-all' style='color:#2196f3;font-size:1.2em;'></i>";
+    if (data.up_to !== undefined) {
+      // Range acknowledgement: everything of ours up to this id in that conversation was read
+      if (currentRecipients !== data.conversation) return;
+      getChatBody().find('.message.mine').each(function() {
+        if (parseInt($(this).data('msg-id')) <= data.up_to) {
+          $(this).find('.msg-ticks').html(readTicks);
+        }
+      });
+      return;
+    }
     const msgId = data.msg_id;
     // Update all matching ticks in the DOM, even if chat is not open
-    $(".message[data-msg-id='" + msgId + "'] .msg-ticks").html("<i class='bi bi-check2-all' style='color:#2196f3;font-size:1.2em;'></i>");
+    $(".message[data-msg-id='" + msgId + "'] .msg-ticks").html(readTicks);
   });
 
   // 🔥 REAL-TIME: Handle message deletion (complete removal including date/time)
@@ -1867,6 +1951,16 @@ socket.on('group_admin_only_error', function(data) {
   setTimeout(function() { $('#admin-only-error').fadeOut(500, function() { $(this).remove(); }); }, 2500);
 });
 
+// Server dropped an event because this user exceeded its rate limit
+socket.on('rate_limited', function(data) {
+  // Typing/read events are best-effort; only surface drops the user can notice
+  if (!data || (data.event !== 'send_message' && data.event !== 'react_message')) return;
+  let errMsg = data.error || 'You are doing that too fast. Please slow down.';
+  $('#rate-limit-error').remove();
+  $("#message-form").prepend(`<div id='rate-limit-error' class='alert alert-warning py-1 mb-2'>${errMsg}</div>`);
+  setTimeout(function() { $('#rate-limit-error').fadeOut(500, function() { $(this).remove(); }); }, 2500);
+});
+
 function syncMobileSidebar() {
   // Copy user list
   $('#mobile-user-list').html($('#user-list').html());
@@ -2248,6 +2342,15 @@ $(document).on('click', '#clear-group-chat-btn', function() {
     }
   });
 });
+// Export buttons: the server streams a zip (messages.jsonl + files/), so a plain navigation downloads it
+$(document).on('click', '#export-chat-btn', function() {
+  if (!currentRecipients || currentRecipients.startsWith('group-')) return;
+  window.location = '/export?user=' + encodeURIComponent(currentRecipients);
+});
+$(document).on('click', '#export-group-chat-btn', function() {
+  if (!currentGroupId) return;
+  window.location = '/export?group_id=' + encodeURIComponent(currentGroupId);
+});
 // --- Suggestions for further improvements ---
 // 1. Add search/filter in chat/group lists
 // 2. Show last seen/online status in chat info
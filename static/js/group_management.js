@@ -517,12 +517,12 @@ function openAddMemberModal() {
     });
 }
 
-// Add member to group
+// Add the selected users to the group in one bulk request
 function addMemberToGroup() {
-    const username = $('#add-member-select').val();
+    const usernames = $('#add-member-select').val() || [];
     const isAdmin = $('#add-as-admin-checkbox').is(':checked');
     
-    if (!username || !currentGroupId) {
+    if (!usernames.length || !currentGroupId) {
         return;
     }
     
@@ -531,14 +531,13 @@ function addMemberToGroup() {
     const originalText = $btn.text();
     $btn.html('<i class="bi bi-hourglass-split"></i> Adding...').prop('disabled', true);
     
-    // Call API to add member
+    // Call API to add members
     $.ajax({
-        url: `/api/groups/${currentGroupId}/add_member`,
+        url: `/api/groups/${currentGroupId}/members/bulk`,
         type: 'POST',
         contentType: 'application/json',
         data: JSON.stringify({ 
-            username: username,
-            is_admin: isAdmin
+            add: usernames.map(username => ({ username: username, role: isAdmin ? 'admin' : 'member' }))
         }),
         success: function(response) {
             if (response.success) {
@@ -549,23 +548,20 @@ function addMemberToGroup() {
                 loadGroupInfo(currentGroupId);
                 
                 // Show success message
+                const who = usernames.length === 1 ? usernames[0] : `${usernames.length} users`;
                 showPopup({
-                    title: 'Member Added',
-                    message: `${username} has been added to the group${isAdmin ? ' as an admin' : ''}.`,
+                    title: usernames.length === 1 ? 'Member Added' : 'Members Added',
+                    message: `${who} ${usernames.length === 1 ? 'has' : 'have'} been added to the group${isAdmin ? ' as admins' : ''}.`,
                     icon: 'success'
                 });
-            } else {
-                showPopup({
-                    title: 'Error',
-                    message: response.error || 'Failed to add member to group.',
-                    icon: 'error'
-                });
             }
         },
-        error: function() {
+        error: function(xhr) {
+            const resp = xhr.responseJSON || {};
+            const details = resp.invalid ? Object.entries(resp.invalid).map(([u, reason]) => `${u}: ${reason}`).join(', ') : '';
             showPopup({
                 title: 'Error',
-                message: 'Failed to add member to group. Please try again.',
+                message: (resp.error || 'Failed to add members to group. Please try again.') + (details ? ` (${details})` : ''),
                 icon: 'error'
             });
         },
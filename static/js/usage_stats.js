@@ -0,0 +1,69 @@
+// Admin usage charts: plain SVG bar charts over /api/admin/stats (DailyStat rollups)
+document.addEventListener('DOMContentLoaded', function() {
+  const section = document.getElementById('usage-section');
+  if (!section || !section.classList.contains('active')) return;
+  const daysSelect = document.getElementById('usage-days');
+
+  function escapeHtml(value) {
+    return String(value === null || value === undefined ? '' : value)
+      .replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+      .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+  }
+
+  function formatBytes(bytes) {
+    const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+    let i = 0;
+    while (bytes >= 1024 && i < units.length - 1) {
+      bytes /= 1024;
+      i++;
+    }
+    return (i ? bytes.toFixed(1) : bytes) + ' ' + units[i];
+  }
+
+  function barChart(el, days, field, format) {
+    const width = 600, height = 160, gap = 1;
+    const values = days.map(d => d[field]);
+    const max = Math.max(1, ...values);
+    const barWidth = width / values.length;
+    const bars = values.map(function(value, i) {
+      const h = Math.round(value / max * (height - 20));
+      return '<rect x="' + (i * barWidth) + '" y="' + (height - h) + '" width="' + Math.max(1, barWidth - gap) +
+        '" height="' + h + '" fill="#0d6efd"><title>' + escapeHtml(days[i].day + ': ' + format(value)) + '</title></rect>';
+    }).join('');
+    el.innerHTML = '<svg viewBox="0 0 ' + width + ' ' + height + '" preserveAspectRatio="none" style="width:100%;height:' +
+      height + 'px">' + bars + '</svg><div class="d-flex justify-content-between small text-muted"><span>' +
+      escapeHtml(days[0].day) + '</span><span>max ' + escapeHtml(format(max)) + '</span><span>' +
+      escapeHtml(days[days.length - 1].day) + '</span></div>';
+  }
+
+  function list(el, rows, label, value) {
+    el.innerHTML = rows.length
+      ? '<table class="table table-sm mb-0">' + rows.map(r => '<tr><td>' + escapeHtml(label(r)) +
+          '</td><td class="text-end">' + escapeHtml(value(r)) + '</td></tr>').join('') + '</table>'
+      : '<span class="text-muted">No activity</span>';
+  }
+
+  function load() {
+    fetch('/api/admin/stats?days=' + daysSelect.value)
+      .then(res => res.json())
+      .then(function(data) {
+        if (data.error) throw new Error(data.error);
+        section.querySelectorAll('[data-chart]').forEach(function(el) {
+          const field = el.dataset.chart;
+          barChart(el, data.days, field, field === 'storage_bytes' ? formatBytes : String);
+        });
+        list(document.getElementById('usage-top-users'), data.top_users, r => r.username, r => r.messages);
+        list(document.getElementById('usage-top-groups'), data.top_groups, r => r.name, r => r.messages);
+        list(document.getElementById('usage-file-types'), data.file_types, r => r.type,
+          r => r.files + ' (' + formatBytes(r.bytes) + ')');
+      })
+      .catch(function(err) {
+        section.querySelectorAll('[data-chart]').forEach(function(el) {
+          el.innerHTML = '<span class="text-danger">' + escapeHtml(err.message) + '</span>';
+        });
+      });
+  }
+
+  daysSelect.addEventListener('change', load);
+  load();
+});
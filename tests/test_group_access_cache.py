@@ -0,0 +1,79 @@
+"""Permission changes must reach the cached group access (see get_group_access) at once."""
+import pytest
+
+import app as chat
+
+
+@pytest.fixture(scope='module')
+def lanchat(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('lanchat')
+    flask_app = chat.create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp / "chat.db"}',
+        'SOCKETIO_ASYNC_MODE': 'threading',
+        'KEY_FILE': str(tmp / 'chat.key'),
+        'KEYRING_FILE': str(tmp / 'chat.keyring'),
+        'ARCHIVE_FOLDER': str(tmp / 'archive'),
+        'TESTING': True,
+    })
+    with flask_app.app_context():
+        chat.db.create_all()
+        for username in ('owner', 'member'):
+            chat.db.session.add(chat.User(username=username, password=''))
+        chat.db.session.commit()
+    yield flask_app
+    with flask_app.app_context():
+        chat.db.engine.dispose()
+
+
+def login(flask_app, username):
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess['username'] = username
+    return client
+
+
+@pytest.fixture
+def group(lanchat):
+    """An admin_only group of owner (admin) and member, with one message to pin; yields (group_id, message_id)."""
+    owner = login(lanchat, 'owner')
+    group_id = owner.post('/api/groups', json={'name': 'g', 'members': ['owner', 'member']}).get_json()['group_id']
+    assert owner.post(f'/api/groups/{group_id}/admin_only', json={'admin_only': True}).status_code == 200
+    with lanchat.app_context():
+        msg = chat.Message(sender='owner', recipients=f'group-{group_id}', content=chat.encrypt_message('hi'),
+                           group_id=group_id)
+        chat.db.session.add(msg)
+        chat.db.session.commit()
+        message_id = msg.id
+    assert owner.post(f'/api/groups/{group_id}/pin_message', json={'message_id': message_id}).status_code == 200
+    return group_id, message_id
+
+
+def test_permission_changes_take_effect_immediately(lanchat, group):
+    group_id, _ = group
+    owner = login(lanchat, 'owner')
+    member = login(lanchat, 'member')
+    socket = chat.socketio.test_client(lanchat, flask_test_client=member)
+    socket.emit('join', {'room': 'member'})
+    base = f'/api/groups/{group_id}'
+
+    def send():
+        socket.get_received()
+        socket.emit('send_message', {'recipients': f'group-{group_id}', 'content': 'hello'})
+        return [event['name'] for event in socket.get_received()]
+
+    # Warm the cache so every later check would see a stale entry if invalidation were missing
+    assert send() == ['group_admin_only_error']
+
+    assert owner.post(f'{base}/set_admin', json={'username': 'member', 'is_admin': True}).status_code == 200
+    assert 'group_admin_only_error' not in send()
+
+    assert owner.post(f'{base}/set_role', json={'username': 'member', 'role': 'member'}).status_code == 200
+    assert send() == ['group_admin_only_error']
+
+    assert member.get(f'{base}/pinned_messages').status_code == 200
+    assert owner.post(f'{base}/remove_member', json={'username': 'member'}).status_code == 200
+    assert member.get(f'{base}/pinned_messages').status_code == 403
+
+    assert owner.post(f'{base}/members/bulk', json={'add': ['member']}).status_code == 200
+    assert member.get(f'{base}/pinned_messages').status_code == 200
+    socket.disconnect()
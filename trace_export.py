@@ -0,0 +1,97 @@
+"""Convert LAN Chat trace JSON lines into a file a trace viewer can open.
+
+app.py appends sampled traces to TRACE_FILE (LANCHAT_TRACE_FILE, default
+traces.jsonl) when LANCHAT_TRACE_SAMPLE_RATE is above 0. This script bundles
+those spans into the Chrome trace-event JSON format, which Perfetto
+(ui.perfetto.dev) and chrome://tracing load directly:
+
+    LANCHAT_TRACE_SAMPLE_RATE=0.1 python app.py
+    python trace_export.py traces.jsonl --slowest 20 --output trace.json
+    python trace_export.py traces.jsonl --summary
+
+--summary prints total and mean time per span name instead of writing a file.
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+
+def load_traces(path):
+    """Group span events by trace_id; returns {trace_id: [events]}."""
+    traces = defaultdict(list)
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                span = json.loads(line)
+            except ValueError:
+                print(f'skipping malformed line {line_no}', file=sys.stderr)
+                continue
+            traces[span.get('args', {}).get('trace_id')].append(span)
+    return traces
+
+
+def root_span(events):
+    """The request/event span that encloses the rest of the trace."""
+    roots = [e for e in events if e.get('cat') == 'request']
+    return max(roots or events, key=lambda e: e['dur'])
+
+
+def select(traces, name=None, min_ms=0.0, slowest=None):
+    chosen = []
+    for trace_id, events in traces.items():
+        root = root_span(events)
+        if name and name not in root['name']:
+            continue
+        if root['dur'] < min_ms * 1000:
+            continue
+        chosen.append((root['dur'], trace_id))
+    chosen.sort(reverse=True)
+    if slowest:
+        chosen = chosen[:slowest]
+    return [trace_id for _, trace_id in chosen]
+
+
+def summarize_spans(traces, trace_ids):
+    totals = defaultdict(lambda: [0, 0.0, 0.0])  # name -> [count, total us, max us]
+    for trace_id in trace_ids:
+        for e in traces[trace_id]:
+            t = totals[e['name']]
+            t[0] += 1
+            t[1] += e['dur']
+            t[2] = max(t[2], e['dur'])
+    rows = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+    print(f'{"span":<48} {"count":>7} {"total ms":>10} {"mean ms":>9} {"max ms":>9}')
+    for name, (count, total, peak) in rows:
+        print(f'{name[:48]:<48} {count:>7} {total / 1000:>10.2f} {total / count / 1000:>9.3f} {peak / 1000:>9.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace_file', nargs='?', default='traces.jsonl', help='JSON lines written by app.py')
+    parser.add_argument('--output', default='trace.json', help='Chrome trace-event file to write')
+    parser.add_argument('--name', help='only traces whose root span name contains this, e.g. send_message')
+    parser.add_argument('--min-ms', type=float, default=0.0, help='only traces at least this long')
+    parser.add_argument('--slowest', type=int, help='keep only the N slowest matching traces')
+    parser.add_argument('--summary', action='store_true', help='print per-span timing totals instead')
+    args = parser.parse_args()
+
+    traces = load_traces(args.trace_file)
+    trace_ids = select(traces, args.name, args.min_ms, args.slowest)
+    if args.summary:
+        summarize_spans(traces, trace_ids)
+        return
+    events = []
+    for trace_id in trace_ids:
+        events.extend(traces[trace_id])
+    events.sort(key=lambda e: (e['tid'], e['ts'], -e['dur']))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    print(f'Wrote {len(trace_ids)} traces ({len(events)} spans) to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
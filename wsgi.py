@@ -0,0 +1,18 @@
+"""Production entry point for LAN Chat.
+
+Unlike `python app.py` this runs without the debugger and reloader and on a
+fixed port:
+
+    python wsgi.py                        # LANCHAT_HOST / LANCHAT_PORT, default 0.0.0.0:5000
+    gunicorn -k eventlet -w 1 wsgi:app    # one worker: rooms, caches and replay buffers are in-process
+"""
+import os
+
+from app import create_app, init_db, socketio
+
+app = create_app()
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+init_db()
+
+if __name__ == '__main__':
+    socketio.run(app, host=os.environ.get('LANCHAT_HOST', '0.0.0.0'), port=int(os.environ.get('LANCHAT_PORT', 5000)))